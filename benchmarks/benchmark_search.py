@@ -0,0 +1,218 @@
+# Copyright (c) 2021-2022 Alibaba Group Holding Limited.
+
+import os,sys
+import json
+import time
+import shutil
+import statistics
+import platform
+import argparse
+import tempfile
+import subprocess
+import torch
+from tabulate import tabulate
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "nas"))
+
+from nas.evolutions import load_population
+
+__repo_dir__ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# the cfg_options of all the cases, cpu only with the madnas score and the single mode
+__common_options__ = ["only_master=False", "log_level=INFO", "ea_dist_mode=single", "score_type=madnas",
+                      "lat_gpu=False", "lat_pred=False", "budget_latency=None", "budget_model_size=None",
+                      "ea_popu_size=64", "ea_metrics=True"]
+
+# the shipped init structures, with the budgets a bit above them and the scores of their search scripts
+__benchmark_cases__ = {
+    "R50-like": ["space_structure_txt=scripts/classification/models/R50-like.txt", "space_mutation=space_K1KXK1",
+                 "task=classification", "space_classfication=True", "budget_image_size=224",
+                 "budget_flops=41e8", "budget_layers=90"],
+    "maedet_s": ["space_structure_txt=scripts/detection/models/maedet_s.txt", "space_mutation=space_K1KXK1",
+                 "task=detection", "space_classfication=False", "budget_image_size=480",
+                 "budget_flops=12e9", "budget_layers=91", "score_multi_ratio=[0,0,1,1,6]"],
+    "mixed7d0G": ["space_structure_txt=scripts/quant/models/mixed7d0G.txt", "space_mutation=space_quant_k1dwk1",
+                  "task=classification", "space_classfication=True", "budget_image_size=224",
+                  "budget_flops=109e6", "budget_layers=47", "score_image_size=224", "score_multi_ratio=[0,0,1,1,6]",
+                  "score_quant_search=True", "score_init_std=4", "score_init_std_act=5", "space_block_num=2"],
+}
+# the candidates built on the meta device without the weights, for the budgets and the madnas score
+__benchmark_cases__["R50-like_meta"] = __benchmark_cases__["R50-like"] + ["score_meta_device=True"]
+
+# the metrics checked against the baseline, and whether the larger is better. The phases are only reported,
+# they are too short to be compared on a shared machine
+__checked_metrics__ = {"evals_per_s": True, "peak_rss_mb": False, "best_score": True}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Run the fixed-seed cpu searches on the shipped init structures, '
+                                     'and compare the throughput, the memory and the best score with the baseline')
+    parser.add_argument('--cases', type=str, default=",".join(__benchmark_cases__.keys()),
+                        help='comma separated cases of %s'%(list(__benchmark_cases__.keys())))
+    parser.add_argument('--num_nets', type=int, default=200, help='the evaluated nets of each search')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5, help='run each search this number of times, and keep the median '
+                        'throughput and phase times and the min memory, against the noise of a shared machine')
+    parser.add_argument('--num_threads', type=int, default=1, help='OMP_NUM_THREADS of the searches')
+    parser.add_argument('--baseline', type=str, default=os.path.join(__repo_dir__, 'benchmarks/baseline.json'))
+    parser.add_argument('--update_baseline', action='store_true', help='save the results as the new baseline')
+    parser.add_argument('--throughput_threshold', type=float, default=None,
+                        help='the relative regression of the median evals_per_s to fail, None for the larger spread of '
+                        'the repeats of the baseline and the current run, and at least --min_throughput_threshold')
+    parser.add_argument('--min_throughput_threshold', type=float, default=0.15)
+    parser.add_argument('--phase_threshold', type=float, default=0.4,
+                        help='the relative regression of the median ms per net of a phase to report as slower, '
+                        'which does not fail')
+    parser.add_argument('--rss_threshold', type=float, default=0.1, help='the relative regression of peak_rss_mb to fail')
+    parser.add_argument('--score_threshold', type=float, default=1e-3,
+                        help='the relative regression of best_score to fail, the searches are deterministic')
+    parser.add_argument('--min_phase_ms', type=float, default=1.0,
+                        help='only check the phases taking at least this time per net in the baseline')
+    parser.add_argument('--work_dir', type=str, default=None, help='keep the searches here, a temporary dir if None')
+    parser.add_argument('--output', type=str, default=None, help='save the results as json')
+    args = parser.parse_args()
+    return args
+
+
+def get_host_info():
+    # the host of the results, the timings and the memory are only comparable on the same one
+    cpu = platform.processor()
+    if os.path.isfile('/proc/cpuinfo'):
+        with open('/proc/cpuinfo', 'r') as fid:
+            cpu = next((line.split(':', 1)[1].strip() for line in fid if line.startswith('model name')), cpu)
+    return {"cpu": cpu, "num_cpus": os.cpu_count(), "python": platform.python_version(), "torch": torch.__version__}
+
+
+def run_case(case, work_dir, args):
+    """Run the search of the case in a subprocess, and get its results from the metrics and the final population.
+
+    The peak RSS is the max resident set size of the search process, by wait4.
+    """
+    if os.path.isdir(work_dir): shutil.rmtree(work_dir)
+    os.makedirs(work_dir)
+    cmd = [sys.executable, os.path.join(__repo_dir__, 'nas/search.py'), os.path.join(__repo_dir__, 'configs/config_nas.py'),
+           '--work_dir', work_dir, '--seed', str(args.seed), '--cfg_options'] + __common_options__ + \
+          __benchmark_cases__[case] + ['ea_num_random_nets=%d'%(args.num_nets), 'ea_log_freq=%d'%(max(1, args.num_nets//4))]
+    env = dict(os.environ, OMP_NUM_THREADS=str(args.num_threads), MKL_NUM_THREADS=str(args.num_threads))
+
+    start_timer = time.time()
+    with open(os.path.join(work_dir, 'benchmark.log'), 'w') as fid:
+        proc = subprocess.Popen(cmd, cwd=__repo_dir__, env=env, stdout=fid, stderr=subprocess.STDOUT)
+        _, status, rusage = os.wait4(proc.pid, 0)
+    wall_time = time.time() - start_timer
+    if os.waitstatus_to_exitcode(status) != 0:
+        raise RuntimeError('the search of %s failed, see %s'%(case, os.path.join(work_dir, 'benchmark.log')))
+
+    with open(os.path.join(work_dir, 'metrics.jsonl'), 'r') as fid:
+        summary = json.loads(fid.readlines()[-1])["summary"]
+    final_population = load_population(os.path.join(work_dir, 'nas_cache/iter_final.npz'))
+    # ru_maxrss is in KB on linux
+    return {"num_nets": args.num_nets, "seed": args.seed, "wall_time": wall_time,
+            "evals_per_s": summary["evals_per_s"], "peak_rss_mb": rusage.ru_maxrss/1024,
+            "best_score": float(max(final_population["popu_acc_list"])), "ms_per_eval": summary["ms_per_eval"]}
+
+
+def merge_repeats(result_list):
+    # the median of the timings of the repeats, the best score is the same with the fixed seed
+    result = dict(result_list[0])
+    result["wall_time"] = min([x["wall_time"] for x in result_list])
+    evals_per_s_list = [x["evals_per_s"] for x in result_list]
+    result["evals_per_s"] = statistics.median(evals_per_s_list)
+    # the run-to-run spread of the throughput, the tolerance of the median of the next runs
+    result["evals_per_s_spread"] = (max(evals_per_s_list) - min(evals_per_s_list))/result["evals_per_s"]
+    result["evals_per_s_list"] = evals_per_s_list
+    result["peak_rss_mb"] = min([x["peak_rss_mb"] for x in result_list])
+    result["ms_per_eval"] = {phase: statistics.median([x["ms_per_eval"].get(phase, value) for x in result_list])
+                             for phase, value in result["ms_per_eval"].items()}
+    return result
+
+
+def get_throughput_threshold(result, baseline, args):
+    if args.throughput_threshold is not None:
+        return args.throughput_threshold
+    # the load of a shared machine changes between the sessions, which the spread of either run measures
+    return max(args.min_throughput_threshold, baseline.get("evals_per_s_spread", 0.0), result["evals_per_s_spread"])
+
+
+def compare_case(result, baseline, args):
+    """Get the rows of the metrics and the phases of the case compared with its baseline, and whether any
+    of the metrics regresses past its threshold. The phases past --phase_threshold are slower, which does
+    not fail."""
+    thresholds = {"evals_per_s": get_throughput_threshold(result, baseline, args), "peak_rss_mb": args.rss_threshold,
+                  "best_score": args.score_threshold}
+    rows, is_regression = [], False
+    metric_list = [(key, result[key], baseline[key], is_larger_better, thresholds[key], True)
+                   for key, is_larger_better in __checked_metrics__.items()]
+    metric_list += [("%s_ms"%(phase), value, baseline["ms_per_eval"][phase], False, args.phase_threshold, False)
+                    for phase, value in result["ms_per_eval"].items()
+                    if baseline["ms_per_eval"].get(phase, 0.0) >= args.min_phase_ms]
+    for key, value, baseline_value, is_larger_better, threshold, is_checked in metric_list:
+        change = (value - baseline_value)/max(1e-10, abs(baseline_value))
+        regression = -change if is_larger_better else change
+        status = "ok"
+        if regression > threshold:
+            status = "FAIL" if is_checked else "slower"
+        is_regression = is_regression or status == "FAIL"
+        rows.append([key, "%.4g"%(baseline_value), "%.4g"%(value), "%+.1f%%"%(100*change), "%.1f%%"%(100*threshold), status])
+    return rows, is_regression
+
+
+def main():
+    args = parse_args()
+    case_list = args.cases.split(",")
+    for case in case_list:
+        if case not in __benchmark_cases__:
+            raise ValueError("unknown case %s, not in %s"%(case, list(__benchmark_cases__.keys())))
+    work_dir = args.work_dir if args.work_dir is not None else tempfile.mkdtemp(prefix='benchmark_search_')
+
+    host_info = get_host_info()
+    results = {}
+    for case in case_list:
+        results[case] = merge_repeats([run_case(case, os.path.join(work_dir, case), args) for _ in range(args.repeat)])
+        results[case]["host"] = host_info
+        print("%s done in %.1fs, median %.3g evals/s (spread %.1f%% over %d runs), peak rss %.0f MB, best score %.6g"%(
+              case, results[case]["wall_time"], results[case]["evals_per_s"], 100*results[case]["evals_per_s_spread"],
+              args.repeat, results[case]["peak_rss_mb"], results[case]["best_score"]))
+    if args.work_dir is None: shutil.rmtree(work_dir)
+    if args.output is not None:
+        with open(args.output, 'w') as fid:
+            json.dump(results, fid, indent=2)
+
+    baseline = {}
+    if os.path.isfile(args.baseline):
+        with open(args.baseline, 'r') as fid:
+            baseline = json.load(fid)
+    if args.update_baseline:
+        baseline.update(results)
+        with open(args.baseline, 'w') as fid:
+            json.dump(baseline, fid, indent=2)
+        print('update the baseline: %s'%(args.baseline))
+        return
+
+    headers = ["case", "metric", "baseline", "current", "change", "threshold", "status"]
+    table, failed_case_list = [], []
+    for case, result in results.items():
+        if case not in baseline:
+            print('no baseline of %s, skip the comparison'%(case))
+            continue
+        if (baseline[case]["num_nets"], baseline[case]["seed"]) != (result["num_nets"], result["seed"]):
+            raise ValueError("the baseline of %s is with num_nets=%d and seed=%d"%(case, baseline[case]["num_nets"],
+                             baseline[case]["seed"]))
+        if baseline[case].get("host") != result["host"]:
+            print('the baseline of %s is from another host %s, the timings and the memory are not comparable'%(
+                  case, baseline[case].get("host")))
+        rows, is_regression = compare_case(result, baseline[case], args)
+        table += [[case] + row for row in rows]
+        if is_regression: failed_case_list.append(case)
+    print(tabulate(table, headers=headers, disable_numparse=True))
+    if any([row[-1] == "slower" for row in table]):
+        print('the slower phases are past --phase_threshold, only advisory')
+    if len(failed_case_list) > 0:
+        print('regression past the threshold in %s'%(failed_case_list))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,7 @@
 # Copyright (c) 2021-2022 Alibaba Group Holding Limited.
 
 import os,sys
-import random
+import random, ast
 import logging
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
@@ -30,9 +30,11 @@ class Config(BaseConfig):
         self.budget_stages = 5 # Downsample
         # Specific for mcunet
         self.budget_mcu_max_feature = None 
+        self.budget_mcu_arena = None # the bytes of the feature arena planned by the tensor lifetimes
 
         """ Score config """
-        self.score_type = "entropy" # madnas, entropy 
+        self.score_type = "entropy" # madnas, entropy, or a list of proxies in ["entropy", "naswot", "synflow"]
+        self.score_proxy_ratio = None # weight of each proxy when score_type is a list, None for all 1
         self.score_batch_size = 32 # no need for madnas
         # 224 for Imagenet, 480 for detection, 160 for mcu
         self.score_image_size = 224 
@@ -40,6 +42,7 @@ class Config(BaseConfig):
         self.align_budget_layers = False # reserved
         # score params for entropy score
         self.score_no_creat = False # False
+        self.score_meta_device = False # build the candidates on the meta device, no weight memory for madnas and the budgets
         self.score_repeat = 4 # no need for madnas
         self.score_skip_relu = True # no relu in forward
         self.score_skip_bn = True # no bn in forward
@@ -50,6 +53,8 @@ class Config(BaseConfig):
         self.score_init_std_act = 1 # quant initialization std for activation
         # Score params for adding other constraits to the ACC
         self.score_flop_ratio = None # Acc = score + ration*flops/1e6
+        # Share the scores between searches with the same score config
+        self.score_store_dir = None # the shared dir of the score store, None is disabled
 
         """ Latency config """
         self.lat_gpu = False # whether to mearsure the latency with gpu
@@ -69,6 +74,7 @@ class Config(BaseConfig):
         self.space_block_module = None # extra block not defined in models
         self.space_minor_mutation = False # whether fix the stage layer
         self.space_minor_iter = 100000 # which iteration to enable minor_mutation
+        self.space_feasible_sampler = False # sample the mutation from the feasible choices of the blocks
         self.space_dropout_channel = None # reserved
         self.space_dropout_layer = None # reserved
         self.space_structure_str = None # reserved
@@ -79,7 +85,29 @@ class Config(BaseConfig):
         self.ea_log_freq = 1000 # the interval for show results
         self.ea_num_random_nets = 100000 # the searching iterations
         self.ea_sync_size_ratio = 1.0 # control each thread sync number: ratio * popu_size
+        self.ea_master_iter = 1 # nets evaluated by the master between serving the workers, 0 to only serve them
+        self.ea_steady_state = False # rank 0 serves the population, each worker fetches one parent and pushes one child at a time
+        self.ea_selection = "random" # the parent selection: random or tournament
+        self.ea_tournament_size = 8 # the individuals sampled for a tournament
+        self.ea_survivor = "best" # the survivors: best (top ea_popu_size), aging (the youngest and the best one) or crowding
+        self.ea_crowding_distance = 2 # the crowding survivors differ from the better ones in this number of genome values
+        self.ea_crossover_ratio = 0.0 # the ratio of the children by the stage-wise crossover of two parents, the others are mutated
+        self.ea_offspring_batch = 1 # the children generated at once by mutate_batch of the space, 1 for mutate_function
+        self.ea_multi_objective = None # the metrics minimized with the maximized acc by the NSGA-II survivors, e.g. ["flops"]
+        self.ea_pareto_budgets = None # the best structures of the Pareto front under the budgets, e.g. {"flops": [1e9, 2e9]}, or [(flops,1e9,2e9)] in cfg_options
+        self.ea_surrogate = False # skip the evaluation of the mutants which the surrogate predicts below the worst acc of the population
+        self.ea_surrogate_data = [] # the glob patterns of the evaluation logs of the previous searches to warm start the surrogate
+        self.ea_surrogate_retrain = 2000 # retrain the surrogate every this number of evaluated nets
+        self.ea_surrogate_max_samples = 200000 # train with the latest evaluated nets
+        self.ea_surrogate_holdout = 0.2 # the ratio of the latest nets to measure the error of the surrogate
+        self.ea_surrogate_alpha = 0.1 # the ridge regularization
+        self.ea_surrogate_margin = 2.0 # screen the mutants predicted below the worst acc by this number of the error
+        self.ea_surrogate_audit = 0.1 # the ratio of the screened mutants still evaluated, to count the wrong screenings
+        self.ea_metrics = False # append the phase timers and the candidate counters of all the ranks to work_dir/metrics.jsonl at each export
+        self.ea_metrics_prometheus = None # also write them in the Prometheus text format to this file in work_dir, e.g. "metrics.prom"
         self.ea_load_population = None # whether load searched population
+        self.ea_packed_genome = True # send the structures between the ranks as the packed integer genomes
+        self.ea_checkpoint_format = "npz" # npz snapshot and the append-only log of the evaluated nets, or txt
 
         """ check the valid of config """
         # self.config_check()
@@ -106,11 +134,45 @@ class Config(BaseConfig):
             if self.budget_image_size > 480:
                 raise ValueError("Budget_image_size must be less than 480 when using latency prediction, not %d"%(self.budget_image_size))
         
+        # a list of proxies may be merged from cfg_options as its string
+        if isinstance(self.score_type, str) and self.score_type.startswith("["):
+            self.score_type = ast.literal_eval(self.score_type)
         if len(self.score_multi_ratio)!=self.budget_stages:
             raise ValueError("The length of score_multi_ratio must be equal to budget_stages, please check that")
         if self.budget_model_size=="None": self.budget_model_size = None # the number of parameters
         if self.budget_flops=="None": self.budget_flops = None # the FLOPs similar to thop
         if self.budget_latency=="None": self.budget_latency = None # the unit is second
+        if self.budget_mcu_arena=="None": self.budget_mcu_arena = None
+        if self.ea_selection not in ["random", "tournament"]:
+            raise ValueError("Supported ea_selection is random or tournament, not %s"%(self.ea_selection))
+        if self.ea_survivor not in ["best", "aging", "crowding"]:
+            raise ValueError("Supported ea_survivor is best, aging or crowding, not %s"%(self.ea_survivor))
+        if not 0 <= self.ea_crossover_ratio <= 1:
+            raise ValueError("ea_crossover_ratio must be in [0, 1], not %s"%(self.ea_crossover_ratio))
+        if self.space_feasible_sampler and (self.ea_crossover_ratio > 0 or self.ea_offspring_batch > 1):
+            raise ValueError("the offspring of ea_crossover_ratio and ea_offspring_batch are mutated by mutate_batch, not space_feasible_sampler")
+        # the list may be merged from cfg_options as its string
+        if isinstance(self.ea_multi_objective, str):
+            self.ea_multi_objective = ast.literal_eval(self.ea_multi_objective) if self.ea_multi_objective != "None" else None
+        if self.ea_pareto_budgets == "None": self.ea_pareto_budgets = None
+        if isinstance(self.ea_pareto_budgets, (list, tuple)):
+            # [(key, budget, ...), ...] from cfg_options, which can't parse a dict
+            self.ea_pareto_budgets = {x[0]: list(x[1:]) for x in self.ea_pareto_budgets}
+        if self.ea_metrics_prometheus == "None": self.ea_metrics_prometheus = None
+        if isinstance(self.ea_surrogate_data, str):
+            self.ea_surrogate_data = [self.ea_surrogate_data]
+        if self.ea_surrogate and (self.ea_survivor != "best" or self.ea_multi_objective is not None):
+            raise ValueError("ea_surrogate screens the mutants by the worst acc, only with ea_survivor=best and no ea_multi_objective")
+        if self.ea_surrogate and not 0 < self.ea_surrogate_audit <= 1:
+            # the audited mutants are evaluated, so the search goes on when the surrogate screens all the mutants
+            raise ValueError("ea_surrogate_audit must be in (0, 1], not %s"%(self.ea_surrogate_audit))
+        if self.ea_multi_objective is not None:
+            valid_objectives = ["params", "flops", "latency"]
+            if self.budget_mcu_max_feature is not None: valid_objectives.append("max_feature")
+            if self.budget_mcu_arena is not None: valid_objectives.append("arena")
+            for key in list(self.ea_multi_objective) + list((self.ea_pareto_budgets or {}).keys()):
+                if key not in valid_objectives:
+                    raise ValueError("The objective must be in %s, not %s"%(valid_objectives, key))
 
 
 if __name__ == '__main__':
@@ -147,9 +147,10 @@ def robust_save(filename, save_function):
     mkfilepath(filename)
     backup_filename = filename + '.robust_save_temp'
     save_function(backup_filename)
-    if os.path.isfile(filename):
-        os.remove(filename)
-    os.rename(backup_filename, filename)
+    with open(backup_filename, 'rb+') as fid:
+        os.fsync(fid.fileno())
+    # atomic on the same file system, the file is either the old one or the new one after a crash
+    os.replace(backup_filename, filename)
 
 
 def save_pyobj(filename, pyobj):
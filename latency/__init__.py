@@ -1,2 +1,4 @@
 from .benchmark_gpu import GetRobustLatencyMeanStd
-from .op_profiler import OpProfiler
\ No newline at end of file
+from .op_profiler import OpProfiler
+from .benchmark_cpu import GetRobustLatencyMeanStdCPU
+from .block_profiler import BlockProfiler
@@ -0,0 +1,60 @@
+# Copyright (c) 2021-2022 Alibaba Group Holding Limited.
+
+import os,sys
+import numpy as np
+import torch, time
+
+
+def __get_cpu_latency__(model, the_image, benchmark_repeat_times):
+    warmup_T = 3
+    with torch.no_grad():
+        for i in range(warmup_T):
+            the_output = model(the_image)
+        start_timer = time.time()
+        for repeat_count in range(benchmark_repeat_times):
+            the_output = model(the_image)
+
+    end_timer = time.time()
+    the_latency = (end_timer - start_timer) / float(benchmark_repeat_times) / the_image.shape[0]
+    return the_latency
+
+
+class GetRobustLatencyMeanStdCPU():
+    def __init__(self, batch_size, resolution, channel=3, num_threads=None, benchmark_repeat_times=10,
+                 robust_repeat_times=5):
+        self.batch_size = batch_size
+        self.resolution = resolution
+        self.channel = channel
+        self.num_threads = num_threads
+        self.benchmark_repeat_times = benchmark_repeat_times
+        self.robust_repeat_times = robust_repeat_times
+
+
+    def get_image(self, memory_format=torch.contiguous_format):
+        if type(self.resolution)==list and len(self.resolution)==2:
+            the_image = torch.randn(self.batch_size, self.channel, self.resolution[0], self.resolution[1])
+        else:
+            the_image = torch.randn(self.batch_size, self.channel, self.resolution, self.resolution)
+        return the_image.contiguous(memory_format=memory_format)
+
+
+    def __call__(self, model, memory_format=torch.contiguous_format):
+        """Get the latency per image of the model on cpu, the unit is second.
+
+        :return: avg_latency, std_latency over the middle of the sorted repeats
+        """
+        if self.num_threads is not None:
+            torch.set_num_threads(self.num_threads)
+        model = model.cpu().eval()
+        the_image = self.get_image(memory_format)
+
+        latency_list = []
+        for repeat_count in range(self.robust_repeat_times):
+            latency_list.append(__get_cpu_latency__(model, the_image, self.benchmark_repeat_times))
+
+        # drop the fastest and the slowest repeats
+        latency_list.sort()
+        if len(latency_list) > 2: latency_list = latency_list[1:-1]
+        avg_latency = np.mean(latency_list)
+        std_latency = np.std(latency_list)
+        return avg_latency, std_latency
@@ -0,0 +1,153 @@
+# Copyright (c) 2021-2022 Alibaba Group Holding Limited.
+
+import os,sys
+import json, time
+import numpy as np
+import torch
+from tabulate import tabulate
+
+
+def get_tensor_bytes(output):
+    if isinstance(output, torch.Tensor):
+        return output.numel() * output.element_size()
+    elif isinstance(output, (list, tuple)):
+        return sum([get_tensor_bytes(x) for x in output])
+    elif isinstance(output, dict):
+        return sum([get_tensor_bytes(x) for x in output.values()])
+    return 0
+
+
+def is_cuda_tensor(output):
+    if isinstance(output, torch.Tensor):
+        return output.is_cuda
+    elif isinstance(output, (list, tuple)) and len(output) > 0:
+        return is_cuda_tensor(output[0])
+    return False
+
+
+class BlockProfiler():
+    def __init__(self, model):
+        """Record the forward time, output bytes and peak memory of the blocks and inner layers by hooks.
+
+        :param model: MasterNet or any module with get_profile_modules() returning a list of (name, module)
+        Usage:
+            with BlockProfiler(model) as profiler:
+                model(x)
+            print(profiler.get_table())
+            profiler.save_chrome_trace("trace.json")
+        """
+        self.profile_modules = model.get_profile_modules()
+        self.handles = []
+        self.reset()
+
+
+    def reset(self):
+        self.records = {name: [] for name, _ in self.profile_modules}
+        self.events = []
+        self.stack = []
+
+
+    def register(self):
+        for name, module in self.profile_modules:
+            self.handles.append(module.register_forward_pre_hook(self.get_pre_hook(name)))
+            self.handles.append(module.register_forward_hook(self.get_post_hook(name)))
+        return self
+
+
+    def remove(self):
+        for handle in self.handles:
+            handle.remove()
+        self.handles = []
+
+
+    def __enter__(self):
+        return self.register()
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.remove()
+
+
+    def get_pre_hook(self, name):
+        def pre_hook(module, input):
+            use_cuda = is_cuda_tensor(input)
+            if use_cuda:
+                torch.cuda.synchronize()
+                # the peak of the parent is kept before the peak stats are reset for the child
+                if len(self.stack) > 0:
+                    self.stack[-1]["peak_bytes"] = max(self.stack[-1]["peak_bytes"], torch.cuda.max_memory_allocated())
+                torch.cuda.reset_peak_memory_stats()
+            self.stack.append({"name": name, "use_cuda": use_cuda, "peak_bytes": 0, "start_ns": time.perf_counter_ns()})
+        return pre_hook
+
+
+    def get_post_hook(self, name):
+        def post_hook(module, input, output):
+            frame = self.stack.pop()
+            assert frame["name"] == name, "the hooks of %s and %s are not nested"%(frame["name"], name)
+            if frame["use_cuda"]:
+                torch.cuda.synchronize()
+            end_ns = time.perf_counter_ns()
+            if frame["use_cuda"]:
+                peak_bytes = max(frame["peak_bytes"], torch.cuda.max_memory_allocated())
+                if len(self.stack) > 0:
+                    self.stack[-1]["peak_bytes"] = max(self.stack[-1]["peak_bytes"], peak_bytes)
+            else:
+                peak_bytes = None # no allocator stats on cpu
+            record = {"name": name, "start_ns": frame["start_ns"], "time_ns": end_ns - frame["start_ns"],
+                      "output_bytes": get_tensor_bytes(output), "peak_bytes": peak_bytes, "depth": len(self.stack)}
+            self.records[name].append(record)
+            self.events.append(record)
+        return post_hook
+
+
+    def get_summary(self, predictions=None):
+        """Get the average of the records for every block and inner layer.
+
+        :param predictions: dict of {layer name: predicted latency in ms}, the predictions of the
+                            blocks are summed from their inner layers
+        """
+        summary = []
+        for name, module in self.profile_modules:
+            records = self.records[name]
+            info = {"name": name, "class": module.__class__.__name__, "calls": len(records)}
+            info["time_ms"] = np.mean([x["time_ns"] for x in records])/1e6 if len(records) > 0 else None
+            info["output_mb"] = records[-1]["output_bytes"]/2**20 if len(records) > 0 else None
+            peak_bytes = [x["peak_bytes"] for x in records if x["peak_bytes"] is not None]
+            info["peak_mb"] = max(peak_bytes)/2**20 if len(peak_bytes) > 0 else None
+            if predictions is not None:
+                pred_list = [v for k, v in predictions.items() if k == name or k.startswith(name + ".")]
+                info["pred_ms"] = float(sum(pred_list)) if len(pred_list) > 0 else None
+                if info["pred_ms"] and info["time_ms"] is not None:
+                    info["measured/pred"] = info["time_ms"]/info["pred_ms"]
+                else:
+                    info["measured/pred"] = None
+            summary.append(info)
+        return summary
+
+
+    def get_table(self, predictions=None):
+        summary = self.get_summary(predictions)
+        headers = ["name", "class", "calls", "time_ms", "output_mb", "peak_mb"]
+        if predictions is not None:
+            headers += ["pred_ms", "measured/pred"]
+        table = []
+        for info in summary:
+            row = [info[key] for key in headers]
+            table.append(["-" if x is None else ("%.3f"%(x) if isinstance(x, float) else x) for x in row])
+        return tabulate(table, headers=headers, disable_numparse=True, colalign=["left"]+["right"]*(len(headers)-1))
+
+
+    def save_chrome_trace(self, filename):
+        """Save the records in the Chrome trace format, which can be opened in chrome://tracing or Perfetto."""
+        if len(self.events) == 0:
+            raise ValueError("there is no record to save, run the forward with the hooks first")
+        start_ns = min([x["start_ns"] for x in self.events])
+        trace_events = []
+        for event in sorted(self.events, key=lambda x: (x["start_ns"], x["depth"])):
+            trace_events.append({"name": event["name"], "ph": "X", "pid": 0, "tid": 0,
+                "ts": (event["start_ns"] - start_ns)/1000, "dur": event["time_ns"]/1000,
+                "args": {"output_bytes": event["output_bytes"], "peak_bytes": event["peak_bytes"]}})
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        with open(filename, 'w') as fid:
+            json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, fid)
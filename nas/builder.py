@@ -3,13 +3,14 @@
 from logging import Logger
 import os, sys
 import warnings
+import contextlib
 import torch, thop
 import numpy as np
 import torch.nn as nn
 from abc import ABCMeta, abstractmethod
 
 from models import __all_masternet__
-from scores import __all_scores__
+from scores import __all_scores__, ScoreStore
 from latency import GetRobustLatencyMeanStd, OpProfiler
 from configs import load_py_module_from_path 
 
@@ -18,9 +19,12 @@ class BuildNAS(metaclass=ABCMeta):
     def __init__(self, cfg, logger):
         self.cfg = cfg
         self.logger = logger
+        # the SearchMetrics of the search, which times the phases of get_info_for_evolution
+        self.metrics = None
         self.build_master()
         self.build_space()
         self.build_score()
+        self.build_score_store()
         self.build_latency()
         self.logger.info('****** Successfully build the NAS model ******\n')
 
@@ -35,12 +39,25 @@ class BuildNAS(metaclass=ABCMeta):
 
     def build_score(self,):
         if hasattr(self.cfg, "score_type"):
-            self.compute_score = __all_scores__[self.cfg.score_type](self.cfg, logger=self.logger)
+            # a list of proxies shares one forward pass in the multi score
+            if isinstance(self.cfg.score_type, (list, tuple)):
+                self.compute_score = __all_scores__['multi'](self.cfg, logger=self.logger)
+            else:
+                self.compute_score = __all_scores__[self.cfg.score_type](self.cfg, logger=self.logger)
             self.logger.info("****** Build the score: %s ******"%(self.cfg.score_type))
         else:
             raise NameError("cfg must have the parameter of 'score_type'")
 
 
+    def build_score_store(self,):
+        if self.cfg.score_store_dir is not None:
+            self.score_store = ScoreStore(self.cfg, logger=self.logger)
+            self.logger.info("****** Build the score store: %s with %d scores ******"%(
+                            self.score_store.db_path, len(self.score_store)))
+        else:
+            self.score_store = None
+
+
     def build_latency(self,):
         if self.cfg.lat_gpu:
             fp16 = True if self.cfg.lat_date_type=="FP16" else False
@@ -57,13 +74,31 @@ class BuildNAS(metaclass=ABCMeta):
         if hasattr(self.cfg, "space_mutation"):
             mutation_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "spaces", "%s.py"%(self.cfg.space_mutation))
             assert os.path.isfile(mutation_path), "mutation_path is invalid"
-            self.mutation = load_py_module_from_path("%s:mutate_function"%mutation_path)
+            space_module = load_py_module_from_path(mutation_path)
+            self.mutation = space_module.mutate_function
+            # the feasible sampler lists the choices of the blocks, not all the spaces have it
+            self.mutation_choices = getattr(space_module, "get_mutation_choices", None)
+            # the batch of the mutations for the offspring generator
+            self.mutation_batch = getattr(space_module, "mutate_batch", None)
             self.logger.info("****** Build the mutate_function: %s ******"%(self.cfg.space_mutation))
         else:
             raise NameError("cfg must have the parameter of 'space_mutation'")
 
 
-    def do_compute_nas_score(self, model):
+    def get_phase_timer(self, phase):
+        return self.metrics.phase(phase) if self.metrics is not None else contextlib.nullcontext()
+
+
+    def do_compute_nas_score(self, model, lookup_store=True):
+
+        # reuse the score from previous searches with the same score config
+        if self.score_store is not None and lookup_store:
+            the_nas_core = self.score_store.get(model.structure_info)
+            if the_nas_core is not None:
+                return the_nas_core
+
+        # only madnas works on the meta device without the weights
+        if self.cfg.score_type != "madnas": model.materialize()
 
         try:
             nas_score_info = self.compute_score(model)
@@ -75,7 +110,11 @@ class BuildNAS(metaclass=ABCMeta):
             self.logger.error('!!! Failed structure: ')
             self.logger.error(str(model.structure_info))
             the_nas_core = -9999   
-                                                 
+            return the_nas_core
+
+        if self.score_store is not None:
+            self.score_store.put(model.structure_info, the_nas_core)
+
         return the_nas_core
 
 
@@ -133,18 +172,56 @@ class BuildNAS(metaclass=ABCMeta):
             self.logger.debug('*** debug: rank={}, random structure max_feature too large. \n  with the stucture={}'.format(self.cfg.rank, model_info))
             return False
 
+        if self.cfg.budget_mcu_arena is not None and self.cfg.budget_mcu_arena < model_info["arena"]:
+            self.logger.debug('*** debug: rank={}, random structure arena too large. \n  with the stucture={}'.format(self.cfg.rank, model_info))
+            return False
+
         return True
 
 
+    def get_stored_model_info(self, structure_info):
+        """Get the model info of the structure from the score store without building the masternet.
+
+        None if its budget metrics are not stored. The score is None if it is within the budgets but its
+        score is not stored.
+        """
+        model_info = self.score_store.get_info(structure_info)
+        if model_info is None:
+            return None
+        if self.cfg.budget_mcu_max_feature is not None and "max_feature" not in model_info:
+            return None
+        if self.cfg.budget_mcu_arena is not None and "arena" not in model_info:
+            return None
+        model_info["is_satify_budget"] = self.is_satify_budget(model_info)
+        if model_info["is_satify_budget"]:
+            model_info["score"] = self.score_store.get(model_info["structure_info"])
+        return model_info
+
+
     def get_info_for_evolution(self, structure_info=None, structure_str=None, structure_txt=None, flop_thop=False):
 
+        # the measured latency is not stored, so the masternet is built for it
+        is_store_info = self.score_store is not None and not self.cfg.lat_gpu and not flop_thop
+        is_score_missed = False
+        if is_store_info and structure_info is not None:
+            with self.get_phase_timer("build"):
+                model_info = self.get_stored_model_info(structure_info)
+            if model_info is not None:
+                if not model_info["is_satify_budget"] or model_info["score"] is not None:
+                    return model_info
+                is_score_missed = True
+
         model_info = {}
 
-        model = self.AnyPlainNet(num_classes=self.cfg.space_num_classes, structure_info=structure_info, 
-                structure_str=structure_str, structure_txt=structure_txt, block_module=self.cfg.space_block_module, 
-                dropout_channel=self.cfg.space_dropout_channel, dropout_layer=self.cfg.space_dropout_layer, 
-                out_indices=self.cfg.out_indices, classfication=self.cfg.space_classfication, 
-                no_create=self.cfg.score_no_creat, quant_search=self.cfg.score_quant_search)
+        with self.get_phase_timer("build"):
+            model = self.AnyPlainNet(num_classes=self.cfg.space_num_classes, structure_info=structure_info, 
+                    structure_str=structure_str, structure_txt=structure_txt, block_module=self.cfg.space_block_module, 
+                    dropout_channel=self.cfg.space_dropout_channel, dropout_layer=self.cfg.space_dropout_layer, 
+                    out_indices=self.cfg.out_indices, classfication=self.cfg.space_classfication, 
+                    no_create=self.cfg.score_no_creat, quant_search=self.cfg.score_quant_search, 
+                    meta_device=self.cfg.score_meta_device and not self.cfg.score_no_creat)
+            # the budgets and the madnas score do not need the weights, which are allocated only for the forward
+            if flop_thop or self.cfg.lat_gpu: model.materialize()
 
         if flop_thop:
             input_D = torch.randn(1, self.cfg.budget_image_channel, self.cfg.budget_image_size, self.cfg.budget_image_size)
@@ -153,19 +230,30 @@ class BuildNAS(metaclass=ABCMeta):
             flops_D, params_D = thop.clever_format([flops_D, params_D], "%.3f")
             self.logger.info('===> decoder:{}flops_{}params\n\n'.format(flops_D, params_D))
         
-        model_info["structure_info"] = model.structure_info
-        model_info["params"] = model.get_model_size()
-        model_info["flops"] = model.get_flops(self.cfg.budget_image_size)
-        model_info["layers"] = model.get_num_layers()
-        model_info["stages"] = model.get_num_stages()
-        model_info["latency"] = self.do_benchmark(model)
-        if self.cfg.budget_mcu_max_feature is not None: 
-            self.logger.debug("max_feature_list=%s"%model.get_max_feature_num(self.cfg.budget_image_size))
-            self.logger.debug("params_list=%s"%model.get_model_size(return_list=True))
-            model_info["max_feature"] = np.max(model.get_max_feature_num(self.cfg.budget_image_size))
-        model_info["is_satify_budget"] = self.is_satify_budget(model_info)
-
-        if model_info["is_satify_budget"]: model_info["score"] = self.do_compute_nas_score(model)
+        with self.get_phase_timer("latency"):
+            the_latency = self.do_benchmark(model)
+        with self.get_phase_timer("budget"):
+            model_info["structure_info"] = model.structure_info
+            model_info["params"] = model.get_model_size()
+            model_info["flops"] = model.get_flops(self.cfg.budget_image_size)
+            model_info["layers"] = model.get_num_layers()
+            model_info["stages"] = model.get_num_stages()
+            model_info["latency"] = the_latency
+            if self.cfg.budget_mcu_max_feature is not None: 
+                self.logger.debug("max_feature_list=%s"%model.get_max_feature_num(self.cfg.budget_image_size))
+                self.logger.debug("params_list=%s"%model.get_model_size(return_list=True))
+                model_info["max_feature"] = np.max(model.get_max_feature_num(self.cfg.budget_image_size))
+            if self.cfg.budget_mcu_arena is not None:
+                memory_plan = model.get_memory_plan(self.cfg.budget_image_size)
+                self.logger.debug("arena_offsets=%s"%[(x["name"], x["output"][1]) for x in memory_plan["layers"]])
+                model_info["arena"] = memory_plan["arena_size"]
+            model_info["is_satify_budget"] = self.is_satify_budget(model_info)
+
+        if model_info["is_satify_budget"]:
+            with self.get_phase_timer("score"):
+                model_info["score"] = self.do_compute_nas_score(model, lookup_store=not is_score_missed)
+        if is_store_info:
+            self.score_store.put_info(model_info)
 
         return model_info
 
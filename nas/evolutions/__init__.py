@@ -1 +1,11 @@
-from .population import Population
\ No newline at end of file
+from .population import Population
+from .arch_spec import BlockSpec, ArchSpec
+from .sampler import FeasibleSampler, get_block_layers, get_rejection_stats
+from .offspring import OffspringGenerator, get_stage_ranges, select_mate
+from .genome import GenomeCodec
+from .server import PopulationServer, get_child_message
+from .surrogate import Surrogate, get_surrogate_stats
+from .metrics import SearchMetrics, get_metrics_summary, export_metrics_jsonl, export_metrics_prometheus
+from .pareto import fast_non_dominated_sort, get_crowding_distance, get_nsga_order, get_budget_best
+from .checkpoint import (save_population, load_population, convert_population, EvaluationLog, read_evaluation_log,
+                load_search_state, load_evaluated_models, get_random_state, set_random_state)
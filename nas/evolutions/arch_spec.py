@@ -0,0 +1,184 @@
+# Copyright (c) 2021-2022 Alibaba Group Holding Limited.
+
+import os, sys
+import ast
+from collections.abc import Mapping, Sequence
+
+
+class BlockSpec(Mapping):
+    """Immutable structure info of one block, read like the dict of the txt format.
+
+    The list values, like nbitsA and nbitsW of the quant search, are kept as tuples and returned as
+    new lists, so that dict(block) is a mutable copy for the mutation without copy.deepcopy.
+    """
+    __slots__ = ("_info", "_list_keys", "_hash")
+
+    def __init__(self, structure_info):
+        info, list_keys = {}, []
+        for key, value in structure_info.items():
+            if isinstance(value, list):
+                value = tuple(value)
+                list_keys.append(key)
+            info[key] = value
+        object.__setattr__(self, "_info", info)
+        object.__setattr__(self, "_list_keys", frozenset(list_keys))
+        object.__setattr__(self, "_hash", None)
+
+
+    def __setattr__(self, name, value):
+        raise AttributeError("BlockSpec is immutable, use replace() to get a new one")
+
+
+    def __getitem__(self, key):
+        value = self._info[key]
+        return list(value) if key in self._list_keys else value
+
+
+    def __contains__(self, key):
+        return key in self._info
+
+
+    def __iter__(self):
+        return iter(self._info)
+
+
+    def __len__(self):
+        return len(self._info)
+
+
+    def __hash__(self):
+        if self._hash is None:
+            object.__setattr__(self, "_hash", hash(frozenset(self._info.items())))
+        return self._hash
+
+
+    def __eq__(self, other):
+        if isinstance(other, BlockSpec):
+            return self is other or (hash(self) == hash(other) and self._info == other._info)
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
+    def __reduce__(self):
+        return (BlockSpec, (self.to_dict(), ))
+
+
+    def __copy__(self):
+        return self
+
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+    def replace(self, **kwargs):
+        """Get a new BlockSpec with some values changed."""
+        structure_info = self.to_dict()
+        structure_info.update(kwargs)
+        return BlockSpec(structure_info)
+
+
+    def to_dict(self):
+        return {key: self[key] for key in self._info}
+
+
+class ArchSpec(Sequence):
+    """Immutable structure info of a network, a tuple of BlockSpec.
+
+    The unchanged blocks are shared between an architecture and its mutants, and the architecture
+    is hashable, so it can be the identity key of the population instead of the str() of the list.
+    str() is the same as the list of dicts, which is the txt format of best_structure.txt.
+    """
+    __slots__ = ("_blocks", "_hash")
+
+    def __init__(self, block_list=()):
+        object.__setattr__(self, "_blocks", tuple([x if isinstance(x, BlockSpec) else BlockSpec(x) for x in block_list]))
+        object.__setattr__(self, "_hash", None)
+
+
+    @classmethod
+    def from_list(cls, structure_info_list):
+        if isinstance(structure_info_list, ArchSpec):
+            return structure_info_list
+        return cls(structure_info_list)
+
+
+    @classmethod
+    def from_str(cls, structure_str):
+        structure_info_list = ast.literal_eval(structure_str)
+        assert isinstance(structure_info_list, list)
+        return cls(structure_info_list)
+
+
+    @classmethod
+    def from_txt(cls, structure_txt):
+        # the same parsing as the structure_txt of MasterNet
+        with open(structure_txt, 'r') as fid:
+            structure_str = ''.join([x.strip() for x in fid.readlines()])
+        return cls.from_str(structure_str)
+
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ArchSpec is immutable, use replace_block() to get a new one")
+
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return ArchSpec(self._blocks[idx])
+        return self._blocks[idx]
+
+
+    def __len__(self):
+        return len(self._blocks)
+
+
+    def __iter__(self):
+        return iter(self._blocks)
+
+
+    def __hash__(self):
+        if self._hash is None:
+            object.__setattr__(self, "_hash", hash(self._blocks))
+        return self._hash
+
+
+    def __eq__(self, other):
+        if isinstance(other, ArchSpec):
+            return self is other or (hash(self) == hash(other) and self._blocks == other._blocks)
+        if isinstance(other, list):
+            return self.to_list() == other
+        return NotImplemented
+
+
+    def __repr__(self):
+        return repr(self.to_list())
+
+
+    def __reduce__(self):
+        return (ArchSpec, (self.to_list(), ))
+
+
+    def __copy__(self):
+        return self
+
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+    def replace_block(self, block_id, *new_blocks):
+        """Replace the block with zero or more blocks, the other blocks are shared with this architecture."""
+        return ArchSpec(self._blocks[:block_id] + tuple(new_blocks) + self._blocks[block_id+1:])
+
+
+    def to_list(self):
+        return [block.to_dict() for block in self._blocks]
+
+
+    def to_str(self):
+        return str(self.to_list())
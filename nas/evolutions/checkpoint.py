@@ -0,0 +1,193 @@
+# Copyright (c) 2021-2022 Alibaba Group Holding Limited.
+
+import os, sys
+import json
+import random
+import numpy as np
+try:
+    import torch
+except ImportError:
+    torch = None
+
+from configs import robust_save, mkfilepath, load_pyobj, save_pyobj
+from .arch_spec import ArchSpec
+from .genome import GenomeCodec
+
+
+# the metrics saved as ints, the others are floats
+__int_metric_keys__ = ["layers", "stages"]
+
+
+def get_metric_value(key, value):
+    return int(value) if key in __int_metric_keys__ else float(value)
+
+
+# the arrays of the snapshot which are not the metrics
+__snapshot_keys__ = ["num_evaluated_nets_count", "genome_spec", "genomes", "search_state"]
+
+
+def save_population_arrays(filename, codec, structure_list, num_evaluated_nets_count, metrics, search_state=None):
+    arrays = {"num_evaluated_nets_count": np.array(num_evaluated_nets_count),
+              "genome_spec": np.array(json.dumps(codec.get_spec())),
+              "genomes": codec.encode_list(structure_list)}
+    for key, value in metrics.items():
+        # the int metrics are kept as ints, so the restored population is the same
+        value = np.array(value)
+        arrays[key] = value if value.dtype.kind in "iu" else value.astype(np.float64)
+    if search_state is not None:
+        arrays["search_state"] = np.array(json.dumps(search_state).encode())
+
+    def save_function(temp_filename):
+        with open(temp_filename, "wb") as fid:
+            np.savez(fid, **arrays)
+    robust_save(filename, save_function)
+
+
+def save_population(filename, popu_nas, search_state=None):
+    """Save the population as a npz snapshot with the packed genomes, replaced atomically by robust_save.
+
+    :param search_state: the json-serializable state of the search saved in the same file, see load_search_state
+    """
+    popu_nas.rank_population(maintain_popu=True)
+    metrics = {key: getattr(popu_nas, "popu_%s_list"%(key)) for key in popu_nas.get_metric_keys()}
+    save_population_arrays(filename, popu_nas.genome_codec, popu_nas.popu_structure_list,
+                           popu_nas.num_evaluated_nets_count, metrics, search_state=search_state)
+
+
+def load_population(filename):
+    """Load the population of a npz snapshot, or a txt snapshot of save_pyobj, as the dict of export_dict."""
+    if not filename.endswith(".npz"):
+        return load_pyobj(filename)
+
+    with np.load(filename, allow_pickle=False) as arrays:
+        codec = GenomeCodec.from_spec(json.loads(str(arrays["genome_spec"])))
+        popu_nas_info = {"num_evaluated_nets_count": int(arrays["num_evaluated_nets_count"]),
+                         "popu_structure_list": codec.decode_list(arrays["genomes"])}
+        for key in arrays.files:
+            if key not in __snapshot_keys__:
+                popu_nas_info["popu_%s_list"%(key)] = arrays[key].tolist()
+    return popu_nas_info
+
+
+def load_search_state(filename):
+    """Load the population and the search state of a snapshot saved with search_state, as (dict, dict)."""
+    with np.load(filename, allow_pickle=False) as arrays:
+        if "search_state" not in arrays.files:
+            raise ValueError("%s has no search state"%(filename))
+        search_state = json.loads(arrays["search_state"].item().decode())
+    return load_population(filename), search_state
+
+
+def get_random_state():
+    # the states of python, numpy and torch random, as json-serializable lists
+    random_state = {"python": random.getstate()}
+    np_state = np.random.get_state()
+    random_state["numpy"] = [np_state[0], np_state[1].tolist()] + list(np_state[2:])
+    if torch is not None:
+        random_state["torch"] = torch.get_rng_state().tolist()
+    return random_state
+
+
+def set_random_state(random_state):
+    version, internal_state, gauss_next = random_state["python"]
+    random.setstate((version, tuple(internal_state), gauss_next))
+    np_state = random_state["numpy"]
+    np.random.set_state((np_state[0], np.array(np_state[1], dtype=np.uint32)) + tuple(np_state[2:]))
+    if torch is not None and "torch" in random_state:
+        torch.set_rng_state(torch.tensor(random_state["torch"], dtype=torch.uint8))
+
+
+def convert_population(src_filename, dst_filename, max_layers=None):
+    """Convert a txt snapshot into a npz snapshot, or back for reading.
+
+    :param max_layers: budget_layers of the search, the longest nbits list of the snapshot if None
+    """
+    popu_nas_info = load_population(src_filename)
+    if not dst_filename.endswith(".npz"):
+        popu_nas_info["popu_structure_list"] = [ArchSpec.from_list(x).to_list() for x in popu_nas_info["popu_structure_list"]]
+        save_pyobj(dst_filename, popu_nas_info)
+        return
+
+    structure_list = [ArchSpec.from_list(x) for x in popu_nas_info["popu_structure_list"]]
+    if max_layers is None:
+        max_layers = max([0] + [len(v) for x in structure_list for block in x for v in block.values() if isinstance(v, list)])
+    codec = GenomeCodec(structure_list[0], max_layers=max_layers)
+    metrics = {key[len("popu_"):-len("_list")]: value for key, value in popu_nas_info.items()
+               if key.startswith("popu_") and key.endswith("_list") and key != "popu_structure_list"}
+    save_population_arrays(dst_filename, codec, structure_list, popu_nas_info["num_evaluated_nets_count"], metrics)
+
+
+class EvaluationLog():
+    def __init__(self, filename, genome_codec, metric_keys):
+        """Append-only binary log of the evaluated individuals, one fixed-size record per individual.
+
+        A record is the genome followed by the metrics as float64, the layout is saved in filename.json
+        once. A record cut by a crash is skipped when reading, so the log is never rewritten.
+        """
+        self.filename = filename
+        self.genome_codec = genome_codec
+        self.metric_keys = list(metric_keys)
+        header = {"genome_spec": genome_codec.get_spec(), "metric_keys": self.metric_keys}
+        header_filename = filename + ".json"
+        if os.path.isfile(header_filename):
+            with open(header_filename, "r") as fid:
+                if json.load(fid) != header:
+                    raise ValueError("%s is written by a different search space or metrics"%(filename))
+        else:
+            def save_function(temp_filename):
+                with open(temp_filename, "w") as fid:
+                    json.dump(header, fid)
+            robust_save(header_filename, save_function)
+        mkfilepath(filename)
+        self.record_size = genome_codec.width*genome_codec.dtype.itemsize + len(self.metric_keys)*8
+        # a record cut by a crash is removed, so the new records are aligned
+        self.num_records = os.path.getsize(filename)//self.record_size if os.path.isfile(filename) else 0
+        self.fid = open(filename, "ab")
+        self.truncate(self.num_records)
+
+
+    def append(self, model_info):
+        genome = self.genome_codec.encode(model_info["structure_info"])
+        metrics = np.array([model_info[key] for key in self.metric_keys], dtype=np.float64)
+        self.fid.write(genome.tobytes() + metrics.tobytes())
+        self.fid.flush()
+        self.num_records += 1
+
+
+    def truncate(self, num_records):
+        # roll back to the first num_records records, which are saved with the search state for --resume
+        self.fid.truncate(num_records*self.record_size)
+        self.num_records = num_records
+
+
+    def close(self):
+        self.fid.close()
+
+
+def read_evaluation_log(filename):
+    """Read the evaluated individuals of an EvaluationLog, as (list of ArchSpec, {metric key: list})."""
+    with open(filename + ".json", "r") as fid:
+        header = json.load(fid)
+    codec = GenomeCodec.from_spec(header["genome_spec"])
+    metric_keys = header["metric_keys"]
+    record_dtype = np.dtype([("genome", codec.dtype, (codec.width, )), ("metrics", np.float64, (len(metric_keys), ))])
+    with open(filename, "rb") as fid:
+        data = fid.read()
+    records = np.frombuffer(data, dtype=record_dtype, count=len(data)//record_dtype.itemsize)
+    structure_list = codec.decode_list(records["genome"])
+    metrics = {key: [get_metric_value(key, x) for x in records["metrics"][:, idx].tolist()] for idx, key in enumerate(metric_keys)}
+    return structure_list, metrics
+
+
+def load_evaluated_models(filename_list):
+    """Get the model info of the individuals in the evaluation logs as {ArchSpec: model_info},
+    which are satisfied with the budgets, so they are not evaluated again."""
+    evaluated_models = {}
+    for filename in filename_list:
+        structure_list, metrics = read_evaluation_log(filename)
+        for idx, structure_info in enumerate(structure_list):
+            model_info = {key: value[idx] for key, value in metrics.items()}
+            model_info["structure_info"] = structure_info
+            model_info["is_satify_budget"] = True
+            evaluated_models[structure_info] = model_info
+    return evaluated_models
@@ -0,0 +1,167 @@
+# Copyright (c) 2021-2022 Alibaba Group Holding Limited.
+
+import os, sys
+import json
+import zlib
+import hashlib
+import numpy as np
+
+from .arch_spec import BlockSpec, ArchSpec
+
+
+class GenomeCodec():
+    def __init__(self, template, max_layers=None, dtype=np.int16, max_cache_size=100000):
+        """Fixed-width integer genome of the structures in a search space, one small int per choice.
+
+        :param template: the structure of the masternet, the mutation keeps its blocks, keys and classes
+        :param max_layers: budget_layers, which limits the length of the nbits lists of the super blocks
+        :param max_cache_size: the encoded and decoded structures are cached, the population is sent repeatedly
+        The layout is built from the template in its key order: the strings (class, inner_class) are the
+        indices in the vocabulary of the template, the ints are stored as they are, and each list is its
+        length followed by the values padded with 0. The same template gives the same codec on all the ranks.
+        """
+        template = ArchSpec.from_list(template)
+        self.dtype = np.dtype(dtype)
+        self.vocab = sorted(set([v for block in template for v in block.values() if isinstance(v, str)]))
+        self.vocab_idx = {v: idx for idx, v in enumerate(self.vocab)}
+        # (block_id, key, kind, width), kind is str, int or list
+        self.layout = []
+        for block_id, block in enumerate(template):
+            for key in block.keys():
+                value = block[key]
+                if isinstance(value, str):
+                    self.layout.append((block_id, key, "str", 1))
+                elif isinstance(value, int):
+                    self.layout.append((block_id, key, "int", 1))
+                elif isinstance(value, list):
+                    if max_layers is None:
+                        raise ValueError("max_layers is needed for the list of %s in block %d"%(key, block_id))
+                    self.layout.append((block_id, key, "list", 1 + max(len(value), max_layers)))
+                else:
+                    raise TypeError("%s=%s in block %d can't be encoded"%(key, value, block_id))
+        self.block_num = len(template)
+        self.block_key_num = [len(block) for block in template]
+        self.width = sum([x[-1] for x in self.layout])
+        self.fingerprint = hashlib.md5(json.dumps(self.get_spec()).encode()).hexdigest()
+        self.max_cache_size = max_cache_size
+        self.encode_cache = {}
+        self.decode_cache = {}
+
+
+    @classmethod
+    def from_spec(cls, spec, max_cache_size=100000):
+        """Get the codec of a spec saved with the genomes, without the template."""
+        codec = cls.__new__(cls)
+        codec.dtype = np.dtype(spec["dtype"])
+        codec.vocab = list(spec["vocab"])
+        codec.vocab_idx = {v: idx for idx, v in enumerate(codec.vocab)}
+        codec.layout = [tuple(x) for x in spec["layout"]]
+        codec.block_num = max([x[0] for x in codec.layout]) + 1
+        codec.block_key_num = [sum([1 for x in codec.layout if x[0] == block_id]) for block_id in range(codec.block_num)]
+        codec.width = sum([x[-1] for x in codec.layout])
+        codec.fingerprint = hashlib.md5(json.dumps(codec.get_spec()).encode()).hexdigest()
+        codec.max_cache_size = max_cache_size
+        codec.encode_cache = {}
+        codec.decode_cache = {}
+        return codec
+
+
+    def encode(self, structure_info_list):
+        """Encode the structure into a genome of shape (width,)."""
+        if isinstance(structure_info_list, ArchSpec):
+            genome = self.encode_cache.get(structure_info_list)
+            if genome is None:
+                genome = self.encode_uncached(structure_info_list)
+                self.update_cache(self.encode_cache, structure_info_list, genome)
+            return genome
+        return self.encode_uncached(structure_info_list)
+
+
+    def encode_uncached(self, structure_info_list):
+        if len(structure_info_list) != self.block_num:
+            raise ValueError("the genome needs %d blocks, not %d"%(self.block_num, len(structure_info_list)))
+        for block_id, block in enumerate(structure_info_list):
+            if len(block) != self.block_key_num[block_id]:
+                raise ValueError("the keys of block %d are different from the template: %s"%(block_id, block))
+        values = []
+        for block_id, key, kind, width in self.layout:
+            value = structure_info_list[block_id][key]
+            if kind == "str":
+                values.append(self.vocab_idx[value])
+            elif kind == "int":
+                values.append(value)
+            else:
+                if len(value) >= width:
+                    raise ValueError("the list of %s in block %d is longer than %d"%(key, block_id, width - 1))
+                values += [len(value)] + list(value) + [0]*(width - 1 - len(value))
+        genome = np.array(values, dtype=np.int64)
+        info = np.iinfo(self.dtype)
+        if genome.min() < info.min or genome.max() > info.max:
+            raise ValueError("the values of the structure overflow %s"%(self.dtype))
+        return genome.astype(self.dtype)
+
+
+    def decode(self, genome):
+        """Decode the genome into the ArchSpec of the structure."""
+        genome = np.asarray(genome, dtype=self.dtype)
+        genome_bytes = genome.tobytes()
+        structure_info_list = self.decode_cache.get(genome_bytes)
+        if structure_info_list is None:
+            structure_info_list = self.decode_uncached(genome)
+            self.update_cache(self.decode_cache, genome_bytes, structure_info_list)
+        return structure_info_list
+
+
+    def update_cache(self, cache, key, value):
+        if len(cache) >= self.max_cache_size:
+            cache.clear()
+        cache[key] = value
+
+
+    def decode_uncached(self, genome):
+        genome = genome.tolist()
+        if len(genome) != self.width:
+            raise ValueError("the genome needs %d values, not %d"%(self.width, len(genome)))
+        block_list = [{} for _ in range(self.block_num)]
+        pos = 0
+        for block_id, key, kind, width in self.layout:
+            if kind == "str":
+                block_list[block_id][key] = self.vocab[genome[pos]]
+            elif kind == "int":
+                block_list[block_id][key] = genome[pos]
+            else:
+                block_list[block_id][key] = genome[pos+1:pos+1+genome[pos]]
+            pos += width
+        return ArchSpec([BlockSpec(x) for x in block_list])
+
+
+    def encode_list(self, structure_info_lists):
+        """Encode the structures into the packed genomes of shape (N, width)."""
+        if len(structure_info_lists) == 0:
+            return np.zeros((0, self.width), dtype=self.dtype)
+        return np.stack([self.encode(x) for x in structure_info_lists])
+
+
+    def decode_list(self, genomes):
+        return [self.decode(x) for x in genomes]
+
+
+    def pack(self, genomes):
+        """Pack the genomes of shape (N, width) into the compressed bytes, the padding and the similar
+        structures of the population are compressed well."""
+        return zlib.compress(np.ascontiguousarray(genomes, dtype=self.dtype).tobytes(), 1)
+
+
+    def unpack(self, packed_genomes):
+        return np.frombuffer(zlib.decompress(packed_genomes), dtype=self.dtype).reshape(-1, self.width)
+
+
+    def get_spec(self):
+        # the layout of the genome, saved with the packed genomes to check the codec
+        return {"vocab": self.vocab, "layout": [list(x) for x in self.layout], "dtype": self.dtype.name}
+
+
+    def check_fingerprint(self, fingerprint):
+        # the packed genomes must be decoded by the codec of the same layout
+        if fingerprint != self.fingerprint:
+            raise ValueError("the genomes are encoded by a different codec: %s"%(fingerprint))
@@ -0,0 +1,143 @@
+# Copyright (c) 2021-2022 Alibaba Group Holding Limited.
+
+import os, sys
+import json
+import time
+
+from .arch_spec import ArchSpec
+
+
+class PhaseTimer():
+    # reused by each phase, so timing a phase costs two perf_counter calls
+    def __init__(self, metrics, phase):
+        self.metrics = metrics
+        self.phase = phase
+        self.begin = None
+
+
+    def __enter__(self):
+        self.begin = time.perf_counter()
+        return self
+
+
+    def __exit__(self, *args):
+        self.metrics.add_time(self.phase, time.perf_counter() - self.begin)
+        return False
+
+
+class SearchMetrics():
+    def __init__(self, rank=0):
+        """The seconds and the calls of the phases of the search, and the counters of the candidates on a rank.
+
+        The phases are mutation, build, budget, latency, score, ranking, sync and checkpoint. Each candidate
+        is one of accepted (new and in the budget), rejected (over the budget), duplicate (already evaluated
+        on this rank), cached (in the evaluation logs before --resume) and screened (by the surrogate), the
+        first three are the evaluated nets.
+        """
+        self.rank = rank
+        self.start_time = time.perf_counter()
+        self.phase_seconds = {}
+        self.phase_counts = {}
+        self.counters = {"evaluated": 0, "accepted": 0, "rejected": 0, "duplicate": 0, "cached": 0, "screened": 0}
+        # the hashes of the structures evaluated on this rank, not saved with the search state
+        self.evaluated_hashes = set()
+        self.timers = {}
+
+
+    def phase(self, phase):
+        """Time the phase, e.g. with metrics.phase("score"): ..."""
+        timer = self.timers.get(phase)
+        if timer is None:
+            timer = self.timers[phase] = PhaseTimer(self, phase)
+        return timer
+
+
+    def add_time(self, phase, seconds):
+        self.phase_seconds[phase] = self.phase_seconds.get(phase, 0.0) + seconds
+        self.phase_counts[phase] = self.phase_counts.get(phase, 0) + 1
+
+
+    def count_candidate(self, model_info, cached=False):
+        """Count the candidate by its model_info of get_model_info."""
+        if model_info.get("is_screened", False):
+            self.counters["screened"] += 1
+            return
+        structure_hash = hash(ArchSpec.from_list(model_info["structure_info"]))
+        if cached:
+            self.counters["cached"] += 1
+            self.evaluated_hashes.add(structure_hash)
+            return
+        self.counters["evaluated"] += 1
+        if not model_info["is_satify_budget"]:
+            self.counters["rejected"] += 1
+        elif structure_hash in self.evaluated_hashes:
+            self.counters["duplicate"] += 1
+        else:
+            self.counters["accepted"] += 1
+        self.evaluated_hashes.add(structure_hash)
+
+
+    def get_stats(self):
+        elapsed_time = time.perf_counter() - self.start_time
+        return {"rank": self.rank, "elapsed_time": elapsed_time,
+                "evals_per_s": self.counters["evaluated"]/max(1e-10, elapsed_time),
+                "counters": dict(self.counters),
+                "phases": {phase: {"seconds": seconds, "count": self.phase_counts[phase]}
+                           for phase, seconds in self.phase_seconds.items()}}
+
+
+    def set_stats(self, stats):
+        """Restore the stats of get_stats, for --resume."""
+        self.start_time = time.perf_counter() - stats["elapsed_time"]
+        self.counters.update(stats["counters"])
+        for phase, phase_info in stats["phases"].items():
+            self.phase_seconds[phase] = phase_info["seconds"]
+            self.phase_counts[phase] = phase_info["count"]
+
+
+def get_metrics_summary(stats_list):
+    # the sums over the ranks, and the seconds per evaluated net of each phase
+    num_evaluated = sum([x["counters"]["evaluated"] for x in stats_list])
+    summary = {"evals_per_s": sum([x["evals_per_s"] for x in stats_list])}
+    for stats in stats_list:
+        for key, value in stats["counters"].items():
+            summary[key] = summary.get(key, 0) + value
+    phase_seconds = {}
+    for stats in stats_list:
+        for phase, phase_info in stats["phases"].items():
+            phase_seconds[phase] = phase_seconds.get(phase, 0.0) + phase_info["seconds"]
+    summary["ms_per_eval"] = {phase: 1e3*seconds/max(1, num_evaluated) for phase, seconds in phase_seconds.items()}
+    return summary
+
+
+def export_metrics_jsonl(filename, stats_list, num_evaluated_nets_count):
+    """Append a record of the metrics of all the ranks to the JSONL file."""
+    record = {"time": time.time(), "n": num_evaluated_nets_count, "summary": get_metrics_summary(stats_list),
+              "ranks": stats_list}
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    with open(filename, 'a') as fid:
+        fid.write(json.dumps(record) + '\n')
+
+
+def export_metrics_prometheus(filename, stats_list, num_evaluated_nets_count):
+    """Write the metrics of all the ranks in the Prometheus text format, e.g. for the textfile collector of
+    the node exporter. The file is replaced atomically."""
+    lines = ['# TYPE nas_evaluated_nets gauge', 'nas_evaluated_nets %d'%(num_evaluated_nets_count),
+             '# TYPE nas_evals_per_second gauge']
+    lines += ['nas_evals_per_second{rank="%d"} %g'%(x["rank"], x["evals_per_s"]) for x in stats_list]
+    lines += ['# TYPE nas_rank_evaluated_nets_total counter']
+    lines += ['nas_rank_evaluated_nets_total{rank="%d"} %d'%(x["rank"], x["counters"]["evaluated"]) for x in stats_list]
+    # the statuses of the candidates are exclusive, so they sum to all the candidates of a rank
+    lines += ['# TYPE nas_candidates_total counter']
+    lines += ['nas_candidates_total{rank="%d",status="%s"} %d'%(x["rank"], key, value)
+              for x in stats_list for key, value in x["counters"].items() if key != "evaluated"]
+    lines += ['# TYPE nas_phase_seconds_total counter']
+    lines += ['nas_phase_seconds_total{rank="%d",phase="%s"} %g'%(x["rank"], phase, phase_info["seconds"])
+              for x in stats_list for phase, phase_info in x["phases"].items()]
+    lines += ['# TYPE nas_phase_calls_total counter']
+    lines += ['nas_phase_calls_total{rank="%d",phase="%s"} %d'%(x["rank"], phase, phase_info["count"])
+              for x in stats_list for phase, phase_info in x["phases"].items()]
+    os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    with open(filename + '.temp', 'w') as fid:
+        fid.write('\n'.join(lines) + '\n')
+    os.replace(filename + '.temp', filename)
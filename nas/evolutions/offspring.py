@@ -0,0 +1,172 @@
+# Copyright (c) 2021-2022 Alibaba Group Holding Limited.
+
+import os, sys
+import numpy as np
+
+from .arch_spec import BlockSpec, ArchSpec
+
+
+def get_stage_ranges(arch):
+    """Get the (begin, end) blocks of each stage, a stage begins at the stem and at each block with stride 2."""
+    begin_list = [0] + [block_id for block_id in range(1, len(arch)) if arch[block_id]['s'] == 2]
+    return list(zip(begin_list, begin_list[1:] + [len(arch)]))
+
+
+def get_diff_stage_ids(parent_a, parent_b):
+    """Get the stages in which the aligned parents differ, None if their blocks or strides are not aligned."""
+    if len(parent_a) != len(parent_b) or any([x['s'] != y['s'] for x, y in zip(parent_a, parent_b)]):
+        return None
+    return [stage_id for stage_id, (begin, end) in enumerate(get_stage_ranges(parent_a))
+            if parent_a[begin:end] != parent_b[begin:end]]
+
+
+def select_mate(parent, select_function, max_draws=8):
+    """Select the mate of the parent for the crossover, different from the parent. It is redrawn up to
+    max_draws times until it differs from the parent in two stages or more, so the crossover has a new child,
+    else the mate differing in the most stages is kept. None if the population has no other individual.
+
+    :param select_function: e.g. Population.select_parent, with the exclude argument
+    """
+    parent = ArchSpec.from_list(parent)
+    best_mate, best_num_diff_stages = None, -1
+    for _ in range(max_draws):
+        mate = select_function(exclude=parent)
+        if mate is None:
+            return None
+        num_diff_stages = len(get_diff_stage_ids(parent, ArchSpec.from_list(mate)) or [])
+        if num_diff_stages >= 2:
+            return mate
+        if num_diff_stages > best_num_diff_stages:
+            best_mate, best_num_diff_stages = mate, num_diff_stages
+    return best_mate
+
+
+def get_stage_mask(num_stages, rng=np.random):
+    """Draw the stages taken from the second parent of the crossover, at least one stage from each parent
+    if num_stages > 1.
+
+    :param rng: np.random or a numpy Generator
+    """
+    stage_mask = rng.random(num_stages) < 0.5
+    if num_stages > 1 and (stage_mask.all() or not stage_mask.any()):
+        stage_mask[int(rng.random()*num_stages)] ^= True
+    return stage_mask
+
+
+class OffspringGenerator():
+    def __init__(self, batch_function, cfg, adjust_function=None, valid_function=None):
+        """Generate a batch of children at once, by the stage-wise crossover and the batched mutation.
+
+        :param batch_function: mutate_batch of the space, which draws many mutations of a structure at once
+        :param adjust_function: adjust_structures of the search, which fits the input channels of each block
+                                to the output channels of the block before it, and the kernel sizes
+        :param valid_function: the budget check of the search, the invalid children are rejected
+        The children of the same parent are mutated by one call of batch_function. The numpy RNG of each batch
+        is seeded from np.random, so a search with --seed and --resume gives the same children.
+        """
+        self.batch_function = batch_function
+        self.cfg = cfg
+        self.adjust_function = adjust_function
+        self.valid_function = valid_function
+
+
+    def crossover(self, parent_a, parent_b, rng=np.random, stats=None):
+        """Get the child with some stages of parent_b and the other stages of parent_a.
+
+        The parents are mutated from the same masternet, so their blocks and strides are aligned. The child takes
+        at least one of the stages in which the parents differ from each parent, so it differs from both of them
+        when they differ in two stages or more. The input channels of the first block of each stage are adjusted
+        to the previous stage. None if there is no parent_b different from parent_a, if the child is the same as
+        a parent, or if it is invalid, which are counted as crossover_same_parent, crossover_unchanged and
+        crossover_rejected.
+
+        :param rng: np.random or a numpy Generator to draw the stages
+        """
+        def reject(key):
+            if stats is not None: stats[key] = stats.get(key, 0) + 1
+            return None
+
+        if stats is not None: stats["crossovers"] = stats.get("crossovers", 0) + 1
+        parent_a = ArchSpec.from_list(parent_a)
+        parent_b = ArchSpec.from_list(parent_b) if parent_b is not None else None
+        if parent_b is None or parent_a == parent_b:
+            return reject("crossover_same_parent")
+        diff_stage_ids = get_diff_stage_ids(parent_a, parent_b)
+        if diff_stage_ids is None:
+            return reject("crossover_rejected")
+        # the parents differing in one stage only have no other child
+        if len(diff_stage_ids) < 2:
+            return reject("crossover_unchanged")
+        stage_set_b = set([stage_id for stage_id, is_b in zip(diff_stage_ids, get_stage_mask(len(diff_stage_ids), rng)) if is_b])
+        block_list = []
+        for stage_id, (begin, end) in enumerate(get_stage_ranges(parent_a)):
+            block_list += list((parent_b if stage_id in stage_set_b else parent_a)[begin:end])
+        child = ArchSpec(block_list)
+        if self.adjust_function is not None:
+            child = self.adjust_function(child, self.cfg)
+        if child == parent_a or child == parent_b:
+            return reject("crossover_unchanged")
+        if self.valid_function is not None and not self.valid_function(child, self.cfg):
+            return reject("crossover_rejected")
+        return child
+
+
+    def mutate(self, parent_list, minor_mutation, rng, stats=None):
+        """Mutate each parent space_block_num times, the mutations of the children of the same parent are drawn
+        by one batch_function call.
+
+        The mutations of a child are drawn on its parent, and applied one after another at the different blocks,
+        the neighbour blocks are fitted by adjust_function. Twice the mutations are drawn as the retries of the
+        invalid ones, a child keeps fewer mutations if none of them are valid, as get_new_random_structure_info.
+        """
+        group_dict = {}
+        for idx, parent in enumerate(parent_list):
+            group_dict.setdefault(parent, []).append(idx)
+        child_list = list(parent_list)
+        for parent, idx_list in group_dict.items():
+            mutations = iter(self.batch_function(parent, self.cfg.budget_layers, 2*self.cfg.space_block_num*len(idx_list),
+                            minor_mutation=minor_mutation, exclude_stem=self.cfg.space_exclude_stem, rng=rng))
+            for idx in idx_list:
+                child = parent
+                mutated_block_ids = set()
+                for mutate_count in range(self.cfg.space_block_num):
+                    for block_id, new_blocks in mutations:
+                        block_ids = set(range(block_id, block_id + len(new_blocks)))
+                        if len(block_ids & mutated_block_ids) > 0:
+                            continue
+                        if stats is not None: stats["proposals"] += 1
+                        new_child = ArchSpec(child[:block_id]._blocks + tuple([BlockSpec(x) for x in new_blocks]) + \
+                                            child[block_id+len(new_blocks):]._blocks)
+                        if self.adjust_function is not None:
+                            new_child = self.adjust_function(new_child, self.cfg)
+                        if self.valid_function is not None and not self.valid_function(new_child, self.cfg):
+                            if stats is not None: stats["rejected"] += 1
+                            continue
+                        if stats is not None and new_child == child: stats["unchanged"] += 1
+                        child = new_child
+                        mutated_block_ids |= block_ids
+                        break
+                child_list[idx] = child
+        return child_list
+
+
+    def generate(self, select_function, num, minor_mutation=False, stats=None):
+        """Generate num children, ea_crossover_ratio of them by the crossover of two parents, the others and
+        the rejected crossovers by space_block_num mutations.
+
+        :param select_function: select a parent from the population, e.g. Population.select_parent, the mate
+                                of the crossover is selected by select_mate
+        """
+        rng = np.random.default_rng(np.random.randint(1 << 31))
+        parent_list = [ArchSpec.from_list(select_function()) for _ in range(num)]
+        child_list = [None] * num
+        is_crossover = rng.random(num) < self.cfg.ea_crossover_ratio
+        for idx in np.nonzero(is_crossover)[0].tolist():
+            child_list[idx] = self.crossover(parent_list[idx], select_mate(parent_list[idx], select_function),
+                                             rng=rng, stats=stats)
+
+        mutate_idx_list = [idx for idx in range(num) if child_list[idx] is None]
+        mutated_list = self.mutate([parent_list[idx] for idx in mutate_idx_list], minor_mutation, rng, stats=stats)
+        for idx, child in zip(mutate_idx_list, mutated_list):
+            child_list[idx] = child
+        return child_list
@@ -0,0 +1,101 @@
+# Copyright (c) 2021-2022 Alibaba Group Holding Limited.
+
+import os, sys
+import bisect
+import numpy as np
+
+
+def dominates(objective_a, objective_b):
+    # all the objectives are minimized, the objectives are the tuples of floats
+    return objective_a != objective_b and all([x <= y for x, y in zip(objective_a, objective_b)])
+
+
+def fast_non_dominated_sort(objectives):
+    """Get the front rank of each solution, 0 for the Pareto front, all the objectives are minimized.
+
+    :param objectives: array of shape (N, M)
+    The efficient non-dominated sort with the binary search (ENS-BS): the solutions are sorted
+    lexicographically, so a solution is never dominated by the later ones, and it is put into the first
+    front without a solution dominating it, found by the binary search over the fronts. With 2 objectives
+    the last solution of a front dominates the solution if any of them does, so the sort is O(N log N).
+    """
+    objectives = np.asarray(objectives, dtype=np.float64)
+    num_solutions, num_objectives = objectives.shape
+    front_rank = np.zeros(num_solutions, dtype=np.int64)
+    if num_solutions == 0:
+        return front_rank
+
+    objective_list = [tuple(x) for x in objectives.tolist()]
+    sort_idx = np.lexsort(objectives.T[::-1]).tolist()
+    front_list = []
+    for idx in sort_idx:
+        objective = objective_list[idx]
+        low, high = 0, len(front_list)
+        while low < high:
+            mid = (low + high)//2
+            if num_objectives == 2:
+                # the last solution of the front has the smallest second objective
+                is_dominated = dominates(front_list[mid][-1], objective)
+            else:
+                # the later solutions of the front are closer to the solution
+                is_dominated = False
+                for front_objective in reversed(front_list[mid]):
+                    if dominates(front_objective, objective):
+                        is_dominated = True
+                        break
+            if is_dominated: low = mid + 1
+            else: high = mid
+        if low == len(front_list):
+            front_list.append([])
+        front_list[low].append(objective)
+        front_rank[idx] = low
+    return front_rank
+
+
+def get_crowding_distance(objectives, front_rank):
+    """Get the crowding distance of each solution in its front, inf for the boundary solutions."""
+    objectives = np.asarray(objectives, dtype=np.float64)
+    crowding_distance = np.zeros(len(objectives))
+    for rank in np.unique(front_rank):
+        front_idx = np.nonzero(front_rank == rank)[0]
+        for objective in objectives[front_idx].T:
+            sort_idx = np.argsort(objective, kind="stable")
+            sorted_objective = objective[sort_idx]
+            crowding_distance[front_idx[sort_idx[[0, -1]]]] = np.inf
+            value_range = sorted_objective[-1] - sorted_objective[0]
+            if len(front_idx) <= 2 or not np.isfinite(value_range) or value_range == 0:
+                continue
+            crowding_distance[front_idx[sort_idx[1:-1]]] += (sorted_objective[2:] - sorted_objective[:-2])/value_range
+    return crowding_distance
+
+
+def get_nsga_order(objectives):
+    """Get the indices of the solutions sorted by the front rank, then by the crowding distance descending."""
+    front_rank = fast_non_dominated_sort(objectives)
+    crowding_distance = get_crowding_distance(objectives, front_rank)
+    return list(np.lexsort((-crowding_distance, front_rank)))
+
+
+def get_budget_best(front_list, metrics, budget_dict):
+    """Get the index of the best acc in the Pareto front for each budget, None if no solution meets the budget.
+
+    :param front_list: the indices of the Pareto front
+    :param metrics: {key: list}, with the acc and the keys of the budgets
+    :param budget_dict: {key: list of budgets}, e.g. {"flops": [1e9, 2e9]}
+    :return: {(key, budget): index}
+    """
+    budget_best = {}
+    for key, budget_list in budget_dict.items():
+        # the front sorted by the budget key, the best acc under a budget is the prefix maximum
+        sorted_front = sorted(front_list, key=lambda idx: metrics[key][idx])
+        sorted_values = [metrics[key][idx] for idx in sorted_front]
+        prefix_best = []
+        for idx in sorted_front:
+            if len(prefix_best) == 0 or metrics["acc"][idx] > metrics["acc"][prefix_best[-1]]:
+                prefix_best.append(idx)
+            else:
+                prefix_best.append(prefix_best[-1])
+        for budget in budget_list:
+            num_under_budget = bisect.bisect_right(sorted_values, budget)
+            budget_best[(key, budget)] = prefix_best[num_under_budget - 1] if num_under_budget > 0 else None
+    return budget_best
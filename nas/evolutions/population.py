@@ -2,15 +2,21 @@
 
 import os
 import sys
+import heapq
+import random
 import numpy as np
 from abc import ABCMeta, abstractmethod
 
+from .arch_spec import ArchSpec
+from .pareto import fast_non_dominated_sort, get_nsga_order
+
 
 class Population(metaclass=ABCMeta):
     def __init__(self, cfg, logger):
         self.cfg = cfg
         self.logger=logger
         self.popu_size = cfg.ea_popu_size
+        self.genome_codec = None
         self.init_population()
         self.logger.info('****** Successfully build the Population ******')
 
@@ -26,6 +32,9 @@ class Population(metaclass=ABCMeta):
         self.popu_layers_list = []
         self.popu_stages_list = []
         if self.cfg.budget_mcu_max_feature is not None: self.popu_max_feature_list = []
+        if self.cfg.budget_mcu_arena is not None: self.popu_arena_list = []
+        # the number of evaluated nets when the individual is born, for the aging survivors
+        if self.cfg.ea_survivor == "aging": self.popu_birth_list = []
 
     def update_population(self, model_info):
         if "score" not in model_info.keys():
@@ -44,7 +53,7 @@ class Population(metaclass=ABCMeta):
         else:
             insert_idx = 0
 
-        self.popu_structure_list.insert(insert_idx, model_info["structure_info"])
+        self.popu_structure_list.insert(insert_idx, ArchSpec.from_list(model_info["structure_info"]))
         self.popu_acc_list.insert(insert_idx, acc_temp)
         self.popu_score_list.insert(insert_idx, model_info["score"])
         self.popu_params_list.insert(insert_idx, model_info["params"])
@@ -54,26 +63,40 @@ class Population(metaclass=ABCMeta):
         self.popu_stages_list.insert(insert_idx,  model_info["stages"])
         if hasattr(self, "popu_max_feature_list"): 
             self.popu_max_feature_list.insert(insert_idx,  model_info["max_feature"])
+        if hasattr(self, "popu_arena_list"): 
+            self.popu_arena_list.insert(insert_idx,  model_info["arena"])
+        if hasattr(self, "popu_birth_list"): 
+            self.popu_birth_list.insert(insert_idx,  model_info.get("birth", self.num_evaluated_nets_count))
 
 
     def rank_population(self, maintain_popu=False):
         # filter out the duplicate structure
         unique_structure_set = set()
-        unique_idx_list = []
+        unique_idx_set = set()
         for the_idx, the_strucure in enumerate(self.popu_structure_list):
-            if str(the_strucure) in unique_structure_set:
+            if the_strucure in unique_structure_set:
                 continue
-            unique_structure_set.add(str(the_strucure))
-            unique_idx_list.append(the_idx)
+            unique_structure_set.add(the_strucure)
+            unique_idx_set.add(the_idx)
 
         # sort population list, pop the duplicate structure, and maintain the population
         sort_idx = list(np.argsort(self.popu_acc_list))
         sort_idx = sort_idx[::-1]
-        for idx in sort_idx:
-            if idx not in unique_idx_list:
-                sort_idx.remove(idx)
-        if maintain_popu: sort_idx = sort_idx[0:self.popu_size]
-        
+        sort_idx = [idx for idx in sort_idx if idx in unique_idx_set]
+        if maintain_popu and len(sort_idx) > self.popu_size:
+            if self.cfg.ea_multi_objective is not None:
+                sort_idx = self.get_nsga_survivors(sort_idx)
+            elif self.cfg.ea_survivor == "aging":
+                sort_idx = self.get_aging_survivors(sort_idx)
+            elif self.cfg.ea_survivor == "crowding":
+                sort_idx = self.get_crowding_survivors(sort_idx)
+            else:
+                sort_idx = sort_idx[0:self.popu_size]
+        self.select_individuals(sort_idx)
+
+
+    def select_individuals(self, sort_idx):
+        # keep the individuals of sort_idx in its order
         self.popu_structure_list = [self.popu_structure_list[idx] for idx in sort_idx]
         self.popu_acc_list = [self.popu_acc_list[idx] for idx in sort_idx]
         self.popu_score_list = [self.popu_score_list[idx] for idx in sort_idx]
@@ -84,6 +107,101 @@ class Population(metaclass=ABCMeta):
         self.popu_stages_list = [self.popu_stages_list[idx] for idx in sort_idx]
         if hasattr(self, "popu_max_feature_list"): 
             self.popu_max_feature_list = [self.popu_max_feature_list[idx] for idx in sort_idx]
+        if hasattr(self, "popu_arena_list"): 
+            self.popu_arena_list = [self.popu_arena_list[idx] for idx in sort_idx]
+        if hasattr(self, "popu_birth_list"): 
+            self.popu_birth_list = [self.popu_birth_list[idx] for idx in sort_idx]
+
+
+    def get_objectives(self, idx_list):
+        # the objectives minimized by the multi-objective search, the acc is maximized
+        objective_lists = [[-x for x in self.popu_acc_list]] + \
+            [getattr(self, "popu_%s_list"%(key)) for key in self.cfg.ea_multi_objective]
+        return np.array([[x[idx] for x in objective_lists] for idx in idx_list], dtype=np.float64)
+
+
+    def get_nsga_survivors(self, sort_idx):
+        """Keep the individuals of the NSGA-II order, by the rank of the non-dominated fronts over the acc and
+        the metrics of ea_multi_objective, then by the crowding distance in the front. sort_idx is sorted by acc,
+        so is the result."""
+        nsga_order = get_nsga_order(self.get_objectives(sort_idx))
+        survivor_idx_set = set([sort_idx[pos] for pos in nsga_order[:self.popu_size]])
+        return [idx for idx in sort_idx if idx in survivor_idx_set]
+
+
+    def keep_pareto_front(self):
+        # remove the duplicate and the dominated individuals
+        self.rank_population()
+        front_rank = fast_non_dominated_sort(self.get_objectives(range(len(self.popu_acc_list))))
+        self.select_individuals([idx for idx in range(len(self.popu_acc_list)) if front_rank[idx] == 0])
+
+
+    def get_aging_survivors(self, sort_idx):
+        """Keep the youngest individuals of the regularized evolution, and the best one regardless of its age,
+        so the result is the best individual ever found. sort_idx is sorted by acc, so is the result."""
+        youngest_idx = heapq.nlargest(self.popu_size - 1, sort_idx[1:], key=lambda idx: self.popu_birth_list[idx])
+        survivor_idx_set = set([sort_idx[0]] + youngest_idx)
+        return [idx for idx in sort_idx if idx in survivor_idx_set]
+
+
+    def get_crowding_survivors(self, sort_idx):
+        """Keep the best individuals which differ from all the better survivors in at least ea_crowding_distance
+        values of the genomes, then fill the population with the best of the others. sort_idx is sorted by acc."""
+        genomes = self.genome_codec.encode_list([self.popu_structure_list[idx] for idx in sort_idx])
+        survivor_pos_list = [0]
+        crowded_pos_list = []
+        for pos in range(1, len(sort_idx)):
+            if len(survivor_pos_list) == self.popu_size:
+                break
+            distance = np.count_nonzero(genomes[survivor_pos_list] != genomes[pos], axis=1).min()
+            if distance >= self.cfg.ea_crowding_distance:
+                survivor_pos_list.append(pos)
+            else:
+                crowded_pos_list.append(pos)
+        crowded_pos_list += list(range(pos + 1, len(sort_idx)))
+        survivor_pos_set = set(survivor_pos_list + crowded_pos_list[:self.popu_size - len(survivor_pos_list)])
+        return [idx for pos, idx in enumerate(sort_idx) if pos in survivor_pos_set]
+
+
+    def select_parent(self, exclude=None):
+        """Select the parent of the mutation, uniformly from the population, or the best of ea_tournament_size
+        individuals sampled uniformly, which is a non-dominated one for the multi-objective search.
+
+        :param exclude: select among the individuals other than this structure, e.g. the mate of the crossover,
+                        None if there is no other individual
+        """
+        candidate_idx = range(len(self.popu_structure_list))
+        if exclude is not None:
+            candidate_idx = [idx for idx in candidate_idx if self.popu_structure_list[idx] != exclude]
+            if len(candidate_idx) == 0:
+                return None
+        if self.cfg.ea_selection == "tournament":
+            sample_idx = random.sample(candidate_idx, min(self.cfg.ea_tournament_size, len(candidate_idx)))
+            if self.cfg.ea_multi_objective is not None:
+                # any of the non-dominated samples, the best acc is always one of them
+                front_rank = fast_non_dominated_sort(self.get_objectives(sample_idx))
+                return self.popu_structure_list[random.choice([idx for idx, rank in zip(sample_idx, front_rank) if rank == 0])]
+            return self.popu_structure_list[max(sample_idx, key=lambda idx: self.popu_acc_list[idx])]
+        return self.popu_structure_list[random.choice(candidate_idx)]
+
+    def get_metric_keys(self):
+        # the model info kept in the population, as the lists of popu_<key>_list
+        metric_keys = ["acc", "score", "params", "flops", "latency", "layers", "stages"]
+        if hasattr(self, "popu_max_feature_list"): metric_keys.append("max_feature")
+        if hasattr(self, "popu_arena_list"): metric_keys.append("arena")
+        if hasattr(self, "popu_birth_list"): metric_keys.append("birth")
+        return metric_keys
+
+
+    def get_model_info_keys(self):
+        # the metrics of an evaluated net, the acc and the birth are given by the population
+        return [key for key in self.get_metric_keys() if key not in ["acc", "birth"]]
+
+
+    def set_genome_codec(self, genome_codec):
+        # export and merge the structures as the packed genomes, see GenomeCodec
+        self.genome_codec = genome_codec
+
 
     def gen_random_structure_net(self,):
         pass
@@ -102,10 +220,19 @@ class Population(metaclass=ABCMeta):
             self.popu_stages_list += popu_nas_info.popu_stages_list
             if hasattr(self, "popu_max_feature_list"): 
                 self.popu_max_feature_list += popu_nas_info.popu_max_feature_list
+            if hasattr(self, "popu_arena_list"): 
+                self.popu_arena_list += popu_nas_info.popu_arena_list
+            if hasattr(self, "popu_birth_list"): 
+                self.popu_birth_list += popu_nas_info.popu_birth_list
 
         if isinstance(popu_nas_info, dict):
             if update_num: self.num_evaluated_nets_count = popu_nas_info["num_evaluated_nets_count"]
-            self.popu_structure_list += popu_nas_info["popu_structure_list"]
+            if "popu_genome_packed" in popu_nas_info:
+                self.genome_codec.check_fingerprint(popu_nas_info["genome_fingerprint"])
+                genomes = self.genome_codec.unpack(popu_nas_info["popu_genome_packed"])
+                self.popu_structure_list += self.genome_codec.decode_list(genomes)
+            else:
+                self.popu_structure_list += [ArchSpec.from_list(x) for x in popu_nas_info["popu_structure_list"]]
             self.popu_acc_list += popu_nas_info["popu_acc_list"]
             self.popu_score_list += popu_nas_info["popu_score_list"]
             self.popu_params_list += popu_nas_info["popu_params_list"]
@@ -115,16 +242,27 @@ class Population(metaclass=ABCMeta):
             self.popu_stages_list += popu_nas_info["popu_stages_list"]
             if hasattr(self, "popu_max_feature_list"): 
                 self.popu_max_feature_list += popu_nas_info["popu_max_feature_list"]
+            if hasattr(self, "popu_arena_list"): 
+                self.popu_arena_list += popu_nas_info["popu_arena_list"]
+            if hasattr(self, "popu_birth_list"): 
+                # the individuals of a population saved without aging are the oldest
+                self.popu_birth_list += popu_nas_info.get("popu_birth_list", [0]*len(popu_nas_info["popu_acc_list"]))
 
         self.rank_population(maintain_popu=True)
 
 
-    def export_dict(self,):
+    def export_dict(self, packed=False):
+        """Export the population, the structures are the packed genomes of GenomeCodec if packed."""
         popu_nas_info = {}
         self.rank_population(maintain_popu=True)
 
         popu_nas_info["num_evaluated_nets_count"] = self.num_evaluated_nets_count
-        popu_nas_info["popu_structure_list"] = self.popu_structure_list
+        if packed and self.genome_codec is not None:
+            popu_nas_info["genome_fingerprint"] = self.genome_codec.fingerprint
+            genomes = self.genome_codec.encode_list(self.popu_structure_list)
+            popu_nas_info["popu_genome_packed"] = self.genome_codec.pack(genomes)
+        else:
+            popu_nas_info["popu_structure_list"] = [x.to_list() for x in self.popu_structure_list]
         popu_nas_info["popu_acc_list"] = self.popu_acc_list
         popu_nas_info["popu_score_list"] = self.popu_score_list
         popu_nas_info["popu_params_list"] = self.popu_params_list
@@ -134,15 +272,20 @@ class Population(metaclass=ABCMeta):
         popu_nas_info["popu_stages_list"] = self.popu_stages_list
         if hasattr(self, "popu_max_feature_list"): 
             popu_nas_info["popu_max_feature_list"] = self.popu_max_feature_list
+        if hasattr(self, "popu_arena_list"): 
+            popu_nas_info["popu_arena_list"] = self.popu_arena_list
+        if hasattr(self, "popu_birth_list"): 
+            popu_nas_info["popu_birth_list"] = self.popu_birth_list
         
         return popu_nas_info
 
 
-    def get_individual_info(self, idx=0, is_struct=False):
+    def get_individual_info(self, idx=0, is_struct=False, rank=True):
+        # rank=False reads the idx of the current order, e.g. the indices computed on a ranked population
         individual_info = {}
-        self.rank_population(maintain_popu=True)
+        if rank: self.rank_population(maintain_popu=True)
         
-        if is_struct: individual_info["structure"] = self.popu_structure_list[idx]
+        if is_struct: individual_info["structure"] = self.popu_structure_list[idx].to_list()
         individual_info["acc"] = self.popu_acc_list[idx]
         individual_info["score"] = self.popu_score_list[idx]
         individual_info["params"] = self.popu_params_list[idx]
@@ -152,5 +295,7 @@ class Population(metaclass=ABCMeta):
         individual_info["stages"] = self.popu_stages_list[idx]
         if hasattr(self, "popu_max_feature_list"): 
             individual_info["max_feature"] = self.popu_max_feature_list[idx]
+        if hasattr(self, "popu_arena_list"): 
+            individual_info["arena"] = self.popu_arena_list[idx]
         
         return individual_info
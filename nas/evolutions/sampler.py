@@ -0,0 +1,130 @@
+# Copyright (c) 2021-2022 Alibaba Group Holding Limited.
+
+import os, sys
+import random
+
+from .arch_spec import BlockSpec, ArchSpec
+
+
+def get_block_layers(block_structure_info):
+    # the same number of conv layers as the budget_layers check in the search
+    if "L" not in block_structure_info:
+        return 1
+    elif block_structure_info['class'] in ["SuperResConvK1KX", "SuperResConvKXKX"]:
+        return block_structure_info['L']*2
+    else:
+        return block_structure_info['L']*3
+
+
+def get_rejection_stats(stats):
+    # the rejected proposals are invalid, the unchanged ones are valid but the same as the parent
+    stats = dict(stats)
+    proposals = max(1, stats["proposals"])
+    stats["rejection_rate"] = stats["rejected"]/proposals
+    stats["wasted_rate"] = (stats["rejected"] + stats.get("unchanged", 0))/proposals
+    return stats
+
+
+class FeasibleSampler():
+    def __init__(self, choices_function, cfg, adjust_function=None, valid_function=None):
+        """Sample the mutations only from the feasible values of the blocks, so no proposal is wasted.
+
+        :param choices_function: get_mutation_choices of the space, which lists the results of the
+                                 mutation for a block as (mutate method, new blocks from the block)
+        :param adjust_function: adjust_structures of the search, applied to the sampled architecture
+        :param valid_function: the budget check of the search, only to count the rejected proposals
+        The choices are filtered up front by the input channels from the neighbour blocks, the kernel
+        sizes limited by the resolution, budget_layers and budget_stages, and the unchanged results.
+        """
+        self.choices_function = choices_function
+        self.cfg = cfg
+        self.adjust_function = adjust_function
+        self.valid_function = valid_function
+        self.stats = {"proposals": 0, "rejected": 0, "unchanged": 0, "choices": 0, "infeasible": 0, "duplicate": 0}
+
+
+    def get_arch_info(self, arch):
+        # the input resolution of the blocks, the layers and the stages of the architecture
+        resolution_list = []
+        resolution = self.cfg.budget_image_size
+        for block in arch:
+            resolution_list.append(resolution)
+            resolution /= block['s']
+        layers = sum([get_block_layers(block) for block in arch])
+        stages = sum([1 for block in arch if block['s'] == 2])
+        return resolution_list, layers, stages
+
+
+    def fit_blocks(self, arch, block_id, new_blocks, resolution_list):
+        # the same input channels and kernel sizes as adjust_structures
+        last_channels = arch[block_id-1]['out'] if block_id > 0 else None
+        fitted_blocks = []
+        for idx, new_block in enumerate(new_blocks):
+            changes = {}
+            if last_channels is not None and new_block['in'] != last_channels:
+                changes['in'] = last_channels
+            last_channels = new_block['out']
+            kernel_size = new_block['k']
+            while kernel_size * 1.5 > resolution_list[block_id+idx]:
+                kernel_size -= 2
+            if kernel_size != new_block['k']:
+                changes['k'] = kernel_size
+            new_block = new_block if isinstance(new_block, BlockSpec) else BlockSpec(new_block)
+            fitted_blocks.append(new_block.replace(**changes) if len(changes) > 0 else new_block)
+        return tuple(fitted_blocks)
+
+
+    def get_feasible_choices(self, arch, block_id, minor_mutation=False, arch_info=None):
+        """Get the feasible choices of the block as {mutate method: [new blocks]}."""
+        resolution_list, layers, stages = self.get_arch_info(arch) if arch_info is None else arch_info
+        feasible_choices = {}
+        seen_blocks = set()
+        for method, new_blocks in self.choices_function(block_id, arch, self.cfg.budget_layers, minor_mutation=minor_mutation):
+            self.stats["choices"] += 1
+            old_blocks = tuple(arch[block_id:block_id+len(new_blocks)])
+            new_blocks = self.fit_blocks(arch, block_id, new_blocks, resolution_list)
+            if new_blocks == old_blocks or new_blocks in seen_blocks:
+                self.stats["duplicate"] += 1
+                continue
+            new_layers = layers + sum([get_block_layers(x) for x in new_blocks]) - sum([get_block_layers(x) for x in old_blocks])
+            new_stages = stages + sum([1 for x in new_blocks if x['s'] == 2]) - sum([1 for x in old_blocks if x['s'] == 2])
+            if (self.cfg.budget_layers is not None and new_layers > self.cfg.budget_layers) or \
+                (self.cfg.budget_stages is not None and new_stages > self.cfg.budget_stages):
+                self.stats["infeasible"] += 1
+                continue
+            seen_blocks.add(new_blocks)
+            feasible_choices.setdefault(method, []).append(new_blocks)
+        return feasible_choices
+
+
+    def sample(self, arch, minor_mutation=False):
+        """Mutate one block uniformly from the blocks with feasible choices, then the method and the value.
+
+        The architecture is returned unchanged when no block can be mutated.
+        """
+        arch = ArchSpec.from_list(arch)
+        arch_info = self.get_arch_info(arch)
+        block_id_list = list(range(1 if self.cfg.space_exclude_stem else 0, len(arch)))
+        random.shuffle(block_id_list)
+        for block_id in block_id_list:
+            feasible_choices = self.get_feasible_choices(arch, block_id, minor_mutation=minor_mutation, arch_info=arch_info)
+            if len(feasible_choices) == 0:
+                continue
+            method = random.choice(sorted(feasible_choices.keys()))
+            new_blocks = random.choice(feasible_choices[method])
+            new_arch = ArchSpec(arch[:block_id]._blocks + new_blocks + arch[block_id+len(new_blocks):]._blocks)
+            if self.adjust_function is not None:
+                new_arch = self.adjust_function(new_arch, self.cfg)
+            self.stats["proposals"] += 1
+            if self.valid_function is not None and not self.valid_function(new_arch, self.cfg):
+                self.stats["rejected"] += 1
+            elif new_arch == arch:
+                self.stats["unchanged"] += 1
+            return new_arch
+        return arch
+
+
+    def get_stats(self):
+        stats = get_rejection_stats(self.stats)
+        stats["infeasible_rate"] = self.stats["infeasible"]/max(1, self.stats["choices"])
+        return stats
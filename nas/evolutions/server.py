@@ -0,0 +1,57 @@
+# Copyright (c) 2021-2022 Alibaba Group Holding Limited.
+
+import os, sys
+import random
+
+from .offspring import select_mate
+
+
+def get_child_message(model_info, genome_codec, metric_keys):
+    """Get the message of an evaluated child for the PopulationServer, the genome and the metrics if it
+    satisfies the budgets."""
+    child_message = {"genome": genome_codec.encode(model_info["structure_info"]),
+                     "is_satify_budget": model_info["is_satify_budget"]}
+    if model_info["is_satify_budget"]:
+        child_message.update({key: model_info[key] for key in metric_keys})
+    return child_message
+
+
+class PopulationServer():
+    def __init__(self, popu_nas, cfg):
+        """The authoritative population of the steady-state evolution.
+
+        The workers fetch one parent at a time and push back its evaluated child, so the selection always sees
+        the latest population and no worker waits for a sync. The structures are sent as the genomes of
+        popu_nas.genome_codec, so the messages are small.
+        """
+        self.popu_nas = popu_nas
+        self.cfg = cfg
+
+
+    def get_parent_message(self):
+        # the same selection and minor_mutation as do_main_job on the latest population
+        parent = self.popu_nas.select_parent()
+        # the second parent of the crossover, different from the parent, None if there is no other individual
+        is_crossover = self.cfg.ea_crossover_ratio > 0 and random.random() < self.cfg.ea_crossover_ratio
+        mate = select_mate(parent, self.popu_nas.select_parent) if is_crossover else None
+        minor_mutation = self.cfg.space_minor_mutation and \
+            self.popu_nas.num_evaluated_nets_count > self.cfg.space_minor_iter
+        # the worst acc of the full population, below which the surrogate of the worker skips the scoring
+        min_acc = min(self.popu_nas.popu_acc_list) if len(self.popu_nas.popu_acc_list) >= self.cfg.ea_popu_size else None
+        return {"parent": self.popu_nas.genome_codec.encode(parent), "minor_mutation": minor_mutation, "min_acc": min_acc,
+                "is_crossover": is_crossover, "mate": self.popu_nas.genome_codec.encode(mate) if mate is not None else None}
+
+
+    def put_child_message(self, child_message):
+        self.popu_nas.num_evaluated_nets_count += 1
+        if not child_message["is_satify_budget"]:
+            return
+        model_info = dict(child_message)
+        model_info["structure_info"] = self.popu_nas.genome_codec.decode(model_info.pop("genome"))
+        self.popu_nas.update_population(model_info)
+        if len(self.popu_nas.popu_structure_list) > self.cfg.ea_popu_size:
+            self.popu_nas.rank_population(maintain_popu=True)
+
+
+    def is_done(self):
+        return self.popu_nas.num_evaluated_nets_count >= self.cfg.ea_num_random_nets
@@ -0,0 +1,153 @@
+# Copyright (c) 2021-2022 Alibaba Group Holding Limited.
+
+import os, sys
+import random
+import numpy as np
+
+from .arch_spec import ArchSpec
+from .checkpoint import read_evaluation_log
+
+
+def get_surrogate_stats(stats_list):
+    # the stats of the surrogates on all the ranks, with the evaluations saved and the rate of the audited
+    # mutants which would enter the population
+    stats = {key: sum([x[key] for x in stats_list]) for key in ["trainings", "passed", "screened", "audited", "wrong"]}
+    stats["saved"] = stats["screened"] - stats["audited"]
+    stats["wrong_rate"] = stats["wrong"]/max(1, stats["audited"])
+    return stats
+
+
+class Surrogate():
+    def __init__(self, genome_codec, cfg, logger):
+        """The online ridge regression of the acc on the genome, to skip the evaluation of the mutants
+        which are unlikely to enter the population.
+
+        The features are the genome values and their log, so a mutant is screened before its masternet is
+        built and scored. The model is retrained every ea_surrogate_retrain evaluated nets, and its error is
+        measured on the latest ea_surrogate_holdout of them, which are not used to fit it. A mutant is screened
+        out if its predicted acc is below the worst acc of the full population by more than ea_surrogate_margin
+        times the error. ea_surrogate_audit of the screened mutants are still evaluated, to count how often the
+        surrogate is wrong, i.e. the screened mutant would enter the population.
+        """
+        self.genome_codec = genome_codec
+        self.cfg = cfg
+        self.logger = logger
+        self.genome_list = []
+        self.acc_list = []
+        self.num_trained = 0
+        self.weights = None
+        self.rmse = None
+        # the min_acc of the audited mutant, which is checked by update after its evaluation
+        self.audit_min_acc = None
+        self.stats = {"trainings": 0, "passed": 0, "screened": 0, "audited": 0, "wrong": 0}
+
+
+    def get_acc(self, model_info):
+        # the acc of the population, see Population.update_population
+        if self.cfg.score_flop_ratio is not None:
+            return model_info["score"] + self.cfg.score_flop_ratio*model_info["flops"]
+        return model_info["score"]
+
+
+    def get_features(self, genomes):
+        genomes = np.asarray(genomes, dtype=np.float64)
+        return np.concatenate([genomes, np.log1p(np.abs(genomes))], axis=1)
+
+
+    def add(self, structure_info, acc):
+        """Add an evaluated net, and retrain the model every ea_surrogate_retrain nets."""
+        self.genome_list.append(self.genome_codec.encode(ArchSpec.from_list(structure_info)))
+        self.acc_list.append(acc)
+        if len(self.acc_list) - self.num_trained >= self.cfg.ea_surrogate_retrain:
+            self.train()
+
+
+    def load(self, filename_list, num_trained=None):
+        """Add the nets of the evaluation logs of the previous searches, the structures out of this search space
+        are skipped. The scores must come from the same score config.
+
+        :param num_trained: train with the first num_trained nets as the saved search, all the nets if None
+        """
+        num_loaded = 0
+        for filename in filename_list:
+            structure_list, metrics = read_evaluation_log(filename)
+            for idx, structure_info in enumerate(structure_list):
+                try:
+                    genome = self.genome_codec.encode(structure_info)
+                except (ValueError, KeyError):
+                    continue
+                self.genome_list.append(genome)
+                self.acc_list.append(self.get_acc({key: value[idx] for key, value in metrics.items()}))
+                num_loaded += 1
+        self.logger.info('surrogate: load %d evaluated nets of %d evaluation logs'%(num_loaded, len(filename_list)))
+        self.train(num_trained)
+
+
+    def train(self, num_trained=None):
+        """Train the model with the latest ea_surrogate_max_samples of the first num_trained nets."""
+        self.num_trained = len(self.acc_list) if num_trained is None else num_trained
+        num_samples = min(self.num_trained, self.cfg.ea_surrogate_max_samples)
+        num_holdout = int(num_samples * self.cfg.ea_surrogate_holdout)
+        if num_samples - num_holdout < 2 or num_holdout < 1:
+            return
+        features = self.get_features(self.genome_list[self.num_trained - num_samples:self.num_trained])
+        accs = np.asarray(self.acc_list[self.num_trained - num_samples:self.num_trained], dtype=np.float64)
+        # the error on the latest nets, which are the closest to the next mutants
+        weights = self.fit(features[:-num_holdout], accs[:-num_holdout])
+        self.rmse = float(np.sqrt(np.mean((self.predict_features(weights, features[-num_holdout:]) - accs[-num_holdout:])**2)))
+        self.weights = self.fit(features, accs)
+        self.stats["trainings"] += 1
+        self.logger.info('surrogate: train with %d nets, rmse=%.4g'%(num_samples, self.rmse))
+
+
+    def fit(self, features, accs):
+        # the closed-form ridge regression on the standardized features
+        mean, std = features.mean(axis=0), features.std(axis=0)
+        std[std == 0] = 1.0
+        x = (features - mean)/std
+        acc_mean = accs.mean()
+        coef = np.linalg.solve(x.T @ x + self.cfg.ea_surrogate_alpha*np.eye(x.shape[1]), x.T @ (accs - acc_mean))
+        return mean, std, coef, acc_mean
+
+
+    def predict_features(self, weights, features):
+        mean, std, coef, acc_mean = weights
+        return ((features - mean)/std) @ coef + acc_mean
+
+
+    def predict(self, structure_info):
+        features = self.get_features([self.genome_codec.encode(ArchSpec.from_list(structure_info))])
+        return float(self.predict_features(self.weights, features)[0])
+
+
+    def screen(self, structure_info, min_acc):
+        """Whether to skip the evaluation of the net, it is unlikely to have an acc above min_acc.
+
+        :param min_acc: the worst acc of the full population, None if it is not full
+        :return: True to skip the evaluation, the audited nets are evaluated and checked by update
+        """
+        self.audit_min_acc = None
+        if self.weights is None or min_acc is None:
+            return False
+        if self.predict(structure_info) + self.cfg.ea_surrogate_margin*self.rmse >= min_acc:
+            self.stats["passed"] += 1
+            return False
+        self.stats["screened"] += 1
+        if random.random() < self.cfg.ea_surrogate_audit:
+            self.stats["audited"] += 1
+            self.audit_min_acc = min_acc
+            return False
+        return True
+
+
+    def update(self, model_info):
+        """Add the evaluated net, the audited one was screened by mistake if its acc is above the min_acc
+        of its screening."""
+        audit_min_acc, self.audit_min_acc = self.audit_min_acc, None
+        if not model_info["is_satify_budget"]:
+            return
+        acc = self.get_acc(model_info)
+        if audit_min_acc is not None and acc >= audit_min_acc:
+            self.stats["wrong"] += 1
+        self.add(model_info["structure_info"], acc)
+
@@ -230,8 +230,8 @@ class ResConvK1KX(nn.Module):
 
     def get_log_zen_score(self, **kwarg):
         if "init_std" in kwarg and "init_std_act" in kwarg and hasattr(self, "nbitsA"):
-            conv1_std = np.log(STD_BITS_LUT[kwarg["init_std_act"]][self.nbitsA[0]]*STD_BITS_LUT[kwarg["init_std"]][self.nbitsW[0]])-np.log(kwarg["init_std_act"])
-            conv2_std = np.log(STD_BITS_LUT[kwarg["init_std_act"]][self.nbitsA[1]]*STD_BITS_LUT[kwarg["init_std"]][self.nbitsW[1]])-np.log(kwarg["init_std_act"])
+            # the std factors of all the inner layers are computed at once
+            conv1_std, conv2_std = np.log(get_std_bits_factor(kwarg["init_std_act"], self.nbitsA)*get_std_bits_factor(kwarg["init_std"], self.nbitsW))-np.log(kwarg["init_std_act"])
 
             return [np.log(np.sqrt(self.in_channels)) + conv1_std + \
                     np.log(np.sqrt(self.bottleneck_channels * self.kernel_size ** 2)) + conv2_std]
@@ -249,6 +249,10 @@ class ResConvK1KX(nn.Module):
 
         return max_featmap_list
 
+    def get_tensor_graph(self, graph, x, resolution, nbitsA_out=8, prefix=""):
+        return get_residual_tensor_graph(self, graph, x, resolution, nbitsA_out=nbitsA_out, prefix=prefix,
+                    is_reslink=True, is_proj=self.in_channels != self.out_channels or self.force_resproj)
+
 
 class SuperResConvK1KX(BaseSuperBlock):
     def __init__(self, structure_info, no_create=False,
@@ -6,10 +6,14 @@ import torch
 import numpy as np
 from torch import nn, Tensor
 from torch.nn import functional as F
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+from torch.utils.checkpoint import checkpoint
 
 from .qconv import QConv2d
+from .quant_std import get_std_bits_factor
 
 
+# reserved for reference, the factors are computed by get_std_bits_factor for any std and nbits
 STD_BITS_LUT = {
     1: {2: 1.0089193649965897, 3: 1.0408034134404924, 4: 1.0408329944621844, 5: 1.0408329944621846, 6: 1.0408329944621846, 7: 1.0408329944621846, 8: 1.0408329944621846}, 
     2: {2: 1.470493611987268, 3: 1.9441392428674842, 4: 2.020625612100753, 5: 2.020725942163689, 6: 2.0207259421636903, 7: 2.0207259421636903, 8: 2.0207259421636903}, 
@@ -24,6 +28,8 @@ STD_BITS_LUT = {
 def network_weight_stupid_init(net: nn.Module):
     with torch.no_grad():
         for m in net.modules():
+            if hasattr(m, 'weight') and m.weight is not None and m.weight.is_meta:
+                continue # no values on the meta device, initialized after materialize
             if isinstance(m, nn.Conv2d):
                 device = m.weight.device
                 in_channels, out_channels, k1, k2 = m.weight.shape
@@ -93,6 +99,68 @@ def network_weight_bn_zero_init(net: nn.Module):
     return net
 
 
+def get_checkpoint_function(blocks):
+    # np.random decides dropout_layer in the inner blocks, so its state is replayed in the recomputation like the torch rng
+    np_state = np.random.get_state()
+    is_recompute = [False]
+
+    def run_blocks(x):
+        if is_recompute[0]:
+            np_state_current = np.random.get_state()
+            np.random.set_state(np_state)
+            # the BN running stats are updated by the forward only, not again by the recomputation
+            bn_buffers = [(buffer, buffer.clone()) for block in blocks for m in block.modules()
+                          if isinstance(m, nn.modules.batchnorm._BatchNorm) for buffer in m.buffers()]
+        try:
+            for block in blocks:
+                x = block(x)
+        finally:
+            # the recomputation may be stopped early by torch once the needed tensors are ready
+            if is_recompute[0]:
+                np.random.set_state(np_state_current)
+                with torch.no_grad():
+                    for buffer, value in bn_buffers: buffer.copy_(value)
+            is_recompute[0] = True
+        return x
+
+    return run_blocks
+
+
+def checkpoint_blocks(blocks, x, checkpoint_every):
+    """Run the blocks in sequence, and recompute the activations of every checkpoint_every blocks in backward.
+
+    Only the inputs of the segments are kept in memory, at the cost of one more forward of the blocks.
+    """
+    for start in range(0, len(blocks), checkpoint_every):
+        x = checkpoint(get_checkpoint_function(blocks[start:start+checkpoint_every]), x, use_reentrant=False)
+    return x
+
+
+def get_residual_tensor_graph(block, graph, x, resolution, nbitsA_out=8, prefix="", is_reslink=True, is_proj=True):
+    """Add the ops of a residual inner block to the TensorGraph for memory planning, and return the output tensor id.
+
+    The residual branch is computed first like forward, and added in place to the output of the last conv.
+    """
+    nbitsA = block.nbitsA if block.quant else [8] * len(block.block_list)
+    out_resolution = resolution // block.stride
+    if is_reslink:
+        reslink = x
+        if block.stride == 2:
+            reslink = graph.add_op("%s.residual_downsample"%(prefix), [reslink], out_resolution**2*block.in_channels*nbitsA[0]/8)
+        if is_proj:
+            reslink = graph.add_op("%s.residual_proj"%(prefix), [reslink], out_resolution**2*block.out_channels*nbitsA[0]/8)
+
+    output = x
+    for idx, the_layer in enumerate(block.block_list):
+        nbitsA_next = nbitsA[idx+1] if idx < len(block.block_list)-1 else nbitsA_out
+        output = the_layer.get_tensor_graph(graph, output, resolution, nbitsA_out=nbitsA_next, prefix="%s.conv%d"%(prefix, idx+1))
+        resolution = the_layer.get_output_resolution(resolution)
+
+    if is_reslink:
+        output = graph.add_op("%s.add"%(prefix), [output, reslink], inplace=True)
+    return output
+
+
 class Swish(nn.Module):
     def __init__(self) -> None:
         super().__init__()
@@ -203,6 +271,16 @@ class ConvKXBN(nn.Module):
             output = F.dropout(output, self.dropout_channel, self.training)
         return output
 
+    def fuse_for_deploy(self):
+        # fold bn1 into conv1 for inference, the block cannot be trained or scored afterwards
+        if isinstance(self.bn1, nn.BatchNorm2d):
+            if self.quant:
+                raise ValueError("BN cannot be folded into QConv2d, use convert_to_int8 for the quant model")
+            self.conv1 = fuse_conv_bn_eval(self.conv1, self.bn1)
+            self.bn1 = nn.Identity()
+        self.dropout_channel = None
+        return self
+
     def get_model_size(self, return_list=False):
         if return_list:
             return [self.model_size]
@@ -244,6 +322,10 @@ class ConvKXBN(nn.Module):
 
         return max_feature
 
+    def get_tensor_graph(self, graph, x, resolution, nbitsA_out=8, prefix=""):
+        # the output is stored in the nbits of the next layer input
+        return graph.add_op(prefix, [x], (resolution//self.stride)**2*self.out_channels*nbitsA_out/8)
+
 
 class ConvKXBNRELU(ConvKXBN):
     def __init__(self, structure_info, no_create=False,
@@ -301,7 +383,7 @@ class ConvKXBNRELU(ConvKXBN):
 
     def get_log_zen_score(self, **kwarg):
         if "init_std" in kwarg and "init_std_act" in kwarg and hasattr(self, "nbitsA"):
-            conv_std = np.log(STD_BITS_LUT[kwarg["init_std_act"]][self.nbitsA]*STD_BITS_LUT[kwarg["init_std"]][self.nbitsW])-np.log(kwarg["init_std_act"])
+            conv_std = np.log(get_std_bits_factor(kwarg["init_std_act"], self.nbitsA)*get_std_bits_factor(kwarg["init_std"], self.nbitsW))-np.log(kwarg["init_std_act"])
             return [np.log(np.sqrt(self.in_channels * self.kernel_size**2))+conv_std]
         else:
             return [np.log(np.sqrt(self.in_channels * self.kernel_size**2))]
@@ -350,6 +432,7 @@ class BaseSuperBlock(nn.Module):
         self.no_create = no_create
         self.dropout_channel = dropout_channel
         self.dropout_layer = dropout_layer
+        self.checkpoint_every = None
 
         assert self.stride == 1 or self.stride == 2
 
@@ -400,7 +483,8 @@ class BaseSuperBlock(nn.Module):
                 stride = 1
                 force_resproj = False
 
-            inner_structure_info = copy.deepcopy(structure_info)
+            # the values are only replaced below, so a shallow copy is enough
+            inner_structure_info = dict(structure_info)
             inner_structure_info['in'] = in_channels
             inner_structure_info['out'] = out_channels
             inner_structure_info['s'] = stride
@@ -423,6 +507,9 @@ class BaseSuperBlock(nn.Module):
 
 
     def forward(self, x):
+        if self.checkpoint_every is not None and self.training and torch.is_grad_enabled():
+            return checkpoint_blocks(self.block_list, x, self.checkpoint_every)
+
         output = x
         for block in self.block_list:
             output = block(output)
@@ -483,6 +570,19 @@ class BaseSuperBlock(nn.Module):
         return params
 
 
+    def get_profile_modules(self, prefix):
+        # the inner layers are in the same order as get_params_for_trt
+        profile_modules = []
+        for block_id, block in enumerate(self.block_list):
+            block_name = "%s.inner%d"%(prefix, block_id)
+            profile_modules.append((block_name, block))
+            for layer_id, layer in enumerate(block.block_list):
+                profile_modules.append(("%s.conv%d"%(block_name, layer_id+1), layer))
+            if isinstance(getattr(block, "residual_proj", None), ConvKXBN):
+                profile_modules.append(("%s.residual_proj"%(block_name), block.residual_proj))
+        return profile_modules
+
+
     def entropy_forward(self, x, skip_relu=True, skip_bn=True, **kwarg):
         output = x
         output_std_list = []
@@ -536,6 +636,16 @@ class BaseSuperBlock(nn.Module):
 
         return max_featmap_list
 
+    def get_tensor_graph(self, graph, x, resolution, nbitsA_out=8, prefix=""):
+        for idx, the_block in enumerate(self.block_list, 0):
+            if self.quant and idx < len(self.block_list)-1:
+                nbitsA_next = self.block_list[idx+1].nbitsA[0]
+            else:
+                nbitsA_next = nbitsA_out
+            x = the_block.get_tensor_graph(graph, x, resolution, nbitsA_out=nbitsA_next, prefix="%s.inner%d"%(prefix, idx))
+            resolution = the_block.get_output_resolution(resolution)
+        return x
+
 __module_blocks__ = {
     'ConvKXBN': ConvKXBN,
     'ConvKXBNRELU': ConvKXBNRELU,
@@ -23,6 +23,14 @@ def round_pass(x):
     return (y - y_grad).detach() + y_grad
 
 
+def get_weight_version(module):
+    # in-place updates (init, load_state_dict, optimizer step) bump the versions and invalidate the frozen weight
+    version = (module.weight.data_ptr(), module.weight._version)
+    if hasattr(module, "weight_quan"):
+        version = version + (module.weight_quan.s.data_ptr(), module.weight_quan.s._version)
+    return version
+
+
 class LsqQuan(Module):
     def __init__(self, bitwidth, positive=False, quant_search=False):
         super(LsqQuan, self).__init__()
@@ -40,6 +48,10 @@ class LsqQuan(Module):
         self.s = Parameter(torch.ones(1))
 
     def init_from(self, x):
+        if x.is_meta:
+            # only the shape is needed before the weight is materialized
+            self.s = Parameter(x.new_empty((x.shape[0],) + (1,) * (x.dim() - 1)))
+            return
         self.s = Parameter(x.detach().abs().mean(dim=list(range(1, x.dim())), keepdim=True) * 2 / (self.upper_bound ** 0.5))
         #self.s = Parameter(x.detach().abs().mean() * 2 / (self.upper_bound ** 0.5))
 
@@ -139,7 +151,72 @@ class QuanWeight(Function):
         return grad_arr, None, None, None
 
 
-class QConv2d(Conv2d):
+class QuantWeightMixin():
+    """The quant states of the weight shared by QConv2d and QLinear, and the frozen quantized weight.
+
+    The class sets weight_nbits and quant_search, and calls init_quant_states after the weight is created.
+    """
+    def init_quant_states(self, num_channels):
+        self.weightq = Parameter(torch.zeros(self.weight.shape), requires_grad=False)
+        self.alpha = Parameter(torch.ones((num_channels)), requires_grad=False)
+        self.scalar = Parameter(torch.ones(1), requires_grad=False)
+        self.frozen = False
+        self.weight_f_version = None
+        self.register_buffer('weight_f', None, persistent=False)
+
+
+    def reset_quant_parameters(self):
+        """Reset the quant states from the current weight, after the module is materialized from the meta device."""
+        with torch.no_grad():
+            self.weightq.zero_()
+            self.alpha.fill_(1)
+            self.scalar.fill_(1)
+        if self.quan_type == 'lsq':
+            with torch.no_grad():
+                self.act_quan.s.fill_(1)
+                self.weight_quan.s.fill_(1)
+            if not self.quant_search: self.weight_quan.init_from(self.weight)
+        self.freeze(self.frozen)
+        return self
+
+
+    def quantize_weight(self):
+        if self.quan_type == 'lsq':
+            return self.weight_quan(self.weight)
+        else:
+            return QuanWeight.apply(self.weight, self.weight_nbits, self.positive)
+
+
+    def freeze(self, mode=True):
+        """Quantize the weight once and reuse it in forward, only for inference.
+
+        The frozen weight is re-quantized when the weight or the scale is updated in place.
+        """
+        self.frozen = mode
+        self.weight_f = None
+        self.weight_f_version = None
+        return self
+
+
+    def get_frozen_weight(self):
+        version = get_weight_version(self)
+        if self.weight_f is None or self.weight_f_version != version:
+            with torch.no_grad():
+                w_f, self.alpha.data, self.weightq.data = self.quantize_weight()
+            self.weight_f = w_f.detach()
+            self.weight_f_version = version
+        return self.weight_f
+
+
+    def get_quantized_weight(self):
+        # the weight used in forward
+        if self.frozen:
+            return self.get_frozen_weight()
+        w_f, self.alpha.data, self.weightq.data = self.quantize_weight()
+        return w_f
+
+
+class QConv2d(QuantWeightMixin, Conv2d):
     def __init__(self, in_channels, out_channels, kernel_size, stride=1, padding=0, dilation=1,
                  groups=1, bias=True, padding_mode='zeros', nbitsA=8, nbitsW=8, 
                  quan_type='lsq', positive=False, **kwargs):
@@ -155,11 +232,10 @@ class QConv2d(Conv2d):
 
         self.nbitsA = nbitsA
         self.nbitsW = nbitsW
+        self.weight_nbits = nbitsW
         self.quan_type = quan_type
         self.positive = positive
-        self.weightq = Parameter(torch.zeros(self.weight.shape), requires_grad=False)
-        self.alpha = Parameter(torch.ones((out_channels)), requires_grad=False)
-        self.scalar = Parameter(torch.ones(1), requires_grad=False)
+        self.init_quant_states(out_channels)
 
         # if self.nbitsA  not in [2, 4, 8] or self.nbitsW  not in [2, 4, 8]:
             # raise ValueError("nbits must be 2/4/8, not nbitsA %d or nbitsW %d"%(self.nbitsA, self.nbitsW))
@@ -172,10 +248,9 @@ class QConv2d(Conv2d):
     def forward(self, input):
         if self.quan_type == 'lsq':
             qact, self.scalar.data, _  = self.act_quan(input)
-            w_f, self.alpha.data, self.weightq.data = self.weight_quan(self.weight)
         else:
             qact, self.scalar.data = QuanActivation.apply(input, self.nbitsA, self.positive)
-            w_f, self.alpha.data, self.weightq.data = QuanWeight.apply(self.weight, self.nbitsW, self.positive)
+        w_f = self.get_quantized_weight()
         # Debug
         # print("\ninput mean %.4f, std %.4f, min %.4f, max %.4f, \n, qact  mean %.4f, std %.4f, min %.4f, max %.4f, "%(
         #     input.mean().item(), input.std().item(), input.min().item(), input.max().item(), 
@@ -201,16 +276,16 @@ class QConv2d(Conv2d):
 
 
 
-class QLinear(Linear):
+class QLinear(QuantWeightMixin, Linear):
     def __init__(self, in_features, out_features, bias=True, nbits=4, quan_type='lsq', positive=False):
         super(QLinear, self).__init__(in_features=in_features, out_features=out_features, bias=bias)
 
         self.nbits = nbits
+        self.weight_nbits = nbits
+        self.quant_search = False
         self.quan_type = quan_type
         self.positive = positive
-        self.weightq = Parameter(torch.zeros(self.weight.shape), requires_grad=False)
-        self.alpha = Parameter(torch.ones((out_features)), requires_grad=False)
-        self.scalar = Parameter(torch.ones(1), requires_grad=False)
+        self.init_quant_states(out_features)
 
         if quan_type == 'lsq':
             self.act_quan = LsqQuan(nbits, positive)
@@ -220,10 +295,9 @@ class QLinear(Linear):
     def forward(self, input):
         if self.quan_type == 'lsq':
             qact, self.scalar.data, _  = self.act_quan(input)
-            w_f, self.alpha.data, self.weightq.data = self.weight_quan(self.weight)
         else:
             qact, self.scalar.data = QuanActivation.apply(input, self.nbits, self.positive)
-            w_f, self.alpha.data, self.weightq.data = QuanWeight.apply(self.weight, self.nbits, self.positive)
+        w_f = self.get_quantized_weight()
 
         return F.linear(qact, w_f, self.bias)
 
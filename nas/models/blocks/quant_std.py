@@ -0,0 +1,93 @@
+# Copyright (c) 2021-2022 Alibaba Group Holding Limited.
+
+import os, sys, json
+import numpy as np
+from scipy.special import ndtr
+
+
+__std_bits_cache__ = {}
+__std_bits_cache_loaded__ = [False]
+
+
+def get_std_bits_cache_file():
+    cache_dir = os.environ.get("LIGHTNAS_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "lightnas"))
+    return os.path.join(cache_dir, "std_bits_lut.json")
+
+
+def compute_std_bits_factor(init_std, nbits):
+    """Compute the std of the quantized Gaussian, vectorized over arrays of std and nbits.
+
+    x ~ N(0, init_std^2) is quantized as q = clamp(round(x), -2^(nbits-1), 2^(nbits-1)),
+    the same bounds as LsqQuan with quant_search=True, and the std of q is returned.
+    The probability of each quantized level comes from the Gaussian CDF, so no sampling is needed.
+    """
+    init_std, nbits = np.broadcast_arrays(np.asarray(init_std, dtype=np.float64), np.asarray(nbits, dtype=np.int64))
+    std_factor = np.zeros(init_std.shape, dtype=np.float64)
+
+    # all the std with the same nbits share one grid of quantized levels
+    for the_nbits in np.unique(nbits):
+        mask = nbits == the_nbits
+        std = init_std[mask][:, None]
+        levels = np.arange(-2**(the_nbits - 1), 2**(the_nbits - 1) + 1, dtype=np.float64)[None, :]
+        cdf_upper = ndtr((levels + 0.5) / std)
+        cdf_lower = ndtr((levels - 0.5) / std)
+        # the clamped tails are merged into the first and the last levels
+        cdf_upper[:, -1] = 1.0
+        cdf_lower[:, 0] = 0.0
+        prob = cdf_upper - cdf_lower
+        mean = np.sum(prob * levels, axis=1)
+        std_factor[mask] = np.sqrt(np.maximum(np.sum(prob * levels**2, axis=1) - mean**2, 0.0))
+
+    return std_factor
+
+
+def load_std_bits_cache():
+    cache_file = get_std_bits_cache_file()
+    if os.path.isfile(cache_file):
+        try:
+            with open(cache_file, 'r') as fid:
+                for key, value in json.load(fid).items():
+                    init_std, nbits = key.split(',')
+                    __std_bits_cache__[(float(init_std), int(nbits))] = value
+        except (ValueError, OSError):
+            pass # a broken cache is rebuilt
+    __std_bits_cache_loaded__[0] = True
+
+
+def save_std_bits_cache():
+    cache_file = get_std_bits_cache_file()
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        backup_file = "%s.%d.tmp"%(cache_file, os.getpid())
+        with open(backup_file, 'w') as fid:
+            json.dump({"%r,%d"%(k[0], k[1]): v for k, v in __std_bits_cache__.items()}, fid)
+        os.replace(backup_file, cache_file)
+    except OSError:
+        pass # the cache is only an acceleration, the values are still memoized in memory
+
+
+def get_std_bits_factor(init_std, nbits):
+    """Get the std factor of the quantized Gaussian with memoization, for scalars or arrays.
+
+    It replaces the lookups of STD_BITS_LUT, and works for any (init_std, nbits) pair.
+    New values are computed at once for the whole array and saved in the on-disk cache.
+    """
+    if not __std_bits_cache_loaded__[0]:
+        load_std_bits_cache()
+
+    is_scalar = np.isscalar(init_std) and np.isscalar(nbits)
+    init_std, nbits = np.broadcast_arrays(np.asarray(init_std, dtype=np.float64), np.asarray(nbits, dtype=np.int64))
+    keys = [(s, n) for s, n in zip(init_std.ravel().tolist(), nbits.ravel().tolist())]
+
+    missing_keys = list(set([key for key in keys if key not in __std_bits_cache__]))
+    if len(missing_keys) > 0:
+        missing_std, missing_nbits = zip(*missing_keys)
+        missing_values = compute_std_bits_factor(missing_std, missing_nbits)
+        for key, value in zip(missing_keys, missing_values.tolist()):
+            __std_bits_cache__[key] = value
+        save_std_bits_cache()
+
+    std_factor = np.array([__std_bits_cache__[key] for key in keys], dtype=np.float64).reshape(init_std.shape)
+    if is_scalar:
+        return float(std_factor)
+    return std_factor
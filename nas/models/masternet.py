@@ -7,10 +7,12 @@ import numpy as np
 import torch
 from torch import nn
 from torch.nn import functional as F
-import ast, argparse
+import ast, argparse, copy
+import contextlib
 
-from .blocks import __all_blocks__, network_weight_stupid_init
-from .blocks.qconv import QLinear
+from .blocks import __all_blocks__, network_weight_stupid_init, ConvKXBN
+from .blocks.qconv import QConv2d, QLinear
+from .memory_planner import TensorGraph, plan_memory
 
 
 def parse_cmd_args(argv):
@@ -87,10 +89,21 @@ def load_model(model, load_parameters_from, strict_load=False, map_location=torc
     return model
 
 
+class InferenceWrapper(nn.Module):
+    def __init__(self, model, memory_format=torch.contiguous_format):
+        super().__init__()
+        self.model = model
+        self.memory_format = memory_format
+
+    def forward(self, x):
+        # convert the input to the memory format of the weights, inside the traced or compiled graph
+        return self.model(x.contiguous(memory_format=self.memory_format))
+
+
 class MasterNet(nn.Module):
     def __init__(self, num_classes=None, structure_info=None, structure_str=None, structure_txt=None,
                  block_module=None, dropout_channel=None, dropout_layer=None, out_indices=(1, 2, 3, 4),
-                 classfication=False, argv=None, no_create=False, **kwargs):
+                 classfication=False, argv=None, no_create=False, checkpoint_every=None, meta_device=False, **kwargs):
         super().__init__()
         self.num_classes = num_classes
         self.structure_info = structure_info
@@ -124,6 +137,10 @@ class MasterNet(nn.Module):
             self.structure_info = ast.literal_eval(self.structure_str)
             assert isinstance(self.structure_info, list)
 
+        # the immutable ArchSpec of the search is built into dicts, which the blocks can update like 'inner_class'
+        if hasattr(self.structure_info, "to_list"):
+            self.structure_info = self.structure_info.to_list()
+
         if "nbitsA" in self.structure_info[0] and "nbitsW" in self.structure_info[0]:
             self.quant = True
         else:
@@ -136,20 +153,23 @@ class MasterNet(nn.Module):
             self.__all_blocks__.update(self.block_module.__module_blocks__)
 
 
-        self.block_list = nn.ModuleList()
-        for block_structure_info in self.structure_info:
-            the_block_class = self.__all_blocks__[block_structure_info['class']]
-            the_block = the_block_class(block_structure_info, no_create=self.no_create, **kwargs)
-            self.block_list.append(the_block)
-        pass
+        # the weights on the meta device have shapes but no memory, call materialize() before forward
+        self.meta_device = meta_device
+        with torch.device("meta") if self.meta_device else contextlib.nullcontext():
+            self.block_list = nn.ModuleList()
+            for block_structure_info in self.structure_info:
+                the_block_class = self.__all_blocks__[block_structure_info['class']]
+                the_block = the_block_class(block_structure_info, no_create=self.no_create, **kwargs)
+                self.block_list.append(the_block)
+            pass
 
-        if self.classfication: # output for the classfication task
-            if self.quant:
-                self.fc_linear = QLinear(self.block_list[-1].out_channels, self.num_classes, bias=True, nbits=8)
-            else:
-                self.fc_linear = nn.Linear(self.block_list[-1].out_channels, self.num_classes, bias=True)
-            
-            network_weight_stupid_init(self.fc_linear)
+            if self.classfication: # output for the classfication task
+                if self.quant:
+                    self.fc_linear = QLinear(self.block_list[-1].out_channels, self.num_classes, bias=True, nbits=8)
+                else:
+                    self.fc_linear = nn.Linear(self.block_list[-1].out_channels, self.num_classes, bias=True)
+                
+                network_weight_stupid_init(self.fc_linear)
 
         self.stage_idx, self.stage_block_num, self.stage_layer_num, self.stage_channels = self.get_stage_info()
         # set dropout rate
@@ -162,6 +182,39 @@ class MasterNet(nn.Module):
             if self.dropout_layer is not None:
                 block.dropout_layer = self.dropout_layer * current_depth / L
 
+        self.set_checkpoint(checkpoint_every)
+
+
+    def set_checkpoint(self, checkpoint_every=None):
+        """Recompute the activations of every checkpoint_every inner layers in backward to save memory.
+
+        It works on the super blocks when training, None to disable it. The recomputation replays the dropout
+        and keeps the BN running stats, so the gradients and the buffers are the same as without it.
+        """
+        if checkpoint_every is not None and checkpoint_every < 1:
+            raise ValueError("checkpoint_every must be a positive integer or None, not %s"%(checkpoint_every))
+        self.checkpoint_every = checkpoint_every
+        for block in self.block_list:
+            if hasattr(block, "checkpoint_every"):
+                block.checkpoint_every = checkpoint_every
+
+
+    def materialize(self, device="cpu"):
+        """Allocate the weights of the masternet built with meta_device=True, and initialize them like the constructor."""
+        if not self.meta_device:
+            return self
+        self.to_empty(device=device)
+        for m in self.modules():
+            if isinstance(m, (nn.Conv2d, nn.Linear, nn.BatchNorm2d)):
+                m.reset_parameters()
+        for m in self.modules():
+            if isinstance(m, (QConv2d, QLinear)):
+                m.reset_quant_parameters()
+        if self.classfication:
+            network_weight_stupid_init(self.fc_linear)
+        self.meta_device = False
+        return self
+
 
     def init_weights(self, pretrained=None):
         """Initialize the weights of masternet.
@@ -177,6 +230,67 @@ class MasterNet(nn.Module):
             pass
 
 
+    def freeze_quant(self, mode=True):
+        """Quantize the weights of the QConv2d/QLinear layers once and reuse them in forward, for deploy only.
+
+        The frozen weights have no gradient, so eval mode does not freeze them, e.g. for the synflow score.
+        mode=False quantizes the weights in every forward again.
+        """
+        for m in self.modules():
+            if isinstance(m, (QConv2d, QLinear)):
+                m.freeze(mode)
+        return self
+
+
+    def fuse_for_deploy(self):
+        """Fold all the BN layers into the convs and drop the dropout branches in place.
+
+        The outputs in eval mode are unchanged, while the fused network is only for inference.
+        """
+        if self.no_create:
+            raise ValueError("the masternet with no_create=True has no weights to fuse")
+        self.eval()
+        for m in self.modules():
+            if isinstance(m, ConvKXBN):
+                m.fuse_for_deploy()
+            if hasattr(m, "dropout_layer"):
+                m.dropout_layer = None
+            if hasattr(m, "dropout_channel"):
+                m.dropout_channel = None
+        return self
+
+
+    def get_inference_model(self, example_input, channels_last=True, compile_mode='compile'):
+        """Get a fused copy of the masternet compiled for inference.
+
+        The python branches on dropout and classfication are resolved after fuse_for_deploy,
+        so the forward is traced into one static graph.
+
+        :param example_input: input tensor for tracing, on the device of the masternet
+        :param channels_last: run the convs in channels_last memory format end to end
+        :param compile_mode: 'compile' for torch.compile, 'trace' for a frozen TorchScript module
+                             which can be saved by torch.jit.save, None for the eager fused module
+        """
+        model = copy.deepcopy(self)
+        if self.quant:
+            model.eval().freeze_quant()
+        else:
+            model.fuse_for_deploy()
+        memory_format = torch.channels_last if channels_last else torch.contiguous_format
+        model = InferenceWrapper(model.to(memory_format=memory_format), memory_format).eval()
+
+        if compile_mode == 'trace':
+            with torch.no_grad():
+                traced_model = torch.jit.trace(model, example_input, strict=False)
+            return torch.jit.freeze(traced_model)
+        elif compile_mode == 'compile':
+            return torch.compile(model)
+        elif compile_mode is None:
+            return model
+        else:
+            raise ValueError("compile_mode must be trace, compile or None, not %s"%(compile_mode))
+
+
     def forward(self, x):
         # add different stages outputs for detection
         output = x
@@ -277,6 +391,22 @@ class MasterNet(nn.Module):
         return params
 
 
+    def get_profile_modules(self):
+        """Get the list of (name, module) of the blocks and their inner layers for profiling.
+
+        The ConvKXBN layers are in the same order as the params of get_params_for_trt.
+        """
+        profile_modules = []
+        for block_id, block in enumerate(self.block_list):
+            block_name = "block%d"%(block_id)
+            profile_modules.append((block_name, block))
+            if hasattr(block, "get_profile_modules"):
+                profile_modules += block.get_profile_modules(block_name)
+        if self.classfication:
+            profile_modules.append(("fc_linear", self.fc_linear))
+        return profile_modules
+
+
     def get_stage_info(self,):
         stage_idx = []
         stage_channels = []
@@ -353,3 +483,31 @@ class MasterNet(nn.Module):
                 max_featmap_list.append(temp_featmap_list)
 
         return max_featmap_list
+
+
+    def get_tensor_graph(self, resolution):
+        """Build the TensorGraph of the feature maps in bytes, with the residual branches and the outputs."""
+        def get_nbitsA_in(block):
+            if not self.quant: return 8
+            return block.nbitsA[0] if type(block.nbitsA)==list else block.nbitsA
+
+        graph = TensorGraph()
+        output = graph.add_tensor("input", resolution**2*3*get_nbitsA_in(self.block_list[0])/8)
+        if not self.classfication: stage_idx_output = [self.stage_idx[idx] for idx in self.out_indices]
+        for idx, the_block in enumerate(self.block_list):
+            nbitsA_next = get_nbitsA_in(self.block_list[idx+1]) if idx < len(self.block_list)-1 else 8
+            output = the_block.get_tensor_graph(graph, output, resolution, nbitsA_out=nbitsA_next, prefix="block%d"%(idx))
+            resolution = the_block.get_output_resolution(resolution)
+            if not self.classfication and idx in stage_idx_output:
+                graph.mark_output(output)
+
+        if self.classfication:
+            output = graph.add_op("gap", [output], self.block_list[-1].out_channels)
+            output = graph.add_op("fc_linear", [output], self.num_classes)
+            graph.mark_output(output)
+        return graph
+
+
+    def get_memory_plan(self, resolution, reorder=True):
+        """Plan the arena of the feature maps by the tensor lifetimes, see memory_planner.plan_memory."""
+        return plan_memory(self.get_tensor_graph(resolution), reorder=reorder)
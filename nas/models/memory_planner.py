@@ -0,0 +1,158 @@
+# Copyright (c) 2021-2022 Alibaba Group Holding Limited.
+
+import os,sys
+import numpy as np
+
+
+class TensorGraph():
+    def __init__(self):
+        """The tensor lifetime graph of a network for memory planning.
+
+        The ops are in execution order, every op reads its input tensors and writes one output tensor,
+        which is a new tensor or its first input for in-place ops like the residual add.
+        """
+        self.tensor_names = []
+        self.tensor_bytes = []
+        self.ops = []
+        self.outputs = []
+
+
+    def add_tensor(self, name, num_bytes):
+        self.tensor_names.append(name)
+        self.tensor_bytes.append(int(np.ceil(num_bytes)))
+        return len(self.tensor_names) - 1
+
+
+    def add_op(self, name, inputs, output_bytes=None, inplace=False):
+        """Add an op and return the id of its output tensor."""
+        if inplace:
+            output = inputs[0]
+        else:
+            output = self.add_tensor(name, output_bytes)
+        self.ops.append({"name": name, "inputs": list(inputs), "output": output})
+        return output
+
+
+    def mark_output(self, tensor_id):
+        # the outputs of the network, such as the stage features for detection, live until the end
+        self.outputs.append(tensor_id)
+
+
+    def get_dependencies(self):
+        # an op waits for the last writers of its inputs and of its in-place output
+        last_writer = {}
+        dependencies = []
+        for op_id, op in enumerate(self.ops):
+            tensors = op["inputs"] + [op["output"]]
+            dependencies.append(set([last_writer[t] for t in tensors if t in last_writer]))
+            last_writer[op["output"]] = op_id
+        return dependencies
+
+
+    def get_lifetimes(self, order):
+        """Get the [first, last] step of every tensor in the execution order, the input tensors start at -1."""
+        first = [-1] * len(self.tensor_names)
+        last = [-1] * len(self.tensor_names)
+        is_written = [False] * len(self.tensor_names)
+        for step, op_id in enumerate(order):
+            op = self.ops[op_id]
+            if not is_written[op["output"]] and op["output"] not in op["inputs"]:
+                first[op["output"]] = step
+            is_written[op["output"]] = True
+            for t in op["inputs"] + [op["output"]]:
+                last[t] = step
+        for t in self.outputs:
+            last[t] = len(order)
+        return first, last
+
+
+def get_peak_live_bytes(graph, order):
+    # the lower bound of the arena, the sum of the tensors alive at the same step
+    first, last = graph.get_lifetimes(order)
+    live_bytes = np.zeros(len(order) + 2, dtype=np.int64)
+    for t, num_bytes in enumerate(graph.tensor_bytes):
+        live_bytes[first[t]+1:last[t]+2] += num_bytes
+    return int(live_bytes.max())
+
+
+def greedy_by_size_allocate(graph, order):
+    """Place the tensors in the arena from the largest one, like the greedy memory planner of TFLite Micro.
+
+    Every tensor takes the lowest offset that does not overlap the placed tensors alive at the same time.
+    :return: arena_size, offsets of the tensors
+    """
+    first, last = graph.get_lifetimes(order)
+    offsets = [None] * len(graph.tensor_names)
+    placed = []
+    for t in sorted(range(len(graph.tensor_names)), key=lambda x: (-graph.tensor_bytes[x], first[x])):
+        if last[t] < first[t]:
+            continue # the tensor is never used
+        overlaps = sorted([(offsets[p], offsets[p] + graph.tensor_bytes[p]) for p in placed
+                            if first[p] <= last[t] and first[t] <= last[p]])
+        offset = 0
+        for start, end in overlaps:
+            if offset + graph.tensor_bytes[t] <= start:
+                break
+            offset = max(offset, end)
+        offsets[t] = offset
+        placed.append(t)
+    arena_size = max([offsets[t] + graph.tensor_bytes[t] for t in placed]) if len(placed) > 0 else 0
+    return arena_size, offsets
+
+
+def get_memory_aware_order(graph):
+    """Reorder the ops by list scheduling, every step runs the ready op which adds the least live memory.
+
+    Only the independent branches, like the residual projection, can be moved.
+    """
+    dependencies = graph.get_dependencies()
+    readers = [set() for _ in graph.tensor_names]
+    for op_id, op in enumerate(graph.ops):
+        for t in op["inputs"] + [op["output"]]:
+            readers[t].add(op_id)
+    for t in graph.outputs:
+        readers[t].add(len(graph.ops))
+
+    order, scheduled = [], set()
+    while len(order) < len(graph.ops):
+        ready = [op_id for op_id in range(len(graph.ops)) if op_id not in scheduled and dependencies[op_id] <= scheduled]
+        def get_memory_delta(op_id):
+            op = graph.ops[op_id]
+            allocated = 0 if op["output"] in op["inputs"] else graph.tensor_bytes[op["output"]]
+            freed = sum([graph.tensor_bytes[t] for t in set(op["inputs"]) if readers[t] <= scheduled | {op_id}])
+            return (allocated - freed, op_id)
+        op_id = min(ready, key=get_memory_delta)
+        order.append(op_id)
+        scheduled.add(op_id)
+    return order
+
+
+def plan_memory(graph, reorder=True):
+    """Plan the arena of the feature maps for the network on MCU.
+
+    :param graph: TensorGraph of the network
+    :param reorder: also try the memory-aware execution order, and keep it if the arena is smaller
+    :return: dict of the arena size, the peak live bytes, the execution order and the per-layer arena offsets
+    """
+    order = list(range(len(graph.ops)))
+    arena_size, offsets = greedy_by_size_allocate(graph, order)
+    reordered = False
+    if reorder:
+        new_order = get_memory_aware_order(graph)
+        new_arena_size, new_offsets = greedy_by_size_allocate(graph, new_order)
+        if new_arena_size < arena_size:
+            order, arena_size, offsets, reordered = new_order, new_arena_size, new_offsets, True
+
+    layers = []
+    for op_id in order:
+        op = graph.ops[op_id]
+        layers.append({"name": op["name"],
+            "inputs": [(graph.tensor_names[t], offsets[t], graph.tensor_bytes[t]) for t in op["inputs"]],
+            "output": (graph.tensor_names[op["output"]], offsets[op["output"]], graph.tensor_bytes[op["output"]])})
+
+    plan = {}
+    plan["arena_size"] = arena_size
+    plan["peak_live_bytes"] = get_peak_live_bytes(graph, order)
+    plan["reordered"] = reordered
+    plan["layers"] = layers
+    return plan
@@ -0,0 +1,171 @@
+# Copyright (c) 2021-2022 Alibaba Group Holding Limited.
+
+import os,sys
+import copy
+import torch
+from torch import nn
+import torch.nn.functional as F
+from torch.ao.quantization import QConfig, QConfigMapping, get_default_qconfig
+from torch.ao.quantization.observer import ObserverBase, PerChannelMinMaxObserver, FixedQParamsObserver
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+from .blocks.qconv import QConv2d, QLinear
+
+
+class LsqWeightObserver(PerChannelMinMaxObserver):
+    def __init__(self, level_max, **kwargs):
+        """The per-channel weight observer which keeps the levels of the trained QConv2d/QLinear.
+
+        The observed weight is the fake-quantized weight, with BN folded per channel, so the scale of a channel
+        is its max abs value over the max abs level of the channel, which is the LSQ step size without BN.
+
+        :param level_max: the max abs integer level of each output channel
+        """
+        super().__init__(**kwargs)
+        self.register_buffer('level_max', level_max.clone().float())
+
+
+    def calculate_qparams(self):
+        max_abs = torch.max(-self.min_val, self.max_val)
+        scale = torch.where(self.level_max > 0, max_abs/self.level_max.clamp(min=1), torch.ones_like(max_abs))
+        scale = torch.clamp(scale, min=self.eps)
+        return scale, torch.zeros_like(scale, dtype=torch.int64)
+
+
+def get_weight_levels(layer):
+    """Get the integer levels of the fake-quantized weight of a QConv2d/QLinear, and its scale per output channel."""
+    with torch.no_grad():
+        w_f, scale, levels = layer.quantize_weight()
+    scale = scale.detach().reshape(-1).expand(layer.weight.shape[0])
+    return levels.detach(), scale
+
+
+def get_act_qparams(layer):
+    """Get the fixed (scale, zero_point, quant_min, quant_max) of the LSQ activation of a QConv2d/QLinear in quint8,
+    the signed levels are shifted by the zero point. None for the admm activation, whose scale is dynamic."""
+    if layer.quan_type != 'lsq':
+        return None
+    nbitsA = layer.nbitsA if isinstance(layer, QConv2d) else layer.nbits
+    if nbitsA > 8:
+        raise ValueError("only nbitsA <= 8 can be exported to int8, not %d"%(nbitsA))
+    zero_point = 0 if layer.positive else 2**(nbitsA-1)
+    return float(layer.act_quan.s.detach().abs().reshape(-1)[0]), zero_point, 0, 2**nbitsA-1
+
+
+def get_int8_qconfig(layer, backend='fbgemm'):
+    """Get the qconfig of one QConv2d/QLinear, whose weight is kept on the LSQ levels of nbitsW.
+
+    The fbgemm/qnnpack conv and linear kernels only run int8, so the weights with
+    fewer bits are kept on their nbitsW levels and stored in int8.
+    """
+    nbitsW = layer.nbitsW if isinstance(layer, QConv2d) else layer.nbits
+    if nbitsW > 8:
+        raise ValueError("only nbitsW <= 8 can be exported to int8, not %d"%(nbitsW))
+    levels, _ = get_weight_levels(layer)
+    level_max = levels.abs().reshape(levels.shape[0], -1).max(dim=1)[0]
+    weight_observer = LsqWeightObserver.with_args(level_max=level_max, dtype=torch.qint8, ch_axis=0,
+                        qscheme=torch.per_channel_symmetric, quant_min=-2**(nbitsW-1), quant_max=2**(nbitsW-1)-1)
+    return QConfig(activation=get_default_qconfig(backend).activation, weight=weight_observer)
+
+
+def replace_fake_quant_layers(model):
+    """Replace QConv2d/QLinear by float Conv2d/Linear with the fake-quantized weights in place.
+
+    :return: dict of {module name: QConv2d/QLinear} of the replaced layers
+    """
+    layer_dict = {}
+    for name, module in list(model.named_modules()):
+        for child_name, child in list(module.named_children()):
+            full_name = child_name if name == '' else "%s.%s"%(name, child_name)
+            if isinstance(child, QConv2d):
+                new_child = nn.Conv2d(child.in_channels, child.out_channels, child.kernel_size, child.stride,
+                            child.padding, child.dilation, child.groups, child.bias is not None, child.padding_mode)
+            elif isinstance(child, QLinear):
+                new_child = nn.Linear(child.in_features, child.out_features, child.bias is not None)
+            else:
+                continue
+            with torch.no_grad():
+                w_f, _, _ = child.quantize_weight()
+                new_child.weight.copy_(w_f)
+                if child.bias is not None: new_child.bias.copy_(child.bias)
+            setattr(module, child_name, new_child)
+            layer_dict[full_name] = child
+    return layer_dict
+
+
+def get_observer_node(prepared_model, node):
+    # the node if it is an observer of the prepared model, else None
+    if not isinstance(node, torch.fx.Node) or node.op != 'call_module':
+        return None
+    return node if isinstance(prepared_model.get_submodule(node.target), ObserverBase) else None
+
+
+def is_relu_node(prepared_model, node):
+    if node.op == 'call_function':
+        return node.target in [torch.relu, F.relu]
+    return node.op == 'call_module' and isinstance(prepared_model.get_submodule(node.target), nn.ReLU)
+
+
+def set_act_observers(prepared_model, layer_dict):
+    """Replace the input observers of the replaced layers by the fixed qparams of their LSQ activations.
+
+    The observer before a ReLU which feeds the layer gets the same qparams, so the output of the conv is
+    rounded once on the levels of the LSQ activation, as the ReLU keeps the levels. An observer read by
+    several layers keeps the qparams of the largest scale, so none of them is clipped.
+    """
+    act_qparams = {}
+    for node in prepared_model.graph.nodes:
+        if node.op != 'call_module' or node.target not in layer_dict or len(node.args) == 0:
+            continue
+        input_node = get_observer_node(prepared_model, node.args[0])
+        qparams = get_act_qparams(layer_dict[node.target])
+        if input_node is None or qparams is None:
+            continue
+        observer_list = [input_node]
+        relu_node = input_node.args[0]
+        if isinstance(relu_node, torch.fx.Node) and is_relu_node(prepared_model, relu_node) and len(relu_node.users) == 1:
+            relu_input_node = get_observer_node(prepared_model, relu_node.args[0])
+            if relu_input_node is not None and len(relu_input_node.users) == 1:
+                observer_list.append(relu_input_node)
+        for observer_node in observer_list:
+            if observer_node.target not in act_qparams or act_qparams[observer_node.target][0] < qparams[0]:
+                act_qparams[observer_node.target] = qparams
+    for name, (scale, zero_point, quant_min, quant_max) in act_qparams.items():
+        setattr(prepared_model, name, FixedQParamsObserver(scale, zero_point, dtype=torch.quint8,
+                quant_min=quant_min, quant_max=quant_max))
+
+
+def convert_to_int8(model, calib_data, backend='fbgemm'):
+    """Convert a MasterNet with QConv2d/QLinear layers into a torch.ao int8 model.
+
+    The int8 weights are the LSQ levels of nbitsW of every layer, with the LSQ step
+    sizes as their scales, times the BN folded into the int8 convs. The inputs of the
+    layers are quantized by the LSQ step sizes of their activations on the nbitsA
+    levels, and the other activation scales are calibrated on calib_data.
+
+    :param model: MasterNet built with nbitsA/nbitsW, usually loaded from a checkpoint
+    :param calib_data: list of input tensors for calibration
+    :param backend: 'fbgemm' for x86, 'qnnpack' for arm
+    :return: the int8 model, running on cpu
+    """
+    if backend not in torch.backends.quantized.supported_engines:
+        raise ValueError("backend %s is not supported in %s"%(backend, torch.backends.quantized.supported_engines))
+    torch.backends.quantized.engine = backend
+
+    float_model = copy.deepcopy(model).cpu()
+    layer_dict = replace_fake_quant_layers(float_model)
+    float_model.eval()
+    if len(layer_dict) == 0:
+        raise ValueError("there is no QConv2d/QLinear in the model to convert")
+
+    qconfig_mapping = QConfigMapping().set_global(get_default_qconfig(backend))
+    for name, layer in layer_dict.items():
+        qconfig_mapping.set_module_name(name, get_int8_qconfig(layer, backend))
+
+    prepared_model = prepare_fx(float_model, qconfig_mapping, example_inputs=(calib_data[0].cpu(),))
+    set_act_observers(prepared_model, layer_dict)
+    with torch.no_grad():
+        for the_data in calib_data:
+            prepared_model(the_data.cpu())
+
+    return convert_fx(prepared_model)
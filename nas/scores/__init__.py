@@ -1,7 +1,10 @@
 from .compute_entropy import ComputeEntropyScore
 from .compute_madnas import ComputeMadnasScore
+from .compute_multi import ComputeMultiScore
+from .score_store import ScoreStore, get_structure_hash
 
 __all_scores__ = {
     'entropy': ComputeEntropyScore,
     'madnas': ComputeMadnasScore,
+    'multi': ComputeMultiScore,
 }
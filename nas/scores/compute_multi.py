@@ -0,0 +1,138 @@
+# Copyright (c) 2021-2022 Alibaba Group Holding Limited.
+
+import os, sys, time, logging
+import torch
+import numpy as np
+from torch import nn
+
+from .compute_entropy import ComputeEntropyScore, network_weight_gaussian_init
+
+
+__all_proxies__ = ['entropy', 'naswot', 'synflow']
+
+
+class ComputeMultiScore(ComputeEntropyScore):
+    """Compute several zero-cost proxies with one shared forward pass.
+
+    The proxies are selected by listing them in cfg.score_type, e.g. ["entropy", "naswot", "synflow"]:
+      - entropy: the std terms of the entropy score, same as ComputeEntropyScore.
+      - naswot: log-determinant of the activation-pattern kernel (NASWOT), the binary codes
+        are taken from the sign of every convolution output.
+      - synflow: synflow-style saliency |w * dR/dw| of each convolution used in the entropy
+        forward, where R is the sum of the last stage feature. It reuses the entropy forward
+        instead of running the all-ones forward of synflow.
+    The final score is the sum of each proxy weighted by cfg.score_proxy_ratio.
+    """
+    def __init__(self, cfg, logger=None):
+        super().__init__(cfg, logger=logger)
+        self.proxies = list(cfg.score_type)
+        for proxy in self.proxies:
+            if proxy not in __all_proxies__:
+                raise ValueError("proxy in score_type must be in %s, not %s"%(__all_proxies__, proxy))
+
+        if cfg.score_proxy_ratio is None:
+            self.proxy_ratio = [1.0]*len(self.proxies)
+        else:
+            self.proxy_ratio = list(cfg.score_proxy_ratio)
+        if len(self.proxy_ratio)!=len(self.proxies):
+            raise ValueError("the length of score_proxy_ratio (%d) must be equal to the length of score_type (%d)"%(
+                            len(self.proxy_ratio), len(self.proxies)))
+
+
+    def register_naswot_hooks(self, model, naswot_kernel):
+
+        def naswot_hook(module, input, output):
+            codes = (output.detach() > 0).flatten(1).float()
+            naswot_kernel[0] = naswot_kernel[0] + codes @ codes.t() + (1.0 - codes) @ (1.0 - codes).t()
+
+        handles = []
+        for m in model.modules():
+            if isinstance(m, nn.Conv2d):
+                handles.append(m.register_forward_hook(naswot_hook))
+        return handles
+
+
+    def __call__(self, model):
+        model.eval()
+        model.requires_grad_(False)
+
+        if self.gpu is not None:
+            torch.cuda.set_device(self.gpu)
+            device = torch.device('cuda:{}'.format(self.gpu))
+            model = model.cuda(self.gpu)
+        else:
+            device = torch.device('cpu')
+
+        info = {}
+        proxy_score_list = {proxy: [] for proxy in self.proxies}
+        synflow_layer_list = []
+        timer_start = time.time()
+        self.stage_idx, self.stage_block_num, self.stage_layer_num, self.stage_channels = model.get_stage_info()
+        conv_list = [m for m in model.modules() if isinstance(m, nn.Conv2d)]
+
+        for repeat_count in range(self.repeat):
+            network_weight_gaussian_init(model, std=self.init_std)
+            input = self.init_std_act*torch.randn(size=[self.batch_size, self.in_ch, self.resolution, self.resolution], device=device, dtype=torch.float32)
+            kwarg = {"init_std":self.init_std, "init_std_act":self.init_std_act}
+
+            naswot_kernel = [torch.zeros(self.batch_size, self.batch_size, device=device)]
+            handles = self.register_naswot_hooks(model, naswot_kernel) if "naswot" in self.proxies else []
+            if "synflow" in self.proxies:
+                for m in conv_list: m.weight.requires_grad_(True)
+
+            with torch.set_grad_enabled("synflow" in self.proxies):
+                stage_features_list, block_std_list = model.entropy_forward_pre_GAP(input, skip_relu=self.skip_relu, skip_bn=self.skip_bn, **kwarg)
+
+            for handle in handles: handle.remove()
+
+            if "entropy" in self.proxies:
+                with torch.no_grad():
+                    proxy_score_list["entropy"].append(np.sum(self.ratio_score(stage_features_list, block_std_list)))
+
+            if "naswot" in self.proxies:
+                _, logdet = torch.linalg.slogdet(naswot_kernel[0].double())
+                proxy_score_list["naswot"].append(logdet.item())
+
+            if "synflow" in self.proxies:
+                torch.sum(stage_features_list[-1]).backward()
+                layer_saliency = []
+                for m in conv_list:
+                    # the residual projections are not used in the entropy forward
+                    if m.weight.grad is not None:
+                        layer_saliency.append(torch.sum(torch.abs(m.weight * m.weight.grad)).item())
+                    m.weight.grad = None
+                    m.weight.requires_grad_(False)
+                synflow_layer_list.append(layer_saliency)
+                proxy_score_list["synflow"].append(np.log(np.sum(layer_saliency) + 1e-10))
+
+        timer_end = time.time()
+        score_array = np.array([proxy_score_list[proxy] for proxy in self.proxies])
+        nas_score_list = score_array.T*np.array(self.proxy_ratio)
+        avg_nas_score = np.mean(np.sum(nas_score_list, axis=1))
+        if self.align_budget_layers:
+            avg_nas_score = avg_nas_score/self.stage_layer_num[-1]*self.budget_layers
+        std_nas_score = np.std(np.sum(nas_score_list, axis=1))
+
+        info['avg_nas_score'] = avg_nas_score
+        info['std_nas_score'] = std_nas_score
+        info['nas_score_list'] = nas_score_list
+        for proxy in self.proxies:
+            info['%s_score'%(proxy)] = np.mean(proxy_score_list[proxy])
+        if "synflow" in self.proxies:
+            info['synflow_layer_saliency'] = np.mean(np.array(synflow_layer_list), axis=0)
+        info['time'] = timer_end - timer_start
+        self.logger.debug("avg_score:%s, proxies:%s, consume time is %f ms\n"%(avg_nas_score,
+                        {proxy: info['%s_score'%(proxy)] for proxy in self.proxies}, info['time']*1000))
+
+        del model
+        torch.cuda.empty_cache()
+        return info
+
+
+def main():
+    pass
+
+
+if __name__ == '__main__':
+    main()
+    pass
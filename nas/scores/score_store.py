@@ -0,0 +1,151 @@
+# Copyright (c) 2021-2022 Alibaba Group Holding Limited.
+
+import os, sys, time, json, logging
+import hashlib
+import sqlite3
+
+
+# the cfg fields which change the value of the score, the key of the store is built with them
+__score_config_keys__ = ['score_type', 'score_proxy_ratio', 'score_batch_size', 'score_image_size',
+                         'score_image_channel', 'score_repeat', 'score_skip_relu', 'score_skip_bn',
+                         'score_multi_ratio', 'score_quant_search', 'score_init_std', 'score_init_std_act',
+                         'align_budget_layers']
+
+# the cfg fields which change the budget metrics of a structure, the budgets themselves are not in the key
+__info_config_keys__ = ['space_num_classes', 'space_classfication', 'space_block_module', 'out_indices',
+                        'budget_image_size', 'budget_image_channel', 'lat_gpu', 'lat_pred', 'lat_pred_device',
+                        'lat_date_type', 'lat_batch_size']
+
+# the budget metrics of the model info kept in the store
+__info_keys__ = ['params', 'flops', 'layers', 'stages', 'latency', 'max_feature', 'arena']
+
+
+def get_structure_hash(structure_info):
+    # 'inner_class' is derived from 'class' when building the masternet, so it is not part of the key
+    if hasattr(structure_info, "to_list"): structure_info = structure_info.to_list()
+    canonical_info = [{k: v for k, v in block_info.items() if k != 'inner_class'} for block_info in structure_info]
+    the_s = json.dumps(canonical_info, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(the_s.encode('utf-8')).hexdigest()
+
+
+def get_score_config(cfg):
+    score_config = {k: getattr(cfg, k) for k in __score_config_keys__ if hasattr(cfg, k)}
+    # the score is scaled by budget_layers only with align_budget_layers, so the sweeps of budget_layers share it
+    if getattr(cfg, 'align_budget_layers', False):
+        score_config['budget_layers'] = cfg.budget_layers
+    return score_config
+
+
+def get_info_config(cfg):
+    return {k: getattr(cfg, k) for k in __info_config_keys__ if hasattr(cfg, k)}
+
+
+def get_config_hash(config):
+    the_s = json.dumps(config, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha1(the_s.encode('utf-8')).hexdigest(), the_s
+
+
+class ScoreStore():
+    """Persistent, append-only store of the scores shared by different searches.
+
+    The scores are saved in a SQLite file under cfg.score_store_dir, and keyed by the canonical
+    hash of the structure info and the hash of the score config. The budget metrics of the
+    structures are saved with the hash of the config they depend on, so a search can check the
+    budgets of a stored structure without building it. Records are never updated, so the first
+    rank writing a structure wins, and different ranks can read and write the store concurrently
+    through the SQLite file lock.
+    """
+    def __init__(self, cfg, logger=None, db_name='score_store.db', timeout=60, max_retry=10):
+        self.store_dir = cfg.score_store_dir
+        self.timeout = timeout
+        self.max_retry = max_retry
+        if logger is None:
+            self.logger = logging
+        else:
+            self.logger = logger
+
+        os.makedirs(self.store_dir, exist_ok=True)
+        self.db_path = os.path.join(self.store_dir, db_name)
+        self.score_config = get_score_config(cfg)
+        self.config_hash, the_s = get_config_hash(self.score_config)
+        self.info_config = get_info_config(cfg)
+        self.info_config_hash, the_info_s = get_config_hash(self.info_config)
+
+        self.num_hits = 0
+        self.num_misses = 0
+        self.num_writes = 0
+        self.num_info_hits = 0
+        self.num_info_misses = 0
+
+        # autocommit mode, each statement is one transaction
+        self.conn = sqlite3.connect(self.db_path, timeout=self.timeout, isolation_level=None)
+        self.execute('CREATE TABLE IF NOT EXISTS scores (structure_hash TEXT NOT NULL, config_hash TEXT NOT NULL, '
+                     'score REAL NOT NULL, structure TEXT, created REAL, PRIMARY KEY (structure_hash, config_hash))')
+        self.execute('CREATE TABLE IF NOT EXISTS infos (structure_hash TEXT NOT NULL, config_hash TEXT NOT NULL, '
+                     'info TEXT NOT NULL, created REAL, PRIMARY KEY (structure_hash, config_hash))')
+        self.execute('CREATE TABLE IF NOT EXISTS configs (config_hash TEXT PRIMARY KEY, config TEXT)')
+        self.execute('INSERT OR IGNORE INTO configs VALUES (?, ?)', (self.config_hash, the_s))
+        self.execute('INSERT OR IGNORE INTO configs VALUES (?, ?)', (self.info_config_hash, the_info_s))
+
+
+    def execute(self, sql, params=()):
+        # the busy timeout covers most of the lock contention, retry for the rest
+        for retry_count in range(self.max_retry):
+            try:
+                return self.conn.execute(sql, params).fetchall()
+            except sqlite3.OperationalError as err:
+                if 'locked' not in str(err) or retry_count == self.max_retry - 1:
+                    raise
+                time.sleep(0.1 * (retry_count + 1))
+
+
+    def get(self, structure_info):
+        rows = self.execute('SELECT score FROM scores WHERE structure_hash=? AND config_hash=?',
+                            (get_structure_hash(structure_info), self.config_hash))
+        if len(rows) > 0:
+            self.num_hits += 1
+            return rows[0][0]
+        self.num_misses += 1
+        return None
+
+
+    def put(self, structure_info, score):
+        self.execute('INSERT OR IGNORE INTO scores VALUES (?, ?, ?, ?, ?)',
+                     (get_structure_hash(structure_info), self.config_hash, float(score),
+                      json.dumps(structure_info, sort_keys=True), time.time()))
+        self.num_writes += 1
+
+
+    def get_info(self, structure_info):
+        """Get the budget metrics and the structure info of the built masternet, None if not stored."""
+        rows = self.execute('SELECT info FROM infos WHERE structure_hash=? AND config_hash=?',
+                            (get_structure_hash(structure_info), self.info_config_hash))
+        if len(rows) > 0:
+            self.num_info_hits += 1
+            return json.loads(rows[0][0])
+        self.num_info_misses += 1
+        return None
+
+
+    def put_info(self, model_info):
+        info = {k: model_info[k].item() if hasattr(model_info[k], "item") else model_info[k]
+                for k in __info_keys__ if k in model_info}
+        info["structure_info"] = model_info["structure_info"]
+        self.execute('INSERT OR IGNORE INTO infos VALUES (?, ?, ?, ?)',
+                     (get_structure_hash(model_info["structure_info"]), self.info_config_hash,
+                      json.dumps(info, sort_keys=True), time.time()))
+
+
+    def get_stats(self):
+        num_lookup = self.num_hits + self.num_misses
+        return {"hits": self.num_hits, "misses": self.num_misses, "writes": self.num_writes,
+                "hit_rate": self.num_hits / max(1, num_lookup), "info_hits": self.num_info_hits,
+                "info_misses": self.num_info_misses}
+
+
+    def __len__(self):
+        return self.execute('SELECT COUNT(*) FROM scores WHERE config_hash=?', (self.config_hash, ))[0][0]
+
+
+    def close(self):
+        self.conn.close()
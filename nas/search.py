@@ -4,11 +4,14 @@ import os
 import sys
 import pdb
 import time
+import glob
 import copy
 import random
+import contextlib
 import warnings
 import argparse
 import numpy as np
+import torch
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -16,7 +19,12 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from configs import (get_root_logger, load_py_module_from_path, 
                 AutoGPU, load_pyobj, save_pyobj, DictAction)
 from nas.builder import BuildNAS
-from nas.evolutions import Population 
+from nas.evolutions import (Population, ArchSpec, FeasibleSampler, GenomeCodec, get_block_layers, get_rejection_stats,
+                OffspringGenerator,
+                PopulationServer, get_child_message, get_budget_best, Surrogate, get_surrogate_stats,
+                SearchMetrics, get_metrics_summary, export_metrics_jsonl, export_metrics_prometheus,
+                save_population, load_population, EvaluationLog, load_search_state, load_evaluated_models,
+                get_random_state, set_random_state)
 
 
 def parse_args():
@@ -24,6 +32,8 @@ def parse_args():
     parser.add_argument('config', help='train config file path')
     parser.add_argument('--seed', type=int, default=None, help='random seed')
     parser.add_argument('--work_dir', help='the dir to save logs and models')
+    parser.add_argument('--resume', action='store_true',
+                        help='resume the search from the search state of each rank in work_dir/nas_cache')
     parser.add_argument(
         '--cfg_options',
         nargs='+',
@@ -56,12 +66,7 @@ def __check_block_structure_info_list_valid__(block_structure_info_list, cfg):
         else:
             assert stride == 1
 
-        if "L" not in block_structure_info.keys():
-            layers += 1
-        elif block_structure_info['class'] in ["SuperResConvK1KX", "SuperResConvKXKX"]:
-            layers += block_structure_info['L']*2
-        else:
-            layers += block_structure_info['L']*3
+        layers += get_block_layers(block_structure_info)
 
     if cfg.budget_stages is not None and num_stages > cfg.budget_stages:
         return False
@@ -72,40 +77,45 @@ def __check_block_structure_info_list_valid__(block_structure_info_list, cfg):
     return True
 
 
-def adjust_structures_inplace(block_structure_info_list, cfg):
-
-    # adjust channels
+def adjust_structures(block_structure_info_list, cfg):
+    """Get the new ArchSpec with the input channels and the kernel sizes fitted, the unchanged blocks are shared."""
+    new_block_list = []
     last_channels = None
-    for i, block_structure_info in enumerate(block_structure_info_list):
-        if last_channels is None:
-            last_channels = block_structure_info['out']
-            continue
-        else:
-            block_structure_info_list[i]['in'] = last_channels
-            last_channels = block_structure_info['out']
-
     # adjust kernel size <= feature map / 1.5
     resolution = cfg.budget_image_size
-    for i, block_structure_info in enumerate(block_structure_info_list):
-        stride = block_structure_info['s']
-        kernel_size = block_structure_info['k']
+    for block_structure_info in block_structure_info_list:
+        changes = {}
+        # adjust channels
+        if last_channels is not None and block_structure_info['in'] != last_channels:
+            changes['in'] = last_channels
+        last_channels = block_structure_info['out']
 
+        kernel_size = block_structure_info['k']
         while kernel_size * 1.5 > resolution:
             kernel_size -= 2
+        if kernel_size != block_structure_info['k']:
+            changes['k'] = kernel_size
 
-        block_structure_info['k'] = kernel_size
+        resolution /= block_structure_info['s']
+        new_block_list.append(block_structure_info.replace(**changes) if len(changes) > 0 else block_structure_info)
 
-        resolution /= stride
-
-    return block_structure_info_list
+    return ArchSpec(new_block_list)
 
 
 def get_new_random_structure_info(block_structure_info_list, mutate_function, cfg, \
-                                minor_mutation=False):
-    block_structure_info_list = copy.deepcopy(block_structure_info_list)
+                                minor_mutation=False, sampler=None, stats=None):
+    # the blocks are immutable and shared with the parent, only the mutated blocks are new
+    block_structure_info_list = ArchSpec.from_list(block_structure_info_list)
+
+    # the feasible sampler never proposes an invalid structure, no retry is needed
+    if sampler is not None:
+        for mutate_count in range(cfg.space_block_num):
+            block_structure_info_list = sampler.sample(block_structure_info_list, minor_mutation=minor_mutation)
+        return block_structure_info_list
 
     for mutate_count in range(cfg.space_block_num):
         is_valid = False
+        new_block_structure_info_list = block_structure_info_list
 
         for idx in range(len(block_structure_info_list)):
             random_id = random.randint(0, len(block_structure_info_list) - 1)
@@ -114,29 +124,25 @@ def get_new_random_structure_info(block_structure_info_list, mutate_function, cf
                 while random_id == 0:
                     random_id = random.randint(0, len(block_structure_info_list) - 1)
 
-            mutated_block_list = mutate_function(random_id, block_structure_info_list, \
+            # a new list of the shared blocks, the mutation can also replace the neighbour blocks in it
+            block_list = list(block_structure_info_list)
+            mutated_block_list = mutate_function(random_id, block_list, \
                 cfg.budget_layers, minor_mutation=minor_mutation)
+            if stats is not None: stats["proposals"] += 1
 
             if mutated_block_list == False:
+                if stats is not None: stats["rejected"] += 1
                 continue
 
-            new_block_structure_info_list = []
-            for block_id in range(len(block_structure_info_list)):
-                if block_id != random_id:
-                    new_block_structure_info_list.append(block_structure_info_list[block_id])
-                else:
-                    if mutated_block_list is None:
-                        pass
-                    else:
-                        for mutated_block in mutated_block_list:
-                            new_block_structure_info_list.append(mutated_block)
-                        pass
-                    pass  # end if
-                pass  # end if
-
-            adjust_structures_inplace(new_block_structure_info_list, cfg)
+            if mutated_block_list is None:
+                mutated_block_list = []
+            new_block_structure_info_list = ArchSpec(block_list[:random_id] + list(mutated_block_list) + block_list[random_id+1:])
+
+            new_block_structure_info_list = adjust_structures(new_block_structure_info_list, cfg)
             # check valid
             is_valid = __check_block_structure_info_list_valid__(new_block_structure_info_list, cfg)
+            if stats is not None and not is_valid: stats["rejected"] += 1
+            if stats is not None and new_block_structure_info_list == block_structure_info_list: stats["unchanged"] += 1
             if is_valid: break
         pass  # end while not is_valid:
         block_structure_info_list = new_block_structure_info_list
@@ -144,42 +150,200 @@ def get_new_random_structure_info(block_structure_info_list, mutate_function, cf
     return block_structure_info_list
 
 
+def save_search_state(filename, popu_nas, cfg, search_state):
+    """Save the population with the full state of the search on this rank, which is restored by --resume.
+
+    :param search_state: the counters and the trackers of the main loop, the random states are added here
+    """
+    search_state = dict(search_state, rank=cfg.rank, world_size=cfg.world_size, random_state=get_random_state())
+    save_population(filename, popu_nas, search_state=search_state)
+
+
+def export_generation(popu_nas, model_nas, cfg, logger, elasp_time, mutation_stats_info, worker_idle_time_list,
+                      surrogate_stats_info=None, metrics_stats_list=None):
+    """Save the latest population of the master, and log the intermediate results."""
+    if cfg.ea_checkpoint_format == "npz":
+        # the latest population, the evaluated nets are in the append-only logs
+        export_generation_filename = os.path.join(cfg.work_dir, 'nas_cache/population.npz')
+        save_population(export_generation_filename, popu_nas)
+    else:
+        export_generation_filename = os.path.join(cfg.work_dir,
+                                                  'nas_cache/iter{}.txt'.format(popu_nas.num_evaluated_nets_count))
+        save_pyobj(export_generation_filename, popu_nas.export_dict())
+    print('exporting generation: %s'%(export_generation_filename))
+
+    # logging intermediate results
+    remain_time = elasp_time * float(cfg.ea_num_random_nets - popu_nas.num_evaluated_nets_count) / (
+                1e-10 + float(popu_nas.num_evaluated_nets_count))
+    if len(popu_nas.popu_acc_list) > 0:
+        individual_info = popu_nas.get_individual_info(idx=0)
+        logger.info('---rank={}, n={}, elasp_time={:4g}h, remain_time={:4}h'.format(
+                cfg.rank, popu_nas.num_evaluated_nets_count, elasp_time / 3600, remain_time / 3600))
+        logger.info('---best_individual: {}'.format(individual_info))
+    if model_nas.score_store is not None:
+        logger.info('---score_store: {}'.format(model_nas.score_store.get_stats()))
+    logger.info('---mutation: {}'.format(mutation_stats_info))
+    if surrogate_stats_info is not None:
+        logger.info('---surrogate: {}'.format(surrogate_stats_info))
+    if cfg.world_size > 1:
+        # rank 0 is the time the master blocks in waitany, the others the time the workers wait for the new jobs
+        logger.info('---idle_time: {}'.format(', '.join(['rank{}={:.1f}s ({:.1%})'.format(
+                    rank, idle_time, idle_time/max(1e-10, elasp_time)) for rank, idle_time in enumerate(worker_idle_time_list)])))
+    if metrics_stats_list is not None:
+        export_metrics(popu_nas, cfg, logger, metrics_stats_list)
+
+
+def export_metrics(popu_nas, cfg, logger, metrics_stats_list):
+    """Log the summary of the phase timers and the candidate counters of all the ranks, and append them to
+    the JSONL file, and write the Prometheus text file with ea_metrics_prometheus."""
+    logger.info('---metrics: {}'.format(get_metrics_summary(metrics_stats_list)))
+    if cfg.ea_metrics:
+        export_metrics_jsonl(os.path.join(cfg.work_dir, 'metrics.jsonl'), metrics_stats_list, popu_nas.num_evaluated_nets_count)
+    if cfg.ea_metrics_prometheus is not None:
+        export_metrics_prometheus(os.path.join(cfg.work_dir, cfg.ea_metrics_prometheus), metrics_stats_list,
+                                  popu_nas.num_evaluated_nets_count)
+
+
+def get_pareto_population(popu_nas, cfg, logger, evaluated_models, multi_objective, chunk_size=1000):
+    """Get the Pareto front of the acc and multi_objective over the population and the evaluated models, ranked
+    by the acc. The front is not cut to ea_popu_size by the NSGA-II survivors."""
+    pareto_cfg = copy.copy(cfg)
+    pareto_cfg.ea_multi_objective = list(multi_objective)
+    pareto_cfg.ea_popu_size = sys.maxsize
+    pareto_popu = Population(pareto_cfg, logger)
+    pareto_popu.set_genome_codec(popu_nas.genome_codec)
+    pareto_popu.merge_shared_data(popu_nas.export_dict(), update_num=False)
+    # the dominated nets are removed by chunks, so the front stays small
+    for chunk_idx in range(0, len(evaluated_models), chunk_size):
+        for model_info in evaluated_models[chunk_idx:chunk_idx+chunk_size]:
+            pareto_popu.update_population(model_info)
+        pareto_popu.keep_pareto_front()
+    pareto_popu.keep_pareto_front()
+    return pareto_popu
+
+
+def export_pareto_front(popu_nas, cfg, logger, chunk_size=1000):
+    """Export the Pareto front of all the evaluated nets in the evaluation logs of all the ranks, or of the final
+    population with the txt checkpoints, and the best structure under each of ea_pareto_budgets."""
+    evaluated_models = []
+    if cfg.ea_checkpoint_format == "npz":
+        evaluated_models = list(load_evaluated_models(glob.glob(os.path.join(cfg.work_dir, 'nas_cache/evaluated_rank*.bin'))).values())
+    pareto_popu = get_pareto_population(popu_nas, cfg, logger, evaluated_models, cfg.ea_multi_objective, chunk_size)
+
+    export_pareto_filename = os.path.join(cfg.work_dir, 'nas_cache/pareto_front.%s'%(cfg.ea_checkpoint_format))
+    if cfg.ea_checkpoint_format == "npz":
+        save_population(export_pareto_filename, pareto_popu)
+    else:
+        save_pyobj(export_pareto_filename, pareto_popu.export_dict())
+    logger.info('---pareto_front: {} structures, {}'.format(len(pareto_popu.popu_acc_list), export_pareto_filename))
+    # the indices are of the order saved above, ranking again may swap the individuals of the same acc
+    for idx in range(len(pareto_popu.popu_acc_list)):
+        logger.info('---pareto_individual: {}'.format(pareto_popu.get_individual_info(idx=idx, rank=False)))
+
+    for key, budget_list in (cfg.ea_pareto_budgets or {}).items():
+        # the best acc under a budget is on the front of the acc and the budget key, which is the front above
+        # only if the key is the single objective
+        budget_popu = pareto_popu if list(cfg.ea_multi_objective) == [key] else \
+                      get_pareto_population(popu_nas, cfg, logger, evaluated_models, [key], chunk_size)
+        metrics = {metric_key: getattr(budget_popu, "popu_%s_list"%(metric_key)) for metric_key in budget_popu.get_metric_keys()}
+        budget_best = get_budget_best(range(len(budget_popu.popu_acc_list)), metrics, {key: budget_list})
+        for (key, budget), idx in budget_best.items():
+            if idx is None:
+                logger.info('---no evaluated structure meets {}={:g}'.format(key, budget))
+                continue
+            individual_info = budget_popu.get_individual_info(idx=idx, is_struct=True, rank=False)
+            save_pyobj(os.path.join(cfg.work_dir, 'best_structure_%s%g.txt'%(key, budget)), individual_info["structure"])
+            save_pyobj(os.path.join(cfg.work_dir, 'nas_info_%s%g.txt'%(key, budget)), individual_info)
+
+
+def assign_worker_job(mpi_comm, popu_nas, cfg, worker_id):
+    """Send the population to the worker as its new job, and get the request of its results."""
+    req = mpi_comm.isend(popu_nas.export_dict(packed=cfg.ea_packed_genome), dest=worker_id, tag=1)
+    req.wait()
+    buf = bytearray(1 << 28)
+    return mpi_comm.irecv(buf, source=worker_id, tag=2)
+
+
+def get_model_info(model_nas, structure_info, evaluated_models=None, surrogate=None, min_acc=None, metrics=None):
+    # the surrogate skips the evaluation of the nets unlikely to have an acc above min_acc
+    if surrogate is not None and surrogate.screen(structure_info, min_acc):
+        model_info = {"structure_info": structure_info, "is_satify_budget": False, "is_screened": True}
+        if metrics is not None: metrics.count_candidate(model_info)
+        return model_info
+    # the models in the evaluation logs before --resume are not evaluated again
+    model_info = None
+    if evaluated_models is not None:
+        model_info = evaluated_models.get(ArchSpec.from_list(structure_info))
+    is_cached = model_info is not None
+    if model_info is None:
+        model_info = model_nas.get_info_for_evolution(structure_info=structure_info)
+    if surrogate is not None: surrogate.update(model_info)
+    if metrics is not None: metrics.count_candidate(model_info, cached=is_cached)
+    return model_info
+
+
 def do_main_job(popu_nas, model_nas, logger=None, max_iter=None, cfg=None,
-                masternet_structure_info=None,):
+                masternet_structure_info=None, sampler=None, mutation_stats=None, evaluation_log=None,
+                evaluated_models=None, surrogate=None, offspring=None, metrics=None):
 
     # whether to fix the stage layer, enable minor_mutation for mutation function.
     if cfg.space_minor_mutation and popu_nas.num_evaluated_nets_count > cfg.space_minor_iter:
         minor_mutation = True
     else:
         minor_mutation = False
+    # the phase timers of the search, or the empty contexts
+    get_phase_timer = metrics.phase if metrics is not None else lambda phase: contextlib.nullcontext()
 
-    for loop_count in range(max_iter):
+    offspring_list = []
+    loop_count = 0
+    while loop_count < max_iter:
         # too many networks in the population pool, remove one with the smallest accuracy
         if len(popu_nas.popu_structure_list) > cfg.ea_popu_size:
             logger.debug('*** debug: rank={}, population too large, remove some.'.format(cfg.rank))
-            popu_nas.rank_population(maintain_popu=True)
+            with get_phase_timer("ranking"):
+                popu_nas.rank_population(maintain_popu=True)
         pass
 
         # ----- begin random generate a new structure and examine its performance ----- #
         logger.debug('*** debug: rank={}, generate random structure, loop_count={}'.format(cfg.rank, loop_count))
-        if len(popu_nas.popu_structure_list) == 0:
-            random_structure_info = masternet_structure_info
-        else:
-            init_random_structure_info = random.choice(popu_nas.popu_structure_list)
-            random_structure_info = get_new_random_structure_info(
-                block_structure_info_list=init_random_structure_info,
-                mutate_function=model_nas.mutation, cfg=cfg, minor_mutation=minor_mutation)
-        pass  # end if
+        with get_phase_timer("mutation"):
+            if len(popu_nas.popu_structure_list) == 0:
+                random_structure_info = masternet_structure_info
+            elif offspring is not None:
+                # a batch of children of the population at once, evaluated one by one
+                if len(offspring_list) == 0:
+                    offspring_list = offspring.generate(popu_nas.select_parent, min(cfg.ea_offspring_batch, max_iter - loop_count),
+                                                        minor_mutation=minor_mutation, stats=mutation_stats)
+                random_structure_info = offspring_list.pop(0)
+            else:
+                init_random_structure_info = popu_nas.select_parent()
+                random_structure_info = get_new_random_structure_info(
+                    block_structure_info_list=init_random_structure_info,
+                    mutate_function=model_nas.mutation, cfg=cfg, minor_mutation=minor_mutation,
+                    sampler=sampler, stats=mutation_stats)
+            pass  # end if
         logger.debug('*** debug: rank={}, random structure generated'.format(cfg.rank))
 
         # load random_structure_info, get the basic info, update the population
-        random_struct_info = model_nas.get_info_for_evolution(structure_info=random_structure_info)
-        if random_struct_info["is_satify_budget"]: popu_nas.update_population(random_struct_info)
-
-    pass  # end for loop_count
+        min_acc = min(popu_nas.popu_acc_list) if len(popu_nas.popu_acc_list) >= cfg.ea_popu_size else None
+        random_struct_info = get_model_info(model_nas, random_structure_info, evaluated_models, surrogate, min_acc, metrics)
+        # the mutants screened by the surrogate are not evaluated, and not counted as the evaluated nets
+        if random_struct_info.get("is_screened", False): continue
+        # the number of evaluated nets when the individual is born, for the aging survivors
+        random_struct_info["birth"] = popu_nas.num_evaluated_nets_count + loop_count
+        if random_struct_info["is_satify_budget"]:
+            with get_phase_timer("ranking"):
+                popu_nas.update_population(random_struct_info)
+            if evaluation_log is not None:
+                with get_phase_timer("checkpoint"):
+                    evaluation_log.append(random_struct_info)
+        loop_count += 1
+
+    pass  # end while loop_count
 
     logger.debug('*** debug: rank={}, cleaning population before return main_job'.format(cfg.rank))
-    popu_nas.rank_population(maintain_popu=True)
+    with get_phase_timer("ranking"):
+        popu_nas.rank_population(maintain_popu=True)
     logger.debug('*** debug: rank={}, return main_job'.format(cfg.rank))
 
     return popu_nas
@@ -217,6 +381,10 @@ def main():
         random.seed(13 + mpi_rank)
     else:
         raise RuntimeError('Not implemented dist_mode=' + cfg.ea_dist_mode)
+    if args.seed is not None:
+        random.seed(args.seed + cfg.rank)
+        np.random.seed(args.seed + cfg.rank)
+        torch.manual_seed(args.seed + cfg.rank)
     timestamp = time.strftime('%Y%m%d_%H%M%S', time.localtime())
     log_file = os.path.join(cfg.work_dir, "search_log/log_rank%d_%s"%(cfg.rank, timestamp))
     os.makedirs(os.path.dirname(log_file), exist_ok=True)
@@ -248,6 +416,72 @@ def main():
         raise ValueError("The initial network must meet the limit budget, preferably less than 1/4")
     if cfg.only_master: exit()
 
+    # the phase timers and the candidate counters of this rank, the masternet above is not counted
+    metrics = SearchMetrics(cfg.rank)
+    model_nas.metrics = metrics
+
+    # sample the mutation from the feasible choices, or count the rejected proposals of mutate_function
+    sampler = None
+    mutation_stats = {"proposals": 0, "rejected": 0, "unchanged": 0}
+    if cfg.space_feasible_sampler:
+        if model_nas.mutation_choices is None:
+            raise ValueError("%s has no get_mutation_choices for space_feasible_sampler"%(cfg.space_mutation))
+        sampler = FeasibleSampler(model_nas.mutation_choices, cfg, adjust_function=adjust_structures,
+                                valid_function=__check_block_structure_info_list_valid__)
+
+    # the crossover and the batched mutations of the children
+    offspring = None
+    if cfg.ea_crossover_ratio > 0 or cfg.ea_offspring_batch > 1:
+        if model_nas.mutation_batch is None:
+            raise ValueError("%s has no mutate_batch for ea_crossover_ratio and ea_offspring_batch"%(cfg.space_mutation))
+        offspring = OffspringGenerator(model_nas.mutation_batch, cfg, adjust_function=adjust_structures,
+                                valid_function=__check_block_structure_info_list_valid__)
+
+    # the packed genomes for the messages between the ranks and the checkpoints, the same codec on all the ranks
+    popu_nas.set_genome_codec(GenomeCodec(masternet_structure_info, max_layers=cfg.budget_layers))
+
+    # the full state of the search on each rank, saved with the population for --resume
+    search_state_filename = os.path.join(cfg.work_dir, 'nas_cache/search_state_rank%d.npz'%(cfg.rank))
+    search_state = None
+    if args.resume:
+        if os.path.isfile(search_state_filename):
+            popu_nas_info, search_state = load_search_state(search_state_filename)
+            if search_state["world_size"] != cfg.world_size:
+                raise ValueError("the search is saved with world_size=%d, can't resume with world_size=%d"%(
+                                search_state["world_size"], cfg.world_size))
+            logger.info('resume the search from %s, n=%d'%(search_state_filename, popu_nas_info["num_evaluated_nets_count"]))
+        else:
+            logger.info('no search state in %s, start a new search'%(search_state_filename))
+
+    evaluation_log = None
+    evaluated_models = None
+    if cfg.ea_checkpoint_format == "npz":
+        evaluation_log_filename = os.path.join(cfg.work_dir, 'nas_cache/evaluated_rank%d.bin'%(cfg.rank))
+        # the models evaluated by all the ranks, including the ones after the search state was saved
+        if search_state is not None:
+            evaluated_models = load_evaluated_models(glob.glob(os.path.join(cfg.work_dir, 'nas_cache/evaluated_rank*.bin')))
+            logger.info('load %d evaluated models'%(len(evaluated_models)))
+        evaluation_log = EvaluationLog(evaluation_log_filename, popu_nas.genome_codec, popu_nas.get_model_info_keys())
+        # the evaluated models after the search state are logged again when they are generated
+        if search_state is not None:
+            evaluation_log.truncate(search_state["num_evaluated_records"])
+
+    # the surrogate of the score on this rank, warm started with the evaluation logs of the previous searches,
+    # and on --resume with the evaluation log of this rank, retrained as it was saved
+    surrogate = None
+    if cfg.ea_surrogate:
+        surrogate = Surrogate(popu_nas.genome_codec, cfg, logger)
+        surrogate_filename_list = sorted([filename for pattern in cfg.ea_surrogate_data for filename in glob.glob(pattern)])
+        if search_state is not None and evaluation_log is not None:
+            surrogate_filename_list.append(evaluation_log_filename)
+        if len(surrogate_filename_list) > 0:
+            surrogate.load(surrogate_filename_list, num_trained=search_state.get("surrogate_num_trained") \
+                           if search_state is not None else None)
+        if search_state is not None:
+            surrogate.stats.update(search_state.get("surrogate_stats") or {})
+    if search_state is not None and search_state.get("metrics_stats") is not None:
+        metrics.set_stats(search_state["metrics_stats"])
+
     # initialize the population with the masternet
     for i in range(popu_nas.popu_size):
         popu_nas.update_population(masternet_info)
@@ -257,165 +491,322 @@ def main():
 
     num_evaluated_nets_count = 0
     # load population list
-    if cfg.ea_load_population is not None:
+    if search_state is not None:
+        popu_nas.init_population()
+        popu_nas.merge_shared_data(popu_nas_info)
+    elif cfg.ea_load_population is not None:
         logger.info('load_population= %s'%(cfg.ea_load_population))
-        loader = load_pyobj(cfg.ea_load_population)
+        loader = load_population(cfg.ea_load_population)
         popu_nas.merge_shared_data(loader)
 
     start_timer = time.time()
     worker_busy_list = [False] * cfg.world_size
     worker_req_list = [None] * cfg.world_size
+    # the seconds the workers wait for the new jobs, reported with their results, and the master waits for the results
+    worker_idle_time_list = [0.0] * cfg.world_size
+    worker_idle_time = 0.0
+    # the stats of the surrogates, the workers report theirs with the results
+    worker_surrogate_stats_list = [None] * cfg.world_size
+    # the stats of the phase timers and the candidate counters, the workers report theirs with the results
+    worker_metrics_stats_list = [None] * cfg.world_size
     last_export_generation_iteration = 0
 
     early_stop = False
     last_min_score = -1
     last_min_score_step = 0
-    while not early_stop:
-        # early stop when min score stops update largely
-        if cfg.rank == 0 and popu_nas.num_evaluated_nets_count >= 10000:
-            min_score = min(popu_nas.popu_acc_list)
-            max_score = max(popu_nas.popu_acc_list)
-            if min_score - last_min_score < max_score * 1e-3:
-                if popu_nas.num_evaluated_nets_count - last_min_score_step > 0.2 * cfg.ea_num_random_nets:
-                    early_stop = False # no early stop
-                    # early_stop = True # early stop is remained for madnas
-                    # logger.info('early stop since min_score={:.4g} from iter={} to iter={}'.format(min_score, last_min_score_step, popu_nas.num_evaluated_nets_count))
-            else:
-                last_min_score = min_score
-                last_min_score_step = popu_nas.num_evaluated_nets_count
-
-
-        # for master node, gather all worker results, if any
+    if search_state is not None:
+        # minor_mutation is enabled by num_evaluated_nets_count, which is restored with the population
+        start_timer -= search_state["elapsed_time"]
+        last_export_generation_iteration = search_state["last_export_generation_iteration"]
+        early_stop = search_state["early_stop"]
+        last_min_score = search_state["last_min_score"]
+        last_min_score_step = search_state["last_min_score_step"]
+        mutation_stats.update(search_state["mutation_stats"])
+        if sampler is not None and search_state["sampler_stats"] is not None:
+            sampler.stats.update(search_state["sampler_stats"])
+        # the last step, the random states are the same as the ones of the saved search
+        set_random_state(search_state["random_state"])
+
+    def get_surrogate_stats_info():
+        if surrogate is None: return None
+        worker_surrogate_stats_list[0] = surrogate.stats
+        return get_surrogate_stats([x for x in worker_surrogate_stats_list if x is not None])
+
+    def get_metrics_stats_list():
+        worker_metrics_stats_list[0] = metrics.get_stats()
+        return [x for x in worker_metrics_stats_list if x is not None]
+
+    def get_search_state():
+        return {"num_evaluated_records": evaluation_log.num_records if evaluation_log is not None else 0,
+                "elapsed_time": time.time() - start_timer,
+                "last_export_generation_iteration": last_export_generation_iteration,
+                "early_stop": early_stop, "last_min_score": last_min_score, "last_min_score_step": last_min_score_step,
+                "minor_mutation": cfg.space_minor_mutation and popu_nas.num_evaluated_nets_count > cfg.space_minor_iter,
+                "mutation_stats": mutation_stats, "sampler_stats": sampler.stats if sampler is not None else None,
+                "surrogate_num_trained": surrogate.num_trained if surrogate is not None else 0,
+                "surrogate_stats": surrogate.stats if surrogate is not None else None,
+                "metrics_stats": metrics.get_stats()}
+
+    if cfg.ea_steady_state and cfg.world_size > 1:
+        # steady-state evolution, rank 0 serves the population, each worker fetches one parent and pushes one child at a time
         if cfg.rank == 0:
-            for worker_id in range(1, cfg.world_size):
-                if worker_busy_list[worker_id]:
-                    the_req = worker_req_list[worker_id]
-                    req_status, req_item = the_req.test()
-                    if req_status:
-                        global_shared_data = req_item
-                        the_req.wait()
-                        logger.debug('*** master recv results from work {}, len={}, n={}'.format(worker_id,
-                                                                                             len(popu_nas.popu_structure_list),
-                                                                                             popu_nas.num_evaluated_nets_count))
-                        if global_shared_data is not None:  # when worker send non-empty list
-                            popu_nas.merge_shared_data(global_shared_data, update_num=False)
-                        else:
-                            raise RuntimeError('from worker {}, recv None results!'.format(worker_id))
-
-                        logger.debug('*** master updates n from {} to {}'.format(popu_nas.num_evaluated_nets_count,
-                                                                                       popu_nas.num_evaluated_nets_count + sync_interval))
-                        popu_nas.num_evaluated_nets_count += sync_interval # updat the num_evaluted after finish once sync
+            server = PopulationServer(popu_nas, cfg)
+            worker_mutation_stats_list = [{}] * cfg.world_size
+            mpi_status = MPI.Status()
+            num_running_workers = cfg.world_size - 1
+            while num_running_workers > 0:
+                wait_timer = time.time()
+                worker_message = mpi_comm.recv(source=MPI.ANY_SOURCE, tag=3, status=mpi_status)
+                worker_idle_time_list[0] += time.time() - wait_timer
+                metrics.add_time("sync", time.time() - wait_timer)
+                worker_id = mpi_status.Get_source()
+                worker_idle_time_list[worker_id] += worker_message["worker_idle_time"]
+                worker_mutation_stats_list[worker_id] = worker_message["mutation_stats"]
+                worker_surrogate_stats_list[worker_id] = worker_message["surrogate_stats"]
+                worker_metrics_stats_list[worker_id] = worker_message["metrics_stats"]
+                if worker_message["child"] is not None:
+                    with metrics.phase("ranking"):
+                        server.put_child_message(worker_message["child"])
+
+                # the children in flight are still merged after the search is done
+                if server.is_done():
+                    mpi_comm.send(None, dest=worker_id, tag=4)
+                    num_running_workers -= 1
+                    logger.debug('*** debug: master has send termination signal to worker {}.'.format(worker_id))
+                else:
+                    mpi_comm.send(server.get_parent_message(), dest=worker_id, tag=4)
+
+                # export generation
+                if popu_nas.num_evaluated_nets_count - last_export_generation_iteration > max(1, cfg.ea_log_freq):
+                    mutation_stats_info = {key: sum([x.get(key, 0) for x in worker_mutation_stats_list])
+                                        for key in worker_mutation_stats_list[worker_id]}
+                    with metrics.phase("checkpoint"):
+                        export_generation(popu_nas, model_nas, cfg, logger, time.time() - start_timer,
+                                        get_rejection_stats(mutation_stats_info), worker_idle_time_list,
+                                        get_surrogate_stats_info(), get_metrics_stats_list())
+                        last_export_generation_iteration = popu_nas.num_evaluated_nets_count
+                        save_search_state(search_state_filename, popu_nas, cfg, get_search_state())
+            pass  # end while num_running_workers
+            popu_nas.rank_population(maintain_popu=True)
+        else:
+            child_message = None
+            num_worker_evaluated_nets = 0
+            while True:
+                wait_timer = time.time()
+                mpi_comm.send({"child": child_message, "worker_idle_time": worker_idle_time,
+                               "mutation_stats": sampler.stats if sampler is not None else mutation_stats,
+                               "surrogate_stats": surrogate.stats if surrogate is not None else None,
+                               "metrics_stats": metrics.get_stats()}, dest=0, tag=3)
+                parent_message = mpi_comm.recv(source=0, tag=4)
+                worker_idle_time = time.time() - wait_timer
+                metrics.add_time("sync", worker_idle_time)
+                if parent_message is None:
+                    logger.debug('*** debug: worker {} recv termination signal. Break now.'.format(cfg.rank))
+                    break
+
+                parent_structure_info = popu_nas.genome_codec.decode(parent_message["parent"])
+                is_screened = True
+                # the mutants screened by the surrogate are not evaluated, and another one is generated
+                while is_screened:
+                    with metrics.phase("mutation"):
+                        random_structure_info = None
+                        if parent_message["is_crossover"] and offspring is not None:
+                            mate_structure_info = popu_nas.genome_codec.decode(parent_message["mate"]) \
+                                                  if parent_message["mate"] is not None else None
+                            random_structure_info = offspring.crossover(parent_structure_info, mate_structure_info,
+                                                                        stats=mutation_stats)
+                        if random_structure_info is None:
+                            random_structure_info = get_new_random_structure_info(
+                                block_structure_info_list=parent_structure_info,
+                                mutate_function=model_nas.mutation, cfg=cfg, minor_mutation=parent_message["minor_mutation"],
+                                sampler=sampler, stats=mutation_stats)
+                    random_struct_info = get_model_info(model_nas, random_structure_info, evaluated_models,
+                                                        surrogate, parent_message["min_acc"], metrics)
+                    is_screened = random_struct_info.get("is_screened", False)
+                if random_struct_info["is_satify_budget"] and evaluation_log is not None:
+                    with metrics.phase("checkpoint"):
+                        evaluation_log.append(random_struct_info)
+                child_message = get_child_message(random_struct_info, popu_nas.genome_codec, popu_nas.get_model_info_keys())
+
+                num_worker_evaluated_nets += 1
+                if num_worker_evaluated_nets % sync_interval == 0:
+                    with metrics.phase("checkpoint"):
+                        save_search_state(search_state_filename, popu_nas, cfg, get_search_state())
+            pass  # end while True
+    else:
+        while not early_stop:
+            # early stop when min score stops update largely
+            if cfg.rank == 0 and popu_nas.num_evaluated_nets_count >= 10000:
+                min_score = min(popu_nas.popu_acc_list)
+                max_score = max(popu_nas.popu_acc_list)
+                if min_score - last_min_score < max_score * 1e-3:
+                    if popu_nas.num_evaluated_nets_count - last_min_score_step > 0.2 * cfg.ea_num_random_nets:
+                        early_stop = False # no early stop
+                        # early_stop = True # early stop is remained for madnas
+                        # logger.info('early stop since min_score={:.4g} from iter={} to iter={}'.format(min_score, last_min_score_step, popu_nas.num_evaluated_nets_count))
+                else:
+                    last_min_score = min_score
+                    last_min_score_step = popu_nas.num_evaluated_nets_count
+
+
+            # for master node, serve the worker results as they arrive, and assign the new job to the worker right away.
+            # the master evaluates ea_master_iter nets between serving, or blocks in waitany when ea_master_iter=0
+            while cfg.rank == 0 and any(worker_busy_list):
+                busy_worker_list = [worker_id for worker_id in range(1, cfg.world_size) if worker_busy_list[worker_id]]
+                busy_req_list = [worker_req_list[worker_id] for worker_id in busy_worker_list]
+                if cfg.ea_master_iter == 0:
+                    wait_timer = time.time()
+                    req_idx, global_shared_data = MPI.Request.waitany(busy_req_list)
+                    worker_idle_time_list[0] += time.time() - wait_timer
+                    metrics.add_time("sync", time.time() - wait_timer)
+                else:
+                    req_idx, req_status, global_shared_data = MPI.Request.testany(busy_req_list)
+                    if not req_status: break
+                worker_id = busy_worker_list[req_idx]
+                logger.debug('*** master recv results from work {}, len={}, n={}'.format(worker_id,
+                                                                                     len(popu_nas.popu_structure_list),
+                                                                                     popu_nas.num_evaluated_nets_count))
+                if global_shared_data is not None:  # when worker send non-empty list
+                    worker_idle_time_list[worker_id] += global_shared_data.get("worker_idle_time", 0.0)
+                    worker_surrogate_stats_list[worker_id] = global_shared_data.get("surrogate_stats")
+                    worker_metrics_stats_list[worker_id] = global_shared_data.get("metrics_stats")
+                    with metrics.phase("ranking"):
+                        popu_nas.merge_shared_data(global_shared_data, update_num=False)
+                else:
+                    raise RuntimeError('from worker {}, recv None results!'.format(worker_id))
+
+                logger.debug('*** master updates n from {} to {}'.format(popu_nas.num_evaluated_nets_count,
+                                                                               popu_nas.num_evaluated_nets_count + sync_interval))
+                popu_nas.num_evaluated_nets_count += sync_interval # updat the num_evaluted after finish once sync
+                worker_req_list[worker_id] = None
+                worker_busy_list[worker_id] = False
+                if popu_nas.num_evaluated_nets_count < cfg.ea_num_random_nets:
+                    with metrics.phase("sync"):
+                        worker_req_list[worker_id] = assign_worker_job(mpi_comm, popu_nas, cfg, worker_id)
+                    worker_busy_list[worker_id] = True
+                    logger.debug('*** debug: master assign new job to worker {}. n={}'.format(
+                                worker_id, popu_nas.num_evaluated_nets_count))
+                # one result at a time when the master blocks, so the export and the termination are checked
+                if cfg.ea_master_iter == 0: break
+            pass  # end cfg.rank == 0:
+
+            # for worker node, ask for new jobs
+            if cfg.rank > 0:
+                wait_timer = time.time()
+                buf = bytearray(1 << 28)
+                req = mpi_comm.irecv(buf, source=0, tag=1)
+                global_shared_data = req.wait()
+                worker_idle_time = time.time() - wait_timer
+                metrics.add_time("sync", worker_idle_time)
+                # print("global_shared_data", global_shared_data)
+                logger.debug('*** debug: worker {} is assigned new jobs, len={}, n={}.'.format(cfg.rank,
+                                                                                   len(popu_nas.popu_structure_list),
+                                                                                    popu_nas.num_evaluated_nets_count))
+                if global_shared_data is not None:
+                    with metrics.phase("ranking"):
+                        popu_nas.merge_shared_data(global_shared_data)
+
+            # enough jobs done, master node clean up and exit
+            if cfg.rank == 0 and (popu_nas.num_evaluated_nets_count >= cfg.ea_num_random_nets or early_stop):
+                logger.debug('*** debug: master send termination signal to all  workers.')
+                for worker_id in range(1, cfg.world_size):
+                    if worker_busy_list[worker_id]:
+                        # logger.info('master waiting worker {} to finish last job.'.format(worker_id))
+                        the_req = worker_req_list[worker_id]
+                        _ = the_req.wait()
                         worker_req_list[worker_id] = None
                         worker_busy_list[worker_id] = False
+                        logger.debug('*** debug: master knows that worker {} has finished last job.'.format(worker_id))
+
+                    # send done signal to worker and wait for confirmation
+                    req = mpi_comm.isend(popu_nas.export_dict(packed=cfg.ea_packed_genome), dest=worker_id, tag=1)
+                    req.wait()
+                    logger.debug('*** debug: master has send termination signal to worker {}.'.format(worker_id))
+                pass  # end for worker_id
+                logger.debug('*** debug: master has send termination signal to everyone, master break looping now.')
+                break
+            pass  # end if
+
+            # enough jobs done, worker node clean up and exit
+            if cfg.rank > 0 and (popu_nas.num_evaluated_nets_count >= cfg.ea_num_random_nets or early_stop):
+                logger.debug('*** debug: worker {} recv termination signal. Break now.'.format(cfg.rank))
+                break
+
+            # for master, assign new jobs to workers
+            if cfg.rank == 0:
+                for worker_id in range(1, cfg.world_size):
+                    if not worker_busy_list[worker_id]:
+                        with metrics.phase("sync"):
+                            worker_req_list[worker_id] = assign_worker_job(mpi_comm, popu_nas, cfg, worker_id)
+                        worker_busy_list[worker_id] = True
+                        logger.debug('*** debug: master assign new job to worker {}. n={}'.format(
+                                    worker_id, popu_nas.num_evaluated_nets_count))
                     pass
-                pass
-            pass  # end for worker_id
-        pass  # end cfg.rank == 0:
-
-        # for worker node, ask for new jobs
-        if cfg.rank > 0:
-            buf = bytearray(1 << 28)
-            req = mpi_comm.irecv(buf, source=0, tag=1)
-            global_shared_data = req.wait()
-            # print("global_shared_data", global_shared_data)
-            logger.debug('*** debug: worker {} is assigned new jobs, len={}, n={}.'.format(cfg.rank,
-                                                                               len(popu_nas.popu_structure_list),
-                                                                                popu_nas.num_evaluated_nets_count))
-            if global_shared_data is not None: popu_nas.merge_shared_data(global_shared_data)
-
-        # enough jobs done, master node clean up and exit
-        if cfg.rank == 0 and (popu_nas.num_evaluated_nets_count >= cfg.ea_num_random_nets or early_stop):
-            logger.debug('*** debug: master send termination signal to all  workers.')
-            for worker_id in range(1, cfg.world_size):
-                if worker_busy_list[worker_id]:
-                    # logger.info('master waiting worker {} to finish last job.'.format(worker_id))
-                    the_req = worker_req_list[worker_id]
-                    _ = the_req.wait()
-                    worker_req_list[worker_id] = None
-                    worker_busy_list[worker_id] = False
-                    logger.debug('*** debug: master knows that worker {} has finished last job.'.format(worker_id))
-
-                # send done signal to worker and wait for confirmation
-                req = mpi_comm.isend(popu_nas.export_dict(), dest=worker_id, tag=1)
-                req.wait()
-                logger.debug('*** debug: master has send termination signal to worker {}.'.format(worker_id))
-            pass  # end for worker_id
-            logger.debug('*** debug: master has send termination signal to everyone, master break looping now.')
-            break
-        pass  # end if
-
-        # enough jobs done, worker node clean up and exit
-        if cfg.rank > 0 and (popu_nas.num_evaluated_nets_count >= cfg.ea_num_random_nets or early_stop):
-            logger.debug('*** debug: worker {} recv termination signal. Break now.'.format(cfg.rank))
-            break
-
-        # for master, assign new jobs to workers
-        if cfg.rank == 0:
-            for worker_id in range(1, cfg.world_size):
-                if not worker_busy_list[worker_id]:
-                    req = mpi_comm.isend(popu_nas.export_dict(), dest=worker_id, tag=1)
+                pass  # end for worker_id
+            pass  # end for
+
+            # rank 0 serves the workers between its own small jobs, and runs the whole search without the workers
+            if cfg.rank == 0 and cfg.world_size == 1:
+                this_worker_max_iter = max(10, sync_interval // 10)
+            elif cfg.rank == 0:
+                this_worker_max_iter = cfg.ea_master_iter
+            else:
+                this_worker_max_iter = sync_interval
+
+            logger.debug('*** debug: rank={}, do_main_job() begin.'.format(cfg.rank))
+            popu_nas = do_main_job(popu_nas, model_nas, logger=logger, 
+                max_iter=this_worker_max_iter, cfg=cfg,
+                masternet_structure_info=masternet_structure_info,
+                sampler=sampler, mutation_stats=mutation_stats, evaluation_log=evaluation_log,
+                evaluated_models=evaluated_models, surrogate=surrogate, offspring=offspring, metrics=metrics)
+
+            if cfg.rank == 0:
+                popu_nas.num_evaluated_nets_count += this_worker_max_iter
+
+            logger.debug('*** debug: rank={}, do_main_job() end.'.format(cfg.rank))
+
+            # for worker node, push result to master
+            if cfg.rank > 0:
+                worker_shared_data = popu_nas.export_dict(packed=cfg.ea_packed_genome)
+                worker_shared_data["worker_idle_time"] = worker_idle_time
+                if surrogate is not None: worker_shared_data["surrogate_stats"] = surrogate.stats
+                worker_shared_data["metrics_stats"] = metrics.get_stats()
+                with metrics.phase("sync"):
+                    req = mpi_comm.isend(worker_shared_data, dest=0, tag=2)
                     req.wait()
-                    logger.debug('*** debug: master assign new job to worker {}. n={}'.format(
-                                worker_id, popu_nas.num_evaluated_nets_count))
-                    buf = bytearray(1 << 28)
-                    req = mpi_comm.irecv(buf, source=worker_id, tag=2)
-                    worker_busy_list[worker_id] = True
-                    worker_req_list[worker_id] = req
-                pass
-            pass  # end for worker_id
-        pass  # end for
-
-        # rank 0 processes the merge task, so the iteration is smaller than others
-        if cfg.rank == 0:
-            this_worker_max_iter = max(10, sync_interval // 10)
-        else:
-            this_worker_max_iter = sync_interval
-
-        logger.debug('*** debug: rank={}, do_main_job() begin.'.format(cfg.rank))
-        popu_nas = do_main_job(popu_nas, model_nas, logger=logger, 
-            max_iter=this_worker_max_iter, cfg=cfg,
-            masternet_structure_info=masternet_structure_info)
-
-        if cfg.rank == 0:
-            popu_nas.num_evaluated_nets_count += this_worker_max_iter
-
-        logger.debug('*** debug: rank={}, do_main_job() end.'.format(cfg.rank))
-
-        # for worker node, push result to master
-        if cfg.rank > 0:
-            req = mpi_comm.isend(popu_nas.export_dict(), dest=0, tag=2)
-            req.wait()
-            logger.debug('*** debug: worker {} push results to master. n={}.'.format(cfg.rank, popu_nas.num_evaluated_nets_count))
-
-        # export generation
-        if cfg.rank == 0 and popu_nas.num_evaluated_nets_count - last_export_generation_iteration > \
-                max(1, cfg.ea_log_freq):
-            export_generation_filename = os.path.join(cfg.work_dir,
-                                                      'nas_cache/iter{}.txt'.format(popu_nas.num_evaluated_nets_count))
-            print('exporting generation: %s'%(export_generation_filename))
-            save_pyobj(export_generation_filename, popu_nas.export_dict())
-
-            # logging intermediate results
-            elasp_time = time.time() - start_timer
-            remain_time = elasp_time * float(cfg.ea_num_random_nets - popu_nas.num_evaluated_nets_count) / (
-                        1e-10 + float(popu_nas.num_evaluated_nets_count))
-            if len(popu_nas.popu_acc_list) > 0:
-                individual_info = popu_nas.get_individual_info(idx=0)
-                logger.info('---rank={}, n={}, elasp_time={:4g}h, remain_time={:4}h'.format(
-                        cfg.rank, popu_nas.num_evaluated_nets_count, elasp_time / 3600, remain_time / 3600))
-                logger.info('---best_individual: {}'.format(individual_info))
-
-            last_export_generation_iteration = popu_nas.num_evaluated_nets_count
-        pass  # end export generation
-    pass  # end while True
-
+                logger.debug('*** debug: worker {} push results to master. n={}.'.format(cfg.rank, popu_nas.num_evaluated_nets_count))
+                with metrics.phase("checkpoint"):
+                    save_search_state(search_state_filename, popu_nas, cfg, get_search_state())
+
+            # export generation
+            if cfg.rank == 0 and popu_nas.num_evaluated_nets_count - last_export_generation_iteration > \
+                    max(1, cfg.ea_log_freq):
+                mutation_stats_info = sampler.get_stats() if sampler is not None else get_rejection_stats(mutation_stats)
+                with metrics.phase("checkpoint"):
+                    export_generation(popu_nas, model_nas, cfg, logger, time.time() - start_timer,
+                                    mutation_stats_info, worker_idle_time_list, get_surrogate_stats_info(),
+                                    get_metrics_stats_list())
+                    last_export_generation_iteration = popu_nas.num_evaluated_nets_count
+                    save_search_state(search_state_filename, popu_nas, cfg, get_search_state())
+            pass  # end export generation
+        pass  # end while True
+
+
+    if evaluation_log is not None: evaluation_log.close()
+    if cfg.rank == 0 and surrogate is not None: logger.info('---surrogate: {}'.format(get_surrogate_stats_info()))
+    if cfg.rank == 0 and popu_nas.num_evaluated_nets_count != last_export_generation_iteration:
+        export_metrics(popu_nas, cfg, logger, get_metrics_stats_list())
 
     # export results for master node
     if cfg.rank == 0:
         # export final generation
-        export_generation_filename = os.path.join(cfg.work_dir, 'nas_cache/iter_final.txt')
+        if cfg.ea_checkpoint_format == "npz":
+            export_generation_filename = os.path.join(cfg.work_dir, 'nas_cache/iter_final.npz')
+            save_population(export_generation_filename, popu_nas)
+        else:
+            export_generation_filename = os.path.join(cfg.work_dir, 'nas_cache/iter_final.txt')
+            save_pyobj(export_generation_filename, popu_nas.export_dict())
         print('exporting generation: ' + export_generation_filename)
-        save_pyobj(export_generation_filename, popu_nas.export_dict())
 
         # export best structure info
         if len(popu_nas.popu_acc_list) > 0:
@@ -424,6 +815,10 @@ def main():
             nas_info_txt = os.path.join(cfg.work_dir, 'nas_info.txt')
             save_pyobj(nas_info_txt, individual_info)
         pass  # end with
+
+        # export the Pareto front and the best structures under the budgets
+        if cfg.ea_multi_objective is not None:
+            export_pareto_front(popu_nas, cfg, logger)
     pass  # end if cfg.rank == 0
     exit()
 
@@ -0,0 +1,567 @@
+# Copyright (c) 2021-2022 Alibaba Group Holding Limited.
+
+import os, sys
+import random
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+def smart_round(x, base=8):
+    if base is None:
+        if x > 32 * 8:
+            round_base = 32
+        elif x > 16 * 8:
+            round_base = 16
+        else:
+            round_base = 8
+    else:
+        round_base = base
+
+    return max(round_base, round(x / float(round_base)) * round_base)
+
+
+def smart_round_array(x, base=8):
+    # the same rounding as smart_round, numpy rounds half to even like round()
+    return np.maximum(base, np.round(x / float(base)) * base)
+
+
+@dataclass
+class BlockRule:
+    """The mutation of one block class, the constraints of 'out' are applied in the order of the fields.
+
+    :param methods: the mutate methods, drawn uniformly
+    :param minor_methods: the mutate methods of minor_mutation, the same as methods if None
+    :param last_mutable: whether the block can be mutated as the last block
+    :param out_max: output_channel <= out_max
+    :param out_range: [min, max] of output_channel for each block_id, None for no range
+    :param out_max_in_ratio: output_channel <= out_max_in_ratio*input_channel
+    :param out_min_in: output_channel >= input_channel
+    :param out_max_next: output_channel <= output_channel of the next block
+    :param out_min_next_ratio: output_channel >= smart_round(out_min_next_ratio*output_channel of the next block)
+    :param out_keep_btn_ratio: the bottleneck follows the output_channel with the same btn ratio
+    :param next_btn_max_out: the bottleneck of the next block <= output_channel
+    :param btn_by_ratio: mutate the bottleneck by the btn ratio of output_channel, or else by the channel scale
+    :param btn_minimum_ratio: the bottleneck must be larger than out/btn_minimum_ratio
+    :param layers_per_L: the conv layers of one L, only for the maximum L
+    :param first_block_max_L: the block 1 can't have the large layers
+    :param L_budget_offset: the other blocks have L <= budget_layers//layers_per_L//(block_num-L_budget_offset)
+    """
+    methods: List[str] = field(default_factory=lambda: ['out', 'k', 'btn', 'L'])
+    minor_methods: Optional[List[str]] = None
+    last_mutable: bool = True
+    out_max: Optional[int] = None
+    out_range: Optional[List[Optional[Tuple[int, int]]]] = None
+    out_max_in_ratio: Optional[float] = None
+    out_min_in: bool = False
+    out_max_next: bool = False
+    out_min_next_ratio: Optional[float] = None
+    out_keep_btn_ratio: bool = False
+    next_btn_max_out: bool = False
+    btn_by_ratio: bool = False
+    btn_minimum_ratio: Optional[float] = None
+    layers_per_L: int = 3
+    first_block_max_L: int = 3
+    L_budget_offset: int = 2
+
+
+@dataclass
+class SpaceDefinition:
+    """The choice sets of a search space and the BlockRule of each block class.
+
+    :param last_block: how to mutate the last block, None for its BlockRule,
+                       'fixed' to never change it, 'nbits' to only mutate its nbitsA and nbitsW
+    """
+    block_rules: Dict[str, BlockRule]
+    channel_scales: List[float]
+    max_channel: int
+    kernel_sizes: List[int] = field(default_factory=lambda: [3, 5])
+    layer_deltas: List[int] = field(default_factory=lambda: [-2, -1, 1, 2])
+    btn_ratios: List[float] = field(default_factory=list)
+    nbits_list: List[int] = field(default_factory=list)
+    nbits_mutate_ratio: float = 0.1 # random uniform 0~1, if bigger then mutate
+    last_block: Optional[str] = None
+
+
+class CompiledSpace():
+    def __init__(self, space):
+        """The mutation functions of a SpaceDefinition.
+
+        mutate_function draws one mutation with the same random calls as the hand written spaces,
+        get_mutation_choices lists all its results for the feasible sampler, and mutate_batch draws
+        many mutations of a structure at once with the numpy RNG.
+        """
+        self.space = space
+        self.method_codes = {'out': 0, 'k': 1, 'btn': 2, 'L': 3, 'nbits': 4}
+
+
+    # ---------- the choices ----------
+    def mutate_channel(self, channels):
+        scale = random.choice(self.space.channel_scales)
+        new_channels = smart_round(scale*channels)
+        new_channels = min(self.space.max_channel, new_channels)
+        return new_channels
+
+
+    def mutate_kernel_size(self, kernel_size):
+        for i in range(len(self.space.kernel_sizes)):
+            new_kernel_size = random.choice(self.space.kernel_sizes)
+            if new_kernel_size!=kernel_size:
+                break
+        return new_kernel_size
+
+
+    def mutate_btn_ratio(self, btn_ratio):
+        for i in range(len(self.space.btn_ratios)):
+            new_btn_ratio = random.choice(self.space.btn_ratios)
+            if new_btn_ratio!=btn_ratio:
+                break
+        return new_btn_ratio
+
+
+    def mutate_layer(self, layer):
+        for i in range(len(self.space.layer_deltas)):
+            new_layer = layer + random.choice(self.space.layer_deltas)
+            new_layer = max(1, new_layer)
+            if new_layer!=layer:
+                break
+        return new_layer
+
+
+    def check_btn(self, btn_ratio):
+        if btn_ratio not in self.space.btn_ratios:
+            return min(self.space.btn_ratios, key=lambda x:abs(x-btn_ratio))
+        else:
+            return btn_ratio
+
+
+    def mutate_nbits(self, nbits):
+        nbits_list = self.space.nbits_list
+        # avoid the endless loop
+        if len(nbits_list)==1 and nbits in nbits_list:
+            return nbits
+        ind = nbits_list.index(nbits)
+        new_ind = ind
+
+        while new_ind == ind:
+            new_ind = random.choice((ind - 1, ind + 1))
+            new_ind = max(0, new_ind)
+            new_ind = min(len(nbits_list) - 1, new_ind)
+        return nbits_list[new_ind]
+
+
+    def mutate_nbits_list(self, nbits_list, L):
+        if isinstance(nbits_list, int):
+            return self.mutate_nbits(nbits_list)
+        else:
+            nbits_list = list(nbits_list)
+            inner_layer = len(nbits_list)//L
+            for layer_idx in range(L):
+                if random.uniform(0, 1)>self.space.nbits_mutate_ratio:
+                    nbits_list[layer_idx*inner_layer:(layer_idx+1)*inner_layer] = \
+                    [self.mutate_nbits(nbits_list[layer_idx*inner_layer])]*inner_layer
+            return nbits_list
+
+
+    def revise_nbits_for_layers(self, old_L, new_L, structure_info):
+        nbitsA = structure_info["nbitsA"][0]
+        nbitsW = structure_info["nbitsW"][0]
+        inner_layers = len(structure_info["nbitsA"])//old_L
+        if inner_layers not in [2, 3]:
+            raise ValueError("inner_layers must be 2 or 3 for current superblock, not %d"%(inner_layers))
+
+        if old_L<new_L:
+            extra_l = new_L-old_L
+            structure_info['nbitsA'] = structure_info['nbitsA'] + [nbitsA]*inner_layers*extra_l
+            structure_info['nbitsW'] = structure_info['nbitsW'] + [nbitsW]*inner_layers*extra_l
+        else:
+            structure_info['nbitsA'] = structure_info['nbitsA'][:new_L*inner_layers]
+            structure_info['nbitsW'] = structure_info['nbitsW'][:new_L*inner_layers]
+
+        return structure_info
+
+
+    def get_channel_choices(self, channels):
+        return sorted(set([min(self.space.max_channel, smart_round(scale*channels)) for scale in self.space.channel_scales]))
+
+
+    def get_layer_choices(self, layer):
+        return sorted(set([max(1, layer + x) for x in self.space.layer_deltas]))
+
+
+    def get_nbits_choices(self, nbits):
+        # the results of mutate_nbits
+        nbits_list = self.space.nbits_list
+        if len(nbits_list)==1 and nbits in nbits_list:
+            return [nbits]
+        ind = nbits_list.index(nbits)
+        return sorted(set([nbits_list[max(0, min(len(nbits_list) - 1, x))] for x in (ind - 1, ind + 1)]) - set([nbits]))
+
+
+    # ---------- the constraints ----------
+    def get_rule(self, class_name):
+        if class_name not in self.space.block_rules:
+            raise RuntimeError('Not implemented class_name=' + class_name)
+        return self.space.block_rules[class_name]
+
+
+    def get_methods(self, rule, minor_mutation):
+        # coarse2fine mutation flag, only mutate the channels' output
+        return rule.minor_methods if minor_mutation and rule.minor_methods is not None else rule.methods
+
+
+    def get_out_range(self, rule, block_id):
+        if rule.out_range is None or block_id >= len(rule.out_range):
+            return None
+        return rule.out_range[block_id]
+
+
+    def constrain_out(self, new_out, rule, block_id, structure_info, structure_info_next):
+        if rule.out_max is not None:
+            new_out = min(rule.out_max, new_out)
+        out_range = self.get_out_range(rule, block_id)
+        if out_range is not None:
+            this_min, this_max = out_range
+            new_out = max(this_min, min(this_max, new_out))
+        if rule.out_max_in_ratio is not None:
+            new_out = min(rule.out_max_in_ratio*structure_info['in'], new_out)
+        if rule.out_min_in:
+            new_out = max(structure_info['in'], new_out)
+        if structure_info_next is not None:
+            if rule.out_max_next:
+                new_out = min(structure_info_next['out'], new_out)
+            if rule.out_min_next_ratio is not None:
+                new_out = max(smart_round(structure_info_next['out']*rule.out_min_next_ratio), new_out)
+        return new_out
+
+
+    def constrain_layer(self, new_L, rule, block_id, block_num, budget_layers):
+        if block_id==1:
+            return min(rule.first_block_max_L, new_L)
+        return min(int(budget_layers//rule.layers_per_L//(block_num-rule.L_budget_offset)), new_L)
+
+
+    def constrain_btn(self, rule, structure_info):
+        # add the constraint: the btn must be larger than out/btn_minimum_ratio.
+        if rule.btn_minimum_ratio is not None and structure_info['btn']<(structure_info['out']/rule.btn_minimum_ratio):
+            structure_info['btn'] = smart_round(structure_info['out']/rule.btn_minimum_ratio)
+        return structure_info
+
+
+    def check_nbits_keys(self, structure_info):
+        if "nbitsA" not in structure_info or "nbitsW" not in structure_info:
+            raise NameError("structure_info must have nbitsA and nbitsW\n%s"%(structure_info))
+
+
+    def get_next_block(self, rule, new_out, structure_info_next):
+        # the next block with the btn limited by the new output_channel, or None if it isn't changed
+        if rule.next_btn_max_out and structure_info_next is not None and "btn" in structure_info_next:
+            return dict(structure_info_next, btn=min(new_out, structure_info_next['btn']))
+        return None
+
+
+    # ---------- the mutations ----------
+    def mutate_function(self, block_id, structure_info_list, budget_layers, minor_mutation=False):
+        """Mutate one block, return the new blocks replacing it, or False if it can't be mutated.
+
+        The next block can also be replaced in structure_info_list with the constraints of the block.
+        """
+        structure_info = structure_info_list[block_id]
+        is_last = block_id == len(structure_info_list)-1
+        #  Add the constraint: never change the last output channel
+        if is_last and self.space.last_block == 'fixed':
+            return [structure_info]
+        if is_last and self.space.last_block == 'nbits':
+            structure_info = dict(structure_info)
+            self.check_nbits_keys(structure_info)
+            structure_info['nbitsA'] = self.mutate_nbits(structure_info['nbitsA'])
+            structure_info['nbitsW'] = self.mutate_nbits(structure_info['nbitsW'])
+            return [structure_info]
+        structure_info_next = None if is_last else structure_info_list[block_id+1]
+        # a mutable copy, the list values are new lists when structure_info is a BlockSpec
+        structure_info = dict(structure_info)
+        rule = self.get_rule(structure_info['class'])
+        if is_last and not rule.last_mutable:
+            return False
+
+        random_mutate_method = random.choice(self.get_methods(rule, minor_mutation))
+
+        if random_mutate_method == 'out':
+            if rule.out_keep_btn_ratio:
+                btn_ratio = self.check_btn(structure_info['btn']/structure_info['out'])
+            new_out = self.mutate_channel(structure_info['out'])
+            new_out = self.constrain_out(new_out, rule, block_id, structure_info, structure_info_next)
+            structure_info['out'] = new_out
+            if rule.out_keep_btn_ratio:
+                structure_info['btn'] = smart_round(new_out*btn_ratio)
+            structure_info_next = self.get_next_block(rule, new_out, structure_info_next)
+            if structure_info_next is not None:
+                structure_info_list[block_id+1] = structure_info_next
+
+        if random_mutate_method == 'k':
+            structure_info['k'] = self.mutate_kernel_size(structure_info['k'])
+
+        if random_mutate_method == 'btn':
+            if rule.btn_by_ratio:
+                btn_ratio = self.check_btn(structure_info['btn']/structure_info['out'])
+                new_btn_ratio = self.mutate_btn_ratio(btn_ratio)
+                structure_info['btn'] = smart_round(structure_info['out']*new_btn_ratio)
+            else:
+                new_btn = self.mutate_channel(structure_info['btn'])
+                # Add the constraint: bottleneck_channel <= output_channel
+                structure_info['btn'] = min(structure_info['out'], new_btn)
+
+        if random_mutate_method == 'nbits':
+            self.check_nbits_keys(structure_info)
+            structure_info['nbitsA'] = self.mutate_nbits_list(structure_info['nbitsA'], structure_info['L'])
+            structure_info['nbitsW'] = self.mutate_nbits_list(structure_info['nbitsW'], structure_info['L'])
+
+        if random_mutate_method == 'L':
+            old_L = structure_info['L']
+            new_L = self.mutate_layer(structure_info['L'])
+            new_L = self.constrain_layer(new_L, rule, block_id, len(structure_info_list), budget_layers)
+            if 'nbits' in rule.methods and new_L!=old_L:
+                structure_info = self.revise_nbits_for_layers(old_L, new_L, structure_info)
+            structure_info['L'] = new_L
+
+        return [self.constrain_btn(rule, structure_info)]
+
+
+    def get_mutation_choices(self, block_id, structure_info_list, budget_layers, minor_mutation=False):
+        """Get all the results of mutate_function for the block, a list of (mutate method, new blocks from block_id).
+
+        The nbits lists of the super blocks have too many results, so one of them is drawn by mutate_nbits_list.
+        """
+        structure_info = structure_info_list[block_id]
+        is_last = block_id == len(structure_info_list)-1
+        choices = []
+        if is_last and self.space.last_block == 'fixed':
+            return choices
+        if is_last and self.space.last_block == 'nbits':
+            self.check_nbits_keys(structure_info)
+            for new_nbitsA in self.get_nbits_choices(structure_info['nbitsA']):
+                for new_nbitsW in self.get_nbits_choices(structure_info['nbitsW']):
+                    choices.append(('nbits', [dict(structure_info, nbitsA=new_nbitsA, nbitsW=new_nbitsW)]))
+            return choices
+        structure_info_next = None if is_last else structure_info_list[block_id+1]
+        rule = self.get_rule(structure_info['class'])
+        if is_last and not rule.last_mutable:
+            return choices
+        methods = self.get_methods(rule, minor_mutation)
+
+        new_info_list = []
+        if 'out' in methods:
+            if rule.out_keep_btn_ratio:
+                btn_ratio = self.check_btn(structure_info['btn']/structure_info['out'])
+            for new_out in self.get_channel_choices(structure_info['out']):
+                new_out = self.constrain_out(new_out, rule, block_id, structure_info, structure_info_next)
+                new_info = dict(structure_info, out=new_out)
+                if rule.out_keep_btn_ratio:
+                    new_info['btn'] = smart_round(new_out*btn_ratio)
+                new_info_list.append(('out', new_info))
+        if 'k' in methods:
+            for new_k in self.space.kernel_sizes:
+                new_info_list.append(('k', dict(structure_info, k=new_k)))
+        if 'btn' in methods:
+            if rule.btn_by_ratio:
+                for new_btn_ratio in self.space.btn_ratios:
+                    new_info_list.append(('btn', dict(structure_info, btn=smart_round(structure_info['out']*new_btn_ratio))))
+            else:
+                for new_btn in self.get_channel_choices(structure_info['btn']):
+                    new_info_list.append(('btn', dict(structure_info, btn=min(structure_info['out'], new_btn))))
+        if 'nbits' in methods:
+            self.check_nbits_keys(structure_info)
+            new_info_list.append(('nbits', dict(structure_info,
+                        nbitsA=self.mutate_nbits_list(structure_info['nbitsA'], structure_info['L']),
+                        nbitsW=self.mutate_nbits_list(structure_info['nbitsW'], structure_info['L']))))
+        if 'L' in methods:
+            for new_L in self.get_layer_choices(structure_info['L']):
+                new_L = self.constrain_layer(new_L, rule, block_id, len(structure_info_list), budget_layers)
+                new_info = dict(structure_info)
+                if 'nbits' in rule.methods and new_L!=structure_info['L']:
+                    new_info = self.revise_nbits_for_layers(structure_info['L'], new_L, new_info)
+                new_info['L'] = new_L
+                new_info_list.append(('L', new_info))
+
+        for method, new_info in new_info_list:
+            new_blocks = [self.constrain_btn(rule, new_info)]
+            if method == 'out':
+                new_info_next = self.get_next_block(rule, new_info['out'], structure_info_next)
+                if new_info_next is not None:
+                    new_blocks.append(new_info_next)
+            choices.append((method, new_blocks))
+
+        return choices
+
+
+    def get_block_arrays(self, structure_info_list, budget_layers, minor_mutation, exclude_stem):
+        # the values and the constraints of the blocks as arrays, inf and 0 for no constraint
+        block_num = len(structure_info_list)
+        arrays = {name: np.zeros(block_num) for name in ['out', 'in', 'btn', 'k', 'L', 'next_out', 'out_max',
+                    'out_min', 'out_max_next', 'out_min_next', 'out_keep_btn_ratio', 'max_L', 'btn_minimum_ratio', 'btn_by_ratio']}
+        method_table = np.full((block_num, len(self.method_codes)), -1, dtype=np.int64)
+        method_num = np.zeros(block_num, dtype=np.int64)
+        for block_id, structure_info in enumerate(structure_info_list):
+            is_last = block_id == block_num-1
+            structure_info_next = None if is_last else structure_info_list[block_id+1]
+            for name in ['out', 'in', 'btn', 'k', 'L']:
+                arrays[name][block_id] = structure_info.get(name, 0)
+            arrays['next_out'][block_id] = structure_info_next['out'] if structure_info_next is not None else np.inf
+            if is_last and self.space.last_block is not None:
+                if self.space.last_block == 'nbits':
+                    method_table[block_id, 0] = self.method_codes['nbits']
+                    method_num[block_id] = 1
+                continue
+            rule = self.get_rule(structure_info['class'])
+            if (is_last and not rule.last_mutable) or (exclude_stem and block_id == 0):
+                continue
+            methods = self.get_methods(rule, minor_mutation)
+            method_table[block_id, :len(methods)] = [self.method_codes[x] for x in methods]
+            method_num[block_id] = len(methods)
+
+            out_max = np.inf if rule.out_max is None else rule.out_max
+            out_min = 0
+            out_range = self.get_out_range(rule, block_id)
+            if out_range is not None:
+                out_min, out_max = out_range[0], min(out_max, out_range[1])
+            if rule.out_max_in_ratio is not None:
+                out_max = min(out_max, rule.out_max_in_ratio*structure_info['in'])
+            if rule.out_min_in:
+                out_min = max(out_min, structure_info['in'])
+            arrays['out_max'][block_id] = out_max
+            arrays['out_min'][block_id] = out_min
+            arrays['out_max_next'][block_id] = rule.out_max_next
+            arrays['out_min_next'][block_id] = smart_round(structure_info_next['out']*rule.out_min_next_ratio) \
+                            if rule.out_min_next_ratio is not None and structure_info_next is not None else 0
+            if 'L' in structure_info:
+                arrays['max_L'][block_id] = self.constrain_layer(np.inf, rule, block_id, block_num, budget_layers)
+            arrays['btn_minimum_ratio'][block_id] = 0 if rule.btn_minimum_ratio is None else rule.btn_minimum_ratio
+            arrays['out_keep_btn_ratio'][block_id] = rule.out_keep_btn_ratio
+            arrays['btn_by_ratio'][block_id] = rule.btn_by_ratio
+        return arrays, method_table, method_num
+
+
+    def draw_different(self, rng, choices, current):
+        # draw uniformly from the choices different from the current values
+        choices = np.asarray(choices)
+        valid = choices[None, :] != current[:, None]
+        scores = rng.random(valid.shape) * valid
+        return choices[np.argmax(scores, axis=1)]
+
+
+    def mutate_batch(self, structure_info_list, budget_layers, num, minor_mutation=False, exclude_stem=False, rng=None):
+        """Draw num mutations of a structure at once, a list of (block_id, new blocks from block_id).
+
+        The block, the method and the new value are drawn uniformly as mutate_function, with the numpy RNG,
+        and all the values are computed as arrays before the new blocks are built. The kernel size, the btn
+        ratio, the layer and the nbits are drawn from the values different from the current one directly,
+        instead of the retries of mutate_function.
+        """
+        rng = np.random.default_rng() if rng is None else rng
+        block_num = len(structure_info_list)
+        arrays, method_table, method_num = self.get_block_arrays(structure_info_list, budget_layers, minor_mutation, exclude_stem)
+        mutable_ids = np.nonzero(method_num > 0)[0]
+        if len(mutable_ids) == 0:
+            return []
+
+        block_ids = rng.choice(mutable_ids, size=num)
+        methods = method_table[block_ids, (rng.random(num) * method_num[block_ids]).astype(np.int64)]
+        out, btn = arrays['out'][block_ids], arrays['btn'][block_ids]
+
+        # out: the channel scale, then the constraints in the order of constrain_out
+        new_out = smart_round_array(rng.choice(self.space.channel_scales, size=num) * out)
+        new_out = np.minimum(self.space.max_channel, new_out)
+        new_out = np.maximum(arrays['out_min'][block_ids], np.minimum(arrays['out_max'][block_ids], new_out))
+        new_out = np.where(arrays['out_max_next'][block_ids] > 0, np.minimum(arrays['next_out'][block_ids], new_out), new_out)
+        new_out = np.maximum(arrays['out_min_next'][block_ids], new_out)
+
+        # btn: by the channel scale or by the btn ratio
+        if len(self.space.btn_ratios) > 0:
+            btn_ratios = np.asarray(self.space.btn_ratios)
+            btn_ratio = btn_ratios[np.argmin(np.abs(btn_ratios[None, :] - (btn/np.maximum(out, 1))[:, None]), axis=1)]
+            out_btn = smart_round_array(new_out * btn_ratio)
+            ratio_btn = smart_round_array(out * self.draw_different(rng, btn_ratios, btn_ratio))
+        else:
+            out_btn = ratio_btn = btn
+        scale_btn = np.minimum(out, np.minimum(self.space.max_channel,
+                        smart_round_array(rng.choice(self.space.channel_scales, size=num) * btn)))
+        new_btn = np.where(arrays['btn_by_ratio'][block_ids] > 0, ratio_btn, scale_btn)
+
+        new_k = self.draw_different(rng, self.space.kernel_sizes, arrays['k'][block_ids])
+        layer_choices = np.maximum(1, arrays['L'][block_ids][:, None] + np.asarray(self.space.layer_deltas)[None, :])
+        valid = layer_choices != arrays['L'][block_ids][:, None]
+        new_L = layer_choices[np.arange(num), np.argmax(rng.random(valid.shape) * valid, axis=1)]
+        new_L = np.minimum(arrays['max_L'][block_ids], new_L)
+
+        # the btn constraint after all the methods except nbits
+        final_out = np.where(methods == self.method_codes['out'], new_out, out)
+        final_btn = np.where(methods == self.method_codes['btn'], new_btn,
+                        np.where((methods == self.method_codes['out']) & (arrays['out_keep_btn_ratio'][block_ids] > 0), out_btn, btn))
+        btn_minimum_ratio = arrays['btn_minimum_ratio'][block_ids]
+        min_btn = smart_round_array(final_out / np.maximum(btn_minimum_ratio, 1))
+        final_btn = np.where((btn_minimum_ratio > 0) & (final_btn < final_out / np.maximum(btn_minimum_ratio, 1)), min_btn, final_btn)
+
+        # the new value of each mutant by its method, the blocks are copied from the dicts built once
+        code_out, code_k, code_L, code_nbits = [self.method_codes[x] for x in ['out', 'k', 'L', 'nbits']]
+        value_keys = {code_out: 'out', code_k: 'k', code_L: 'L'}
+        new_values = np.select([methods == code_out, methods == code_k, methods == code_L], [final_out, new_k, new_L], 0)
+        base_info_list = [dict(x) for x in structure_info_list]
+        if len(self.space.nbits_list) > 0:
+            nbits_uniforms = rng.random((num, 2, 2*max([1] + [x.get('L', 1) for x in base_info_list])))
+        mutations = []
+        for idx, (block_id, method, new_value, new_btn) in enumerate(zip(block_ids.tolist(), methods.tolist(),
+                                        new_values.astype(np.int64).tolist(), final_btn.astype(np.int64).tolist())):
+            structure_info = base_info_list[block_id]
+            new_info = structure_info.copy()
+            if block_id == block_num-1 and self.space.last_block == 'nbits':
+                self.check_nbits_keys(structure_info)
+                new_info['nbitsA'] = self.mutate_nbits_uniforms(structure_info['nbitsA'], nbits_uniforms[idx, 0])
+                new_info['nbitsW'] = self.mutate_nbits_uniforms(structure_info['nbitsW'], nbits_uniforms[idx, 1])
+                mutations.append((block_id, [new_info]))
+                continue
+            rule = self.space.block_rules[structure_info['class']]
+            if method == code_nbits:
+                self.check_nbits_keys(structure_info)
+                new_info['nbitsA'] = self.mutate_nbits_uniforms(structure_info['nbitsA'], nbits_uniforms[idx, 0].tolist(), structure_info['L'])
+                new_info['nbitsW'] = self.mutate_nbits_uniforms(structure_info['nbitsW'], nbits_uniforms[idx, 1].tolist(), structure_info['L'])
+                mutations.append((block_id, [new_info]))
+                continue
+            if method in value_keys:
+                new_info[value_keys[method]] = new_value
+            if "btn" in structure_info:
+                new_info['btn'] = new_btn
+            if method == code_L and 'nbits' in rule.methods and new_value != structure_info['L']:
+                new_info = self.revise_nbits_for_layers(structure_info['L'], new_value, new_info)
+            new_blocks = [new_info]
+            if method == code_out and block_id < block_num-1:
+                new_info_next = self.get_next_block(rule, new_value, base_info_list[block_id+1])
+                if new_info_next is not None:
+                    new_blocks.append(new_info_next)
+            mutations.append((block_id, new_blocks))
+
+        return mutations
+
+
+    def mutate_nbits_uniforms(self, nbits_list, uniforms, L=None):
+        # mutate_nbits_list with the uniforms drawn by the numpy RNG, the neighbour nbits are drawn directly
+        search_nbits_list = self.space.nbits_list
+        def mutate_nbits(nbits, uniform):
+            ind = search_nbits_list.index(nbits)
+            choices = [x for x in (max(0, ind - 1), min(len(search_nbits_list) - 1, ind + 1)) if x != ind]
+            return search_nbits_list[choices[int(uniform*len(choices))]] if len(choices) > 0 else nbits
+
+        if isinstance(nbits_list, int):
+            return mutate_nbits(nbits_list, uniforms[0])
+        nbits_list = list(nbits_list)
+        inner_layer = len(nbits_list)//L
+        for layer_idx in range(L):
+            if uniforms[2*layer_idx]>self.space.nbits_mutate_ratio:
+                nbits_list[layer_idx*inner_layer:(layer_idx+1)*inner_layer] = \
+                [mutate_nbits(nbits_list[layer_idx*inner_layer], uniforms[2*layer_idx+1])]*inner_layer
+        return nbits_list
+
+
+def compile_space(space):
+    """Compile a SpaceDefinition into the mutation functions, see CompiledSpace."""
+    return CompiledSpace(space)
@@ -15,9 +15,11 @@ from torch.nn.modules.batchnorm import _BatchNorm
 
 @BACKBONES.register_module
 class MadNas(nn.Module):
-    def __init__(self, net_str=None, out_indices=(1, 2, 3, 4), init_cfg=None):
+    def __init__(self, net_str=None, out_indices=(1, 2, 3, 4), init_cfg=None, checkpoint_every=None):
         super(MadNas, self).__init__()
-        self.body = MasterNet(structure_txt=net_str, out_indices=out_indices, no_create=False)
+        # checkpoint_every recomputes the activations of every k inner layers in backward to save memory
+        self.body = MasterNet(structure_txt=net_str, out_indices=out_indices, no_create=False, 
+                            checkpoint_every=checkpoint_every)
         if init_cfg is not None and os.path.isfile(init_cfg):
             self.body.init_weights(init_cfg)
 
@@ -28,6 +30,12 @@ class MadNas(nn.Module):
             elif isinstance(m, (_BatchNorm, nn.GroupNorm)):
                 constant_init(m, 1)
 
+    def switch_to_deploy(self, example_input, channels_last=True, compile_mode='compile'):
+        """Replace the backbone by its fused and compiled graph, only for inference."""
+        self.body.eval()
+        self.body = self.body.get_inference_model(example_input, channels_last=channels_last, 
+                            compile_mode=compile_mode)
+
     def forward(self, x):
         """Forward function."""
         return self.body(x)
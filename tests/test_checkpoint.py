@@ -0,0 +1,29 @@
+# Copyright (c) 2021-2022 Alibaba Group Holding Limited.
+
+import os, sys
+import copy
+import torch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nas.models import MasterNet
+
+__repo_dir__ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_checkpoint_transparent():
+    # the recomputation gives the same gradients, and does not update the BN running stats again
+    torch.manual_seed(0)
+    model = MasterNet(structure_txt=os.path.join(__repo_dir__, "scripts/classification/models/R18-like.txt"),
+                      num_classes=10, classfication=True).train()
+    checkpoint_model = copy.deepcopy(model)
+    checkpoint_model.set_checkpoint(2)
+    input = torch.randn(2, 3, 64, 64)
+    for the_model in [model, checkpoint_model]:
+        torch.manual_seed(1)
+        the_model(input).sum().backward()
+
+    for (name, param), checkpoint_param in zip(model.named_parameters(), checkpoint_model.parameters()):
+        assert torch.allclose(param.grad, checkpoint_param.grad, rtol=1e-4, atol=1e-6), name
+    for (name, buffer), checkpoint_buffer in zip(model.named_buffers(), checkpoint_model.buffers()):
+        assert torch.equal(buffer, checkpoint_buffer), name
@@ -0,0 +1,73 @@
+# Copyright (c) 2021-2022 Alibaba Group Holding Limited.
+
+import os, sys
+import logging
+import numpy as np
+import torch
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "nas"))
+
+from configs import load_py_module_from_path
+from nas.builder import BuildNAS
+from nas.models import MasterNet
+from nas.models.blocks.qconv import QConv2d, QLinear
+from nas.models.quant_export import convert_to_int8, get_weight_levels
+
+__repo_dir__ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def get_quant_cfg(**kwargs):
+    # the quant search of mixed7d0G, small enough for the cpu
+    cfg = load_py_module_from_path(os.path.join(__repo_dir__, 'configs/config_nas.py:Config'))()
+    cfg.merge(dict({"space_structure_txt": os.path.join(__repo_dir__, "scripts/quant/models/mixed7d0G.txt"),
+                    "space_mutation": "space_quant_k1dwk1", "score_quant_search": True, "score_image_size": 32,
+                    "score_batch_size": 2, "score_repeat": 1, "score_multi_ratio": [0, 0, 1, 1, 6],
+                    "budget_flops": None, "budget_latency": None, "budget_model_size": None, "budget_layers": 47,
+                    "lat_gpu": False, "lat_pred": False}, **kwargs))
+    cfg.config_check()
+    cfg.gpu, cfg.rank = None, 0
+    return cfg
+
+
+def test_synflow_quant_space():
+    # the score of the quant layers backprops through the quantized weights in eval mode
+    cfg = get_quant_cfg(score_type=["entropy", "synflow"])
+    model_nas = BuildNAS(cfg, logging.getLogger())
+    model_info = model_nas.get_info_for_evolution(structure_txt=cfg.space_structure_txt)
+    assert model_info["score"] != -9999 and np.isfinite(model_info["score"])
+
+
+def test_freeze_quant():
+    model = MasterNet(structure_txt=os.path.join(__repo_dir__, "scripts/quant/models/mixed7d0G.txt"), num_classes=10,
+                      classfication=True)
+    qconv_list = [m for m in model.modules() if isinstance(m, QConv2d)]
+    model.eval()
+    assert not any([m.frozen for m in qconv_list])
+    input = torch.randn(1, 3, 32, 32)
+    with torch.no_grad():
+        output = model(input)
+        model.freeze_quant()
+        assert all([m.frozen for m in qconv_list])
+        assert torch.allclose(model(input), output)
+
+
+def test_int8_weight_levels():
+    # the int8 weights are the LSQ levels of the trained layers, with BN folded into their scales
+    torch.manual_seed(0)
+    model = MasterNet(structure_txt=os.path.join(__repo_dir__, "scripts/quant/models/mixed7d0G.txt"), num_classes=10,
+                      classfication=True).eval()
+    for m in model.modules():
+        if isinstance(m, torch.nn.BatchNorm2d):
+            m.weight.data.uniform_(0.5, 1.5)
+            m.running_var.uniform_(0.5, 2.0)
+    calib_data = [torch.randn(2, 3, 32, 32) for _ in range(2)]
+    int8_model = convert_to_int8(model, calib_data)
+    for name, layer in model.named_modules():
+        if not isinstance(layer, (QConv2d, QLinear)):
+            continue
+        levels, scale = get_weight_levels(layer)
+        int8_weight = int8_model.get_submodule(name).weight()
+        assert torch.equal(int8_weight.int_repr().to(levels.dtype), levels), name
+        if isinstance(layer, QLinear):
+            assert torch.allclose(int8_weight.q_per_channel_scales().float(), scale, rtol=1e-4), name
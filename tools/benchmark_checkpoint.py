@@ -0,0 +1,106 @@
+# Copyright (c) 2021-2022 Alibaba Group Holding Limited.
+
+import os,sys
+import time
+import argparse
+import numpy as np
+import torch
+from torch import nn
+from tabulate import tabulate
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nas.models.masternet import MasterNet
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Compare the memory and time of training steps with activation checkpointing')
+    parser.add_argument('--structure_txt', type=str, required=True)
+    parser.add_argument('--classfication', action='store_true', help='add the classifier, otherwise output the stage features')
+    parser.add_argument('--resolution', type=int, default=480)
+    parser.add_argument('--batch_size', type=int, default=2)
+    parser.add_argument('--checkpoint_every', type=str, default="0,1,2,4", help='0 for no checkpoint')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--gpu', type=int, default=None)
+    parser.add_argument('--memory_budget_mb', type=float, default=None, help='estimate the max batch size in the budget')
+    args = parser.parse_args()
+    return args
+
+
+def benchmark_training_step(model, the_image, args):
+    """Get the activation memory in MB and the time in second of one training step.
+
+    On gpu the memory is the peak allocated memory over the model and the gradients.
+    On cpu there is no allocator stats, so the bytes of the tensors saved for backward are counted,
+    without the transient memory of recomputing one segment which grows with checkpoint_every.
+    """
+    saved_bytes = [0]
+    def pack_hook(tensor):
+        if not isinstance(tensor, nn.Parameter):
+            saved_bytes[0] += tensor.numel() * tensor.element_size()
+        return tensor
+
+    def training_step():
+        if args.gpu is None:
+            with torch.autograd.graph.saved_tensors_hooks(pack_hook, lambda tensor: tensor):
+                output = model(the_image)
+        else:
+            output = model(the_image)
+        loss = output.mean() if args.classfication else sum([x.mean() for x in output])
+        loss.backward()
+        model.zero_grad(set_to_none=False)
+
+    training_step() # warmup, the gradients are allocated
+    if args.gpu is not None:
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats(args.gpu)
+        base_memory = torch.cuda.memory_allocated(args.gpu)
+
+    time_list = []
+    for repeat_count in range(args.repeat):
+        saved_bytes[0] = 0
+        start_timer = time.time()
+        training_step()
+        if args.gpu is not None: torch.cuda.synchronize()
+        time_list.append(time.time() - start_timer)
+
+    if args.gpu is not None:
+        memory = (torch.cuda.max_memory_allocated(args.gpu) - base_memory)/2**20
+    else:
+        memory = saved_bytes[0]/2**20
+    return memory, np.median(time_list)
+
+
+def main():
+    args = parse_args()
+    checkpoint_every_list = [int(x) for x in args.checkpoint_every.split(',')]
+
+    model = MasterNet(num_classes=1000, structure_txt=args.structure_txt, classfication=args.classfication)
+    the_image = torch.randn(args.batch_size, 3, args.resolution, args.resolution)
+    if args.gpu is not None:
+        torch.cuda.set_device(args.gpu)
+        model, the_image = model.cuda(args.gpu), the_image.cuda(args.gpu)
+    model.train()
+
+    results = []
+    for checkpoint_every in checkpoint_every_list:
+        model.set_checkpoint(checkpoint_every if checkpoint_every > 0 else None)
+        results.append(benchmark_training_step(model, the_image, args))
+
+    base_memory, base_time = results[0]
+    headers = ["checkpoint_every", "activation_mb", "mb/img", "step_ms", "memory", "time"]
+    if args.memory_budget_mb is not None: headers.append("max_batch")
+    table = []
+    for checkpoint_every, (memory, step_time) in zip(checkpoint_every_list, results):
+        row = [checkpoint_every if checkpoint_every > 0 else "-", "%.1f"%(memory), "%.1f"%(memory/args.batch_size),
+               "%.1f"%(step_time*1000), "%.2fx"%(memory/base_memory), "%.2fx"%(step_time/base_time)]
+        if args.memory_budget_mb is not None:
+            # the activations grow linearly with the batch size
+            row.append(int(args.memory_budget_mb // (memory/args.batch_size)))
+        table.append(row)
+    print(tabulate(table, headers=headers, disable_numparse=True, colalign=["right"]*len(headers)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# Copyright (c) 2021-2022 Alibaba Group Holding Limited.
+
+import os,sys
+import copy
+import argparse
+import torch
+from torch import nn
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nas.models.masternet import MasterNet, load_model
+from latency import GetRobustLatencyMeanStdCPU
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the deploy-mode masternet on cpu')
+    parser.add_argument('--structure_txt', type=str, required=True)
+    parser.add_argument('--checkpoint', type=str, default=None)
+    parser.add_argument('--num_classes', type=int, default=1000)
+    parser.add_argument('--resolution', type=int, default=224)
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--num_threads', type=int, default=None)
+    parser.add_argument('--channels_last', action='store_true', help='benchmark the inference model in channels_last')
+    parser.add_argument('--compile_mode', type=str, default=None, help='benchmark the inference model by trace or compile')
+    args = parser.parse_args()
+    return args
+
+
+def randomize_bn(model):
+    # without a checkpoint, the running stats of BN are random so that the fusion is not trivial
+    with torch.no_grad():
+        for m in model.modules():
+            if isinstance(m, nn.BatchNorm2d):
+                m.weight.uniform_(0.5, 1.5)
+                m.bias.normal_(0, 0.1)
+                m.running_mean.normal_(0, 0.1)
+                m.running_var.uniform_(0.5, 1.5)
+    return model
+
+
+def main():
+    args = parse_args()
+    model = MasterNet(num_classes=args.num_classes, structure_txt=args.structure_txt, classfication=True)
+    if args.checkpoint is not None:
+        load_model(model, args.checkpoint, strict_load=False)
+    else:
+        randomize_bn(model)
+    model.eval()
+    deploy_model = copy.deepcopy(model).fuse_for_deploy()
+
+    the_image = torch.randn(args.batch_size, 3, args.resolution, args.resolution)
+    with torch.no_grad():
+        output, deploy_output = model(the_image), deploy_model(the_image)
+    print('max abs diff between the original and deploy outputs: %.6f'%((output-deploy_output).abs().max().item()))
+
+    benchmark = GetRobustLatencyMeanStdCPU(args.batch_size, args.resolution, num_threads=args.num_threads)
+    latency, latency_std = benchmark(model)
+    deploy_latency, deploy_std = benchmark(deploy_model)
+    print('original: %.3f ms/img (std %.3f), %.1f img/s'%(latency*1000, latency_std*1000, 1/latency))
+    print('deploy: %.3f ms/img (std %.3f), %.1f img/s'%(deploy_latency*1000, deploy_std*1000, 1/deploy_latency))
+    print('speedup: %.2fx'%(latency/deploy_latency))
+
+    if args.channels_last or args.compile_mode is not None:
+        inference_model = model.get_inference_model(the_image, channels_last=args.channels_last, 
+                            compile_mode=args.compile_mode)
+        with torch.no_grad():
+            inference_output = inference_model(the_image)
+        print('max abs diff between the original and inference outputs: %.6f'%((output-inference_output).abs().max().item()))
+        inference_latency, inference_std = benchmark(inference_model)
+        print('inference (channels_last=%s, compile_mode=%s): %.3f ms/img (std %.3f), %.1f img/s'%(args.channels_last, 
+                args.compile_mode, inference_latency*1000, inference_std*1000, 1/inference_latency))
+        print('speedup: %.2fx'%(latency/inference_latency))
+
+
+if __name__ == '__main__':
+    main()
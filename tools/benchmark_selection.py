@@ -0,0 +1,129 @@
+# Copyright (c) 2021-2022 Alibaba Group Holding Limited.
+
+import os,sys
+import time
+import random
+import logging
+import argparse
+import numpy as np
+import torch
+from tabulate import tabulate
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "nas"))
+
+from configs import load_py_module_from_path, DictAction
+from nas.builder import BuildNAS
+from nas.evolutions import Population, ArchSpec, GenomeCodec, OffspringGenerator
+from nas.search import do_main_job, adjust_structures, __check_block_structure_info_list_valid__
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Compare the evaluations to reach a target score of the parent selections, '
+                                     'the survivors and the offspring')
+    parser.add_argument('config', help='search config file path, e.g. configs/config_nas.py')
+    parser.add_argument('--strategies', type=str, default="random:best,tournament:best,tournament:aging,random:crowding",
+                        help='comma separated ea_selection:ea_survivor[:ea_crossover_ratio[:ea_offspring_batch]], '
+                        'e.g. random:best:0.5:32')
+    parser.add_argument('--num_nets', type=int, default=2000, help='the evaluated nets of each search')
+    parser.add_argument('--seeds', type=str, default="0,1,2")
+    parser.add_argument('--target_score', type=float, default=None,
+                        help='the acc to reach, the lowest final acc of all the searches if None')
+    parser.add_argument('--cfg_options', nargs='+', action=DictAction,
+                        help='override the settings of the config as in nas/search.py')
+    args = parser.parse_args()
+    return args
+
+
+class CachedBuildNAS():
+    def __init__(self, model_nas):
+        """The model info of the same structure is evaluated once for all the searches, the scores without
+        the random inputs are the same, so only the evaluations requested by the search are counted."""
+        self.model_nas = model_nas
+        self.mutation = model_nas.mutation
+        self.mutation_batch = model_nas.mutation_batch
+        self.score_store = None
+        self.model_info_dict = {}
+
+
+    def get_info_for_evolution(self, structure_info):
+        structure_info = ArchSpec.from_list(structure_info)
+        if structure_info not in self.model_info_dict:
+            self.model_info_dict[structure_info] = self.model_nas.get_info_for_evolution(structure_info=structure_info)
+        return dict(self.model_info_dict[structure_info])
+
+
+def run_search(cfg, model_nas, masternet_info, logger, seed):
+    """Run the single-process search of nas/search.py, and get the best acc ever found after each job."""
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+    popu_nas = Population(cfg, logger)
+    popu_nas.set_genome_codec(GenomeCodec(masternet_info["structure_info"], max_layers=cfg.budget_layers))
+    for i in range(popu_nas.popu_size):
+        popu_nas.update_population(masternet_info)
+
+    offspring = None
+    if cfg.ea_crossover_ratio > 0 or cfg.ea_offspring_batch > 1:
+        offspring = OffspringGenerator(model_nas.mutation_batch, cfg, adjust_function=adjust_structures,
+                                valid_function=__check_block_structure_info_list_valid__)
+
+    max_iter = max(10, round(cfg.ea_sync_size_ratio * cfg.ea_popu_size) // 10)
+    best_acc_list = []
+    while popu_nas.num_evaluated_nets_count < cfg.ea_num_random_nets:
+        popu_nas = do_main_job(popu_nas, model_nas, logger=logger, max_iter=max_iter, cfg=cfg,
+                               masternet_structure_info=masternet_info["structure_info"], offspring=offspring)
+        popu_nas.num_evaluated_nets_count += max_iter
+        best_acc = max(popu_nas.popu_acc_list)
+        best_acc_list += [max([best_acc] + best_acc_list[-1:])] * max_iter
+    return best_acc_list
+
+
+def main():
+    args = parse_args()
+    logger = logging.getLogger('benchmark_selection')
+    logging.basicConfig(level=logging.WARNING)
+    Config = load_py_module_from_path(args.config+":Config")
+    cfg = Config()
+    if args.cfg_options is not None:
+        cfg.merge(args.cfg_options)
+    cfg.config_check()
+    cfg.gpu, cfg.rank, cfg.world_size = None, 0, 1
+    cfg.ea_num_random_nets = args.num_nets
+
+    model_nas = CachedBuildNAS(BuildNAS(cfg, logger))
+    masternet_info = model_nas.model_nas.get_info_for_evolution(structure_txt=cfg.space_structure_txt)
+    if not masternet_info["is_satify_budget"]:
+        raise ValueError("The initial network must meet the limit budget")
+
+    # the crossover ratio and the offspring batch are optional, the ones of the config by default
+    strategy_list = [tuple((x.split(":") + [str(cfg.ea_crossover_ratio), str(cfg.ea_offspring_batch)])[:4])
+                     for x in args.strategies.split(",")]
+    seed_list = [int(x) for x in args.seeds.split(",")]
+    results = {}
+    for strategy in strategy_list:
+        cfg.ea_selection, cfg.ea_survivor = strategy[:2]
+        cfg.ea_crossover_ratio, cfg.ea_offspring_batch = float(strategy[2]), int(strategy[3])
+        start_timer = time.time()
+        results[strategy] = [run_search(cfg, model_nas, masternet_info, logger, seed) for seed in seed_list]
+        print("%s done in %.1fs, %d structures evaluated so far"%(":".join(strategy),
+              time.time() - start_timer, len(model_nas.model_info_dict)))
+
+    target_score = args.target_score
+    if target_score is None:
+        target_score = min([x[-1] for best_acc_lists in results.values() for x in best_acc_lists])
+    headers = ["selection", "survivor", "crossover", "batch", "final_acc", "evals_to_target", "reached"]
+    table = []
+    for strategy, best_acc_lists in results.items():
+        # the evaluations to reach the target, the searches not reaching it are counted as num_nets
+        evals_list = [next((idx + 1 for idx, acc in enumerate(x) if acc >= target_score), len(x)) for x in best_acc_lists]
+        reached = sum([1 for x in best_acc_lists if x[-1] >= target_score])
+        table.append(list(strategy) + ["%.4g"%(np.mean([x[-1] for x in best_acc_lists])),
+                      "%d"%(np.mean(evals_list)), "%d/%d"%(reached, len(best_acc_lists))])
+    print("target_score=%.4g, %d seeds, %d nets"%(target_score, len(seed_list), args.num_nets))
+    print(tabulate(table, headers=headers, disable_numparse=True, colalign=["right"]*len(headers)))
+
+
+if __name__ == '__main__':
+    main()
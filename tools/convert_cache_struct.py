@@ -7,6 +7,7 @@ import ast, argparse, copy
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from configs import save_pyobj
+from nas.evolutions import ArchSpec, load_population
 
 
 def parse_args():
@@ -43,8 +44,8 @@ def write_structure_info(structure_info, structure_txt, suffix):
 
 def main():
     args = parse_args()
-    dict_info = load_pyobj(args.filename)
-    structure_info = dict_info["popu_structure_list"][args.idx]
+    dict_info = load_population(args.filename)
+    structure_info = ArchSpec.from_list(dict_info["popu_structure_list"][args.idx]).to_list()
     print(structure_info)
     structure_txt = os.path.join(os.path.dirname(args.filename), "best_structure.txt")
     save_pyobj(structure_txt, structure_info)
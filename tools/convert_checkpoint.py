@@ -0,0 +1,40 @@
+# Copyright (c) 2021-2022 Alibaba Group Holding Limited.
+
+import os,sys
+import time
+import argparse
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from nas.evolutions import convert_population, load_population
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Convert the txt snapshots of nas_cache into the npz checkpoints, or back')
+    parser.add_argument('filenames', nargs='+', help='iter*.txt to npz, or *.npz to txt')
+    parser.add_argument('--max_layers', type=int, default=None, help='budget_layers of the search, for the nbits lists')
+    parser.add_argument('--output_dir', type=str, default=None, help='the same dir as the input if None')
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = parse_args()
+    for filename in args.filenames:
+        base_filename, ext = os.path.splitext(filename)
+        output_filename = base_filename + (".txt" if ext == ".npz" else ".npz")
+        if args.output_dir is not None:
+            output_filename = os.path.join(args.output_dir, os.path.basename(output_filename))
+        start_time = time.time()
+        convert_population(filename, output_filename, max_layers=args.max_layers)
+        convert_time = time.time() - start_time
+        start_time = time.time()
+        popu_nas_info = load_population(output_filename)
+        load_time = time.time() - start_time
+        print('%s -> %s: %d individuals, %.1f KB -> %.1f KB, convert %.3fs, load %.3fs'%(filename, output_filename,
+            len(popu_nas_info["popu_structure_list"]), os.path.getsize(filename)/1024,
+            os.path.getsize(output_filename)/1024, convert_time, load_time))
+
+
+if __name__ == '__main__':
+    main()
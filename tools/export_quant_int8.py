@@ -0,0 +1,60 @@
+# Copyright (c) 2021-2022 Alibaba Group Holding Limited.
+
+import os,sys
+import argparse
+import torch
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nas.models.masternet import MasterNet, load_model
+from nas.models.quant_export import convert_to_int8
+from latency import GetRobustLatencyMeanStdCPU
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Export the mixed-precision masternet to a torch.ao int8 model')
+    parser.add_argument('--structure_txt', type=str, required=True, help='structure txt with nbitsA/nbitsW')
+    parser.add_argument('--checkpoint', type=str, default=None, help='trained QConv2d checkpoint')
+    parser.add_argument('--num_classes', type=int, default=1000)
+    parser.add_argument('--backend', type=str, default='fbgemm', help='fbgemm for x86, qnnpack for arm')
+    parser.add_argument('--resolution', type=int, default=224)
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--calib_num', type=int, default=8, help='number of random batches for calibration')
+    parser.add_argument('--num_threads', type=int, default=None)
+    parser.add_argument('--save', type=str, default=None, help='save the int8 model by torch.jit')
+    args = parser.parse_args()
+    return args
+
+
+def main():
+    args = parse_args()
+    model = MasterNet(num_classes=args.num_classes, structure_txt=args.structure_txt, classfication=True)
+    if not model.quant:
+        raise ValueError("the structure %s has no nbitsA/nbitsW"%(args.structure_txt))
+    if args.checkpoint is not None:
+        load_model(model, args.checkpoint, strict_load=False)
+    model.eval()
+
+    # random data only aligns the speed, use real images for the calibration of trained models
+    calib_data = [torch.randn(args.batch_size, 3, args.resolution, args.resolution) for _ in range(args.calib_num)]
+    int8_model = convert_to_int8(model, calib_data, backend=args.backend)
+
+    with torch.no_grad():
+        fake_output, int8_output = model(calib_data[0]), int8_model(calib_data[0])
+    print('max abs diff between fake-quant and int8 outputs: %.6f'%((fake_output-int8_output).abs().max().item()))
+
+    benchmark = GetRobustLatencyMeanStdCPU(args.batch_size, args.resolution, num_threads=args.num_threads)
+    fake_latency, fake_std = benchmark(model)
+    int8_latency, int8_std = benchmark(int8_model)
+    print('fake-quant float: %.3f ms/img (std %.3f), %.1f img/s'%(fake_latency*1000, fake_std*1000, 1/fake_latency))
+    print('%s int8: %.3f ms/img (std %.3f), %.1f img/s'%(args.backend, int8_latency*1000, int8_std*1000, 1/int8_latency))
+    print('speedup: %.2fx'%(fake_latency/int8_latency))
+
+    if args.save is not None:
+        torch.jit.save(torch.jit.trace(int8_model, calib_data[0]), args.save)
+        print('save the int8 model to %s'%(args.save))
+
+
+if __name__ == '__main__':
+    main()
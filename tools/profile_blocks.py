@@ -0,0 +1,78 @@
+# Copyright (c) 2021-2022 Alibaba Group Holding Limited.
+
+import os,sys
+import argparse
+import logging
+import torch
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from nas.models.masternet import MasterNet, load_model
+from nas.models.blocks import ConvKXBN
+from latency import OpProfiler, BlockProfiler
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Profile the latency and memory of every block in the masternet')
+    parser.add_argument('--structure_txt', type=str, required=True)
+    parser.add_argument('--checkpoint', type=str, default=None)
+    parser.add_argument('--num_classes', type=int, default=1000)
+    parser.add_argument('--resolution', type=int, default=224)
+    parser.add_argument('--batch_size', type=int, default=1)
+    parser.add_argument('--repeat', type=int, default=10, help='the records are averaged over the repeats')
+    parser.add_argument('--gpu', type=int, default=None)
+    parser.add_argument('--fp16', action='store_true')
+    parser.add_argument('--lat_pred_device', type=str, default=None, help='compare with the predictor, such as V100')
+    parser.add_argument('--lat_date_type', type=str, default="FP16")
+    parser.add_argument('--work_dir', type=str, default="./profile")
+    args = parser.parse_args()
+    return args
+
+
+def get_predictions(model, args, logger):
+    # the predicted latency of every conv layer in ms for the batch
+    predictor = OpProfiler(device_name=args.lat_pred_device, date_type=args.lat_date_type, logger=logger)
+    net_params = model.get_params_for_trt(args.resolution)
+    layer_names = [name for name, module in model.get_profile_modules() if isinstance(module, ConvKXBN)]
+    if len(layer_names) != len(net_params):
+        raise ValueError("%d profiled layers do not match %d layers of the predictor"%(len(layer_names), len(net_params)))
+    cmp_ret, _ = predictor(net_params, [0]*len(net_params), args.batch_size)
+    return {name: ret[1] for name, ret in zip(layer_names, cmp_ret)}
+
+
+def main():
+    args = parse_args()
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger('Block Profiler')
+
+    model = MasterNet(num_classes=args.num_classes, structure_txt=args.structure_txt, classfication=True)
+    if args.checkpoint is not None:
+        load_model(model, args.checkpoint, strict_load=False)
+    model.eval()
+
+    the_image = torch.randn(args.batch_size, 3, args.resolution, args.resolution)
+    if args.gpu is not None:
+        torch.cuda.set_device(args.gpu)
+        model, the_image = model.cuda(args.gpu), the_image.cuda(args.gpu)
+        if args.fp16: model, the_image = model.half(), the_image.half()
+
+    with torch.no_grad():
+        model(the_image) # warmup
+        with BlockProfiler(model) as profiler:
+            for repeat_count in range(args.repeat):
+                model(the_image)
+
+    predictions = get_predictions(model, args, logger) if args.lat_pred_device is not None else None
+    table = profiler.get_table(predictions)
+    logger.info("\n%s"%(table))
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    with open(os.path.join(args.work_dir, "block_profile.txt"), 'w') as fid:
+        fid.write(table + "\n")
+    profiler.save_chrome_trace(os.path.join(args.work_dir, "block_profile_trace.json"))
+    logger.info("save the table and the chrome trace to %s"%(args.work_dir))
+
+
+if __name__ == '__main__':
+    main()